@@ -15,6 +15,9 @@ export const getFileNames = (useTestData = false) => {
     operatingConditionsFullFilename: `operating_conditions_full${
       process.env.DATA_VERSION_ID || ""
     }${useTestData ? "_test" : ""}.csv`,
+    aggregatesFilename: `box_plot_aggregates${
+      process.env.DATA_VERSION_ID || ""
+    }${useTestData ? "_test" : ""}.csv`,
   };
 };
 
@@ -69,3 +72,17 @@ export const loadData = async (useTestData = false) => {
   }
   return { trialData, operatingConditions, operatingConditionsFull };
 };
+
+// Box plots precomputed by the pipeline for the default filters
+// (scripts/aggregates.py)
+export const loadAggregates = async (useTestData = false) => {
+  const { aggregatesFilename } = getFileNames(useTestData);
+  if (dataSource === "local") {
+    return await fetchLocalData(
+      path.join(process.cwd(), "data", aggregatesFilename)
+    );
+  } else if (dataSource === "google") {
+    return await fetchCloudData(aggregatesFilename, bucketName);
+  }
+  throw new Error("Invalid data source specified");
+};
@@ -5,7 +5,7 @@ import {
   temperatureFilterDict,
   trialDurationDict,
 } from "@/lib/constants";
-import { loadData } from "./constants";
+import { loadAggregates, loadData } from "./constants";
 
 const calculateQuartiles = (data, key) => {
   const sorted = data.map((d) => parseFloat(d[key])).sort((a, b) => a - b);
@@ -90,6 +90,78 @@ const getIntersectingTrialIDs = (...sets) => {
   return new Set(intersection);
 };
 
+const selectsAll = (filters) =>
+  filters.some((filter) => filter.includes("All"));
+
+// Precomputed box plots cover every material, format, brand and operating
+// condition, for all technologies or a single one. Returns null for other
+// filters, or if the precomputed box plots can't be loaded.
+const lookupAggregates = async (
+  {
+    aggCol,
+    displayCol,
+    uncapResults,
+    displayResiduals,
+    testMethod,
+    timepoint,
+    technologies,
+    itemFilters,
+    conditionFilters,
+  },
+  useTestData
+) => {
+  const coversFilters =
+    technologies.length === 1 &&
+    itemFilters.every(selectsAll) &&
+    conditionFilters.every(
+      ([filters, filterDict]) =>
+        filters.length === Object.keys(filterDict).length
+    );
+  if (!coversFilters) {
+    return null;
+  }
+  const technology = selectsAll(technologies) ? "All" : technologies[0];
+
+  let aggregates;
+  try {
+    aggregates = await loadAggregates(useTestData);
+  } catch (error) {
+    return null;
+  }
+  const rows = aggregates.filter(
+    (row) =>
+      row["Test Method"] === testMethod &&
+      row["Timepoint"] === timepoint &&
+      row["Technology"] === technology &&
+      row["Display Column"] === displayCol &&
+      row["Aggregation Column"] === aggCol &&
+      row["Uncapped"] === (uncapResults ? "True" : "False") &&
+      row["Display Residuals"] === (displayResiduals ? "True" : "False")
+  );
+  // Requests with too few trials to display aren't precomputed
+  if (rows.length === 0) {
+    return null;
+  }
+  return {
+    data: rows.map((row) => ({
+      aggCol: row["aggCol"],
+      count: parseInt(row["count"]),
+      "Material Class I": row["Material Class I"],
+      lowerfence: parseFloat(row["lowerfence"]),
+      q1: parseFloat(row["q1"]),
+      median: parseFloat(row["median"]),
+      mean: parseFloat(row["mean"]),
+      q3: parseFloat(row["q3"]),
+      upperfence: parseFloat(row["upperfence"]),
+      max: parseFloat(row["max"]),
+      min: parseFloat(row["min"]),
+      outliers: JSON.parse(row["outliers"]),
+      color: class2color[row["Material Class I"]],
+    })),
+    numTrials: parseInt(rows[0]["numTrials"]),
+  };
+};
+
 export const prepareData = async (searchParams, useTestData=false) => {
   // Display params
   const aggCol = searchParams.get("aggcol") || "Material Class I";
@@ -143,6 +215,28 @@ export const prepareData = async (searchParams, useTestData=false) => {
     };
   }
 
+  const aggregated = await lookupAggregates(
+    {
+      aggCol,
+      displayCol,
+      uncapResults,
+      displayResiduals,
+      testMethod,
+      timepoint,
+      technologies,
+      itemFilters: [materials, specificMaterials, formats, brands],
+      conditionFilters: [
+        [moistureFilter, moistureFilterDict],
+        [temperatureFilter, temperatureFilterDict],
+        [trialDurations, trialDurationDict],
+      ],
+    },
+    useTestData
+  );
+  if (aggregated) {
+    return aggregated;
+  }
+
   let { trialData, operatingConditions } = await loadData(useTestData);
   var filteredData = [...trialData];
 
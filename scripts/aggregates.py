@@ -0,0 +1,247 @@
+"""Precomputes the box plot statistics shown on the dashboard.
+
+The dashboard API (prepareData in dashboard/app/api/utils.js) filters the
+processed trials and computes quartiles, fences and outliers on every
+request. This module computes the same statistics once per run for the
+default dashboard filters, for every test method, timepoint and single
+technology (or all technologies), so common requests can be served from a
+small table.
+"""
+import json
+from typing import List
+
+import numpy as np
+import pandas as pd
+from constants import (
+    AGGREGATE_GROUP_COLS,
+    AGGREGATE_VALUE_COLS,
+    MATERIAL_CLASS_I_ORDER,
+    MIN_TRIALS_FOR_DISPLAY,
+)
+
+ALL_TECHNOLOGIES = "All"
+FILTER_COLS = ["Test Method", "Timepoint", "Technology"]
+REQUEST_COLS = FILTER_COLS + [
+    "Display Column",
+    "Aggregation Column",
+    "Uncapped",
+    "Display Residuals",
+]
+# Fields of each box in a dashboard response
+BOX_COLS = [
+    "aggCol",
+    "count",
+    "Material Class I",
+    "lowerfence",
+    "q1",
+    "median",
+    "mean",
+    "q3",
+    "upperfence",
+    "max",
+    "min",
+    "outliers",
+]
+STAT_COLS = BOX_COLS + ["numTrials"]
+# Boxes are ordered by Material Class I, with unlisted classes first
+CLASS_ORDER = {
+    material_class: i for i, material_class in enumerate(MATERIAL_CLASS_I_ORDER)
+}
+
+
+def _round_half_up(values: pd.Series, decimals: int) -> pd.Series:
+    """Rounds like Math.round in JavaScript, so .5 always rounds up."""
+    scale = 10**decimals
+    return np.floor(values * scale + 0.5) / scale
+
+
+def display_values(
+    values: pd.Series, uncapped: bool, display_residuals: bool
+) -> pd.Series:
+    """Transforms residuals the way the dashboard displays them.
+
+    >>> values = pd.Series([0.25, 1.5])
+    >>> display_values(values, uncapped=False, display_residuals=False).tolist()
+    [0.75, 0.0]
+    >>> display_values(values, uncapped=True, display_residuals=True).tolist()
+    [0.25, 1.5]
+
+    Args:
+        values: Fraction of each item remaining.
+        uncapped: Whether to show residuals over 100%.
+        display_residuals: Whether to show residuals rather than the
+            fraction disintegrated.
+
+    Returns:
+        The displayed values.
+    """
+    if not uncapped:
+        values = values.clip(upper=1)
+    if not display_residuals:
+        values = (1 - values).clip(lower=0)
+    return values
+
+
+def class_rank(classes: pd.Series) -> pd.Series:
+    """Returns the position of each Material Class I in the box order.
+
+    >>> class_rank(pd.Series(["Fiber", "Biopolymer", "Other"])).tolist()
+    [0.0, 1.0, -1.0]
+
+    Args:
+        classes: Material Class I of each box.
+
+    Returns:
+        The rank of each class in MATERIAL_CLASS_I_ORDER, or -1 for
+        classes that aren't in it.
+    """
+    return classes.map(CLASS_ORDER).fillna(-1)
+
+
+def box_plot_stats(data: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    """Computes box plot statistics of the Value column for each group.
+
+    Matches calculateQuartiles in the dashboard API: quartiles are linearly
+    interpolated (as d3.quantile), fences are 1.5 IQR from the quartiles,
+    clamped to the range of the data, and the median and mean are rounded
+    to 3 decimal places.
+
+    >>> data = pd.DataFrame({"g": ["a"] * 5, "Value": [0.1, 0.2, 0.3, 0.4, 2.0]})
+    >>> stats = box_plot_stats(data, ["g"]).iloc[0]
+    >>> print(stats["q1"], stats["median"], stats["q3"], stats["outliers"])
+    0.2 0.3 0.4 [2.0]
+
+    Args:
+        data: Rows to summarize, with a Value column.
+        keys: Columns to group by.
+
+    Returns:
+        One row per group, in order of first appearance.
+    """
+    grouped = data.groupby(keys, sort=False, observed=True)["Value"]
+    stats = grouped.agg(count="size", mean="mean", max="max", min="min")
+    quartiles = grouped.quantile([0.25, 0.5, 0.75]).unstack()
+    stats["q1"] = quartiles[0.25]
+    stats["median"] = _round_half_up(quartiles[0.5], 3)
+    stats["q3"] = quartiles[0.75]
+    stats["mean"] = _round_half_up(stats["mean"], 3)
+    iqr = stats["q3"] - stats["q1"]
+    stats["lowerfence"] = np.maximum(stats["q1"] - 1.5 * iqr, stats["min"])
+    stats["upperfence"] = np.minimum(stats["q3"] + 1.5 * iqr, stats["max"])
+
+    fences = stats[["lowerfence", "upperfence"]].reset_index()
+    rows = data[keys + ["Value"]].merge(fences, on=keys, how="left")
+    outliers = (
+        rows[
+            (rows["Value"] > rows["upperfence"])
+            | (rows["Value"] < rows["lowerfence"])
+        ]
+        .sort_values("Value", kind="stable")
+        .groupby(keys, sort=False, observed=True)["Value"]
+        .agg(lambda v: json.dumps(v.tolist()))
+    )
+    stats["outliers"] = outliers.reindex(stats.index).fillna("[]")
+    return stats.reset_index()
+
+
+def class_box_plot_stats(data: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    """Computes box plot statistics and the Material Class I of each group.
+
+    As in the dashboard, the first row of each group sets its class, which
+    the boxes are colored and ordered by.
+
+    Args:
+        data: Rows to summarize, with Value and material_class_i columns.
+        keys: Columns to group by.
+
+    Returns:
+        One row per group, in order of first appearance.
+    """
+    stats = box_plot_stats(data, keys)
+    stats["Material Class I"] = (
+        data.groupby(keys, sort=False, observed=True)["material_class_i"]
+        .first()
+        .to_numpy()
+    )
+    return stats
+
+
+def box_plot_aggregates(all_trials: pd.DataFrame) -> pd.DataFrame:
+    """Precomputes box plot statistics for the dashboard.
+
+    Statistics are computed for every combination of test method,
+    timepoint, technology (each one, and all together), displayed column,
+    grouping column and display options. Combinations with fewer than
+    MIN_TRIALS_FOR_DISPLAY trials are left out, except for bulk dose
+    trials, as the dashboard hides them to preserve privacy.
+
+    Args:
+        all_trials: Processed trial data.
+
+    Returns:
+        One row per box. Rows for the same request are ordered as the
+        dashboard orders boxes, by Material Class I.
+    """
+    # Group keys are strings, like the values the dashboard reads from the
+    # CSV, where missing values are empty
+    trials = all_trials.assign(
+        **{
+            col: all_trials[col].astype(object).fillna("").astype(str)
+            for col in dict.fromkeys(AGGREGATE_GROUP_COLS + FILTER_COLS)
+        }
+    )
+    scopes = [
+        trials,
+        trials.assign(Technology=ALL_TECHNOLOGIES),
+    ]
+
+    tables = []
+    for value_col in AGGREGATE_VALUE_COLS:
+        for scope in scopes:
+            rows = scope[scope[value_col].notna()]
+            trial_counts = (
+                rows.groupby(FILTER_COLS, sort=False)["Trial ID"]
+                .nunique()
+                .rename("numTrials")
+                .reset_index()
+            )
+            trial_counts = trial_counts[
+                (trial_counts["numTrials"] >= MIN_TRIALS_FOR_DISPLAY)
+                | (trial_counts["Test Method"] == "Bulk Dose")
+            ]
+            rows = rows.merge(
+                trial_counts[FILTER_COLS], on=FILTER_COLS, how="inner"
+            )
+            if rows.empty:
+                continue
+            for agg_col in AGGREGATE_GROUP_COLS:
+                for uncapped in [False, True]:
+                    for display_residuals in [False, True]:
+                        data = rows[FILTER_COLS].assign(
+                            aggCol=rows[agg_col],
+                            Value=display_values(
+                                rows[value_col], uncapped, display_residuals
+                            ),
+                            material_class_i=rows["Material Class I"],
+                        )
+                        stats = class_box_plot_stats(
+                            data, FILTER_COLS + ["aggCol"]
+                        )
+                        tables.append(
+                            stats.assign(
+                                **{
+                                    "Display Column": value_col,
+                                    "Aggregation Column": agg_col,
+                                    "Uncapped": uncapped,
+                                    "Display Residuals": display_residuals,
+                                }
+                            ).merge(trial_counts, on=FILTER_COLS)
+                        )
+
+    if not tables:
+        return pd.DataFrame(columns=REQUEST_COLS + STAT_COLS)
+    aggregates = pd.concat(tables, ignore_index=True)
+    aggregates["class_rank"] = class_rank(aggregates["Material Class I"])
+    return aggregates.sort_values(REQUEST_COLS + ["class_rank"], kind="stable")[
+        REQUEST_COLS + STAT_COLS
+    ].reset_index(drop=True)
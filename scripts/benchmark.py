@@ -0,0 +1,364 @@
+"""Benchmarks the pipeline against synthetic CFTP-shaped data.
+
+For each scale, synthetic inputs are generated with synthetic_data, then
+each trial pipeline is timed on its own, the cleaning of the combined
+trials is timed and its peak memory measured, and main() is timed end to
+end with a cold and a warm worksheet cache. Results are printed and
+written to a CSV so runs can be compared across commits. Pass a previous
+results CSV as --baseline to fail if peak memory has grown.
+
+Usage:
+    python scripts/benchmark.py --scales 1 10 100
+    python scripts/benchmark.py --baseline data/benchmark_results.csv
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Dict, List, Optional, Sequence
+
+import pandas as pd
+from constants import CURRENT_DIR, DATA_DIR, PIPELINE_BACKEND
+from runner import BACKENDS
+from schema import concat_tables
+from synthetic_data import generate_synthetic_data
+from utils import clear_default_dfs, get_default_dfs
+from workbooks import (
+    cache_settings,
+    clear_cache,
+    close_workbooks,
+    configure_cache,
+)
+
+BenchmarkRecord = Dict[str, Any]
+
+# Peak memory may grow by this fraction of the baseline before it is
+# reported as a regression
+PEAK_MEMORY_TOLERANCE = 0.1
+
+
+def load_run_pipeline() -> ModuleType:
+    """Imports run-pipeline.py, whose name is not a valid module name.
+
+    Returns:
+        The run-pipeline module.
+    """
+    spec = importlib.util.spec_from_file_location(
+        "run_pipeline", CURRENT_DIR / "run-pipeline.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def benchmark_pipelines(
+    run_pipeline: ModuleType,
+    data_sheet_paths: Dict[str, Path],
+    trial_data_paths: Dict[str, Path],
+) -> List[BenchmarkRecord]:
+    """Times each trial pipeline on its own, parsing its inputs from scratch.
+
+    The pipeline outputs are then combined and cleaned by clean_trials, and
+    the peak memory of cleaning is measured. Both run under copy-on-write,
+    as they do in main().
+
+    Args:
+        run_pipeline: The run-pipeline module.
+        data_sheet_paths: Paths to the reference data files.
+        trial_data_paths: Paths to the trial data files.
+
+    Returns:
+        One record per pipeline, then one for cleaning.
+    """
+    with pd.option_context("mode.copy_on_write", True):
+        records = []
+        trial_results = []
+        settings = cache_settings()
+        configure_cache(enabled=False)
+        try:
+            default_dfs = get_default_dfs(data_sheet_paths)
+            for pipeline in run_pipeline.get_trials_to_run(
+                trial_data_paths, default_dfs
+            ):
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    data = pipeline.run(profile_memory=True)
+                seconds = time.perf_counter() - start
+                records.append(
+                    {
+                        "benchmark": "pipeline",
+                        "name": f"{type(pipeline).__name__}:{pipeline.trial_name}",
+                        "seconds": seconds,
+                        "peak_memory_mb": max(
+                            record["peak_memory_mb"]
+                            for record in pipeline.stage_report
+                        ),
+                        "rows": len(data),
+                    }
+                )
+                trial_results.append(data)
+            close_workbooks()
+        finally:
+            configure_cache(**settings)
+        records.append(
+            benchmark_clean_trials(
+                run_pipeline,
+                concat_tables(trial_results),
+                default_dfs.brand_mapping,
+            )
+        )
+    return records
+
+
+def benchmark_clean_trials(
+    run_pipeline: ModuleType, all_trials: pd.DataFrame, brand_mapping: dict
+) -> BenchmarkRecord:
+    """Times clean_trials and measures its peak memory.
+
+    Peak memory is measured with tracemalloc, above the memory in use
+    before cleaning, so it counts the copies cleaning makes.
+
+    Args:
+        run_pipeline: The run-pipeline module.
+        all_trials: Combined output of the trial pipelines.
+        brand_mapping: Mapping of brand names to anonymized brands.
+
+    Returns:
+        The benchmark record.
+    """
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        memory_before, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+        data, _ = run_pipeline.clean_trials(all_trials, brand_mapping)
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+    return {
+        "benchmark": "clean_trials",
+        "name": "clean_trials",
+        "seconds": seconds,
+        "peak_memory_mb": (peak - memory_before) / 2**20,
+        "rows": len(data),
+    }
+
+
+def benchmark_main(
+    run_pipeline: ModuleType,
+    data_sheet_paths: Dict[str, Path],
+    trial_data_paths: Dict[str, Path],
+    output_dir: Path,
+    backend: str = PIPELINE_BACKEND,
+    max_workers: Optional[int] = None,
+) -> List[BenchmarkRecord]:
+    """Times main() end to end with a cold and then a warm worksheet cache.
+
+    Args:
+        run_pipeline: The run-pipeline module.
+        data_sheet_paths: Paths to the reference data files.
+        trial_data_paths: Paths to the trial data files.
+        output_dir: Directory for the worksheet cache and outputs.
+        backend: Runner backend. Defaults to PIPELINE_BACKEND.
+        max_workers: Number of concurrent pipelines. Defaults to None.
+
+    Returns:
+        One record for the cold run and one for the warm run.
+    """
+    cache_dir = output_dir / ".cache"
+    settings = cache_settings()
+    configure_cache(cache_dir=cache_dir)
+    clear_cache(cache_dir)
+    records = []
+    try:
+        for cache_state in ["cold", "warm"]:
+            # Reference data is shared within a process, so reload it to
+            # measure a fresh run
+            clear_default_dfs()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                run_pipeline.main(
+                    max_workers=max_workers,
+                    backend=backend,
+                    output_dirs=[output_dir],
+                    trial_data_paths=trial_data_paths,
+                    data_sheet_paths=data_sheet_paths,
+                )
+            seconds = time.perf_counter() - start
+            records.append(
+                {
+                    "benchmark": "main",
+                    "name": f"main:{backend}:{cache_state} cache",
+                    "seconds": seconds,
+                    "peak_memory_mb": None,
+                    "rows": len(
+                        pd.read_csv(output_dir / "all_trials_processed.csv")
+                    ),
+                }
+            )
+    finally:
+        configure_cache(**settings)
+    return records
+
+
+def run_benchmarks(
+    scales: Sequence[int],
+    item_scale: Optional[int] = None,
+    work_dir: Optional[Path] = None,
+    backend: str = PIPELINE_BACKEND,
+    max_workers: Optional[int] = None,
+) -> pd.DataFrame:
+    """Generates synthetic data at each scale and benchmarks the pipeline.
+
+    Args:
+        scales: Trial scale factors to benchmark.
+        item_scale: Item scale factor. Defaults to the trial scale.
+        work_dir: Directory for the synthetic data and outputs. Defaults to
+            a temporary directory that is removed afterwards.
+        backend: Runner backend for main(). Defaults to PIPELINE_BACKEND.
+        max_workers: Number of concurrent pipelines. Defaults to None.
+
+    Returns:
+        One row per benchmark per scale.
+    """
+    run_pipeline = load_run_pipeline()
+    records = []
+    with contextlib.ExitStack() as stack:
+        if work_dir is None:
+            work_dir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        for scale in scales:
+            scale_dir = Path(work_dir) / f"scale_{scale}"
+            data_sheet_paths, trial_data_paths = generate_synthetic_data(
+                scale_dir,
+                trial_scale=scale,
+                item_scale=scale if item_scale is None else item_scale,
+            )
+            scale_records = benchmark_pipelines(
+                run_pipeline, data_sheet_paths, trial_data_paths
+            ) + benchmark_main(
+                run_pipeline,
+                data_sheet_paths,
+                trial_data_paths,
+                scale_dir,
+                backend=backend,
+                max_workers=max_workers,
+            )
+            records.extend(
+                record | {"scale": scale} for record in scale_records
+            )
+    return pd.DataFrame(
+        records,
+        columns=[
+            "scale",
+            "benchmark",
+            "name",
+            "seconds",
+            "peak_memory_mb",
+            "rows",
+        ],
+    )
+
+
+def peak_memory_regressions(
+    results: pd.DataFrame,
+    baseline: pd.DataFrame,
+    tolerance: float = PEAK_MEMORY_TOLERANCE,
+) -> pd.DataFrame:
+    """Finds benchmarks whose peak memory grew since a baseline run.
+
+    >>> baseline = pd.DataFrame(
+    ...     {"scale": [1, 1], "name": ["a", "b"], "peak_memory_mb": [10, 10]}
+    ... )
+    >>> results = baseline.assign(peak_memory_mb=[10.5, 12])
+    >>> peak_memory_regressions(results, baseline)["name"].tolist()
+    ['b']
+
+    Args:
+        results: Benchmark results.
+        baseline: Results of an earlier run to compare with.
+        tolerance: Fraction of the baseline peak memory a benchmark may
+            grow by. Defaults to PEAK_MEMORY_TOLERANCE.
+
+    Returns:
+        The scale, name and baseline and current peak memory of each
+        benchmark over the tolerance. Benchmarks missing from either run,
+        or without a peak memory, are ignored.
+    """
+    keys = ["scale", "name"]
+    compared = results[keys + ["peak_memory_mb"]].merge(
+        baseline[keys + ["peak_memory_mb"]],
+        on=keys,
+        suffixes=("", "_baseline"),
+    )
+    return compared[
+        compared["peak_memory_mb"]
+        > compared["peak_memory_mb_baseline"] * (1 + tolerance)
+    ].reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline against synthetic data"
+    )
+    parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="+",
+        default=[1, 10],
+        help="Trial scale factors to benchmark",
+    )
+    parser.add_argument(
+        "--item-scale",
+        type=int,
+        help="Item scale factor (defaults to each trial scale)",
+    )
+    parser.add_argument(
+        "--work-dir",
+        type=Path,
+        help="Keep the synthetic data and outputs in this directory",
+    )
+    parser.add_argument("--backend", choices=BACKENDS, default=PIPELINE_BACKEND)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=DATA_DIR / "benchmark_results.csv",
+        help="Where to write the results",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        help="Results of an earlier run; exit with an error if any peak "
+        "memory has grown by more than PEAK_MEMORY_TOLERANCE",
+    )
+    args = parser.parse_args()
+    # Read before the results may overwrite it
+    baseline = None if args.baseline is None else pd.read_csv(args.baseline)
+    results = run_benchmarks(
+        args.scales,
+        item_scale=args.item_scale,
+        work_dir=args.work_dir,
+        backend=args.backend,
+        max_workers=args.workers,
+    )
+    print(results.to_string(index=False))
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    results.to_csv(args.output, index=False)
+    print(f"Saved to {args.output}")
+    if baseline is not None:
+        regressions = peak_memory_regressions(results, baseline)
+        if not regressions.empty:
+            print("Peak memory has grown since the baseline:")
+            print(regressions.to_string(index=False))
+            sys.exit(1)
+        print(f"No peak memory regressions since {args.baseline}")
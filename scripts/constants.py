@@ -1,9 +1,29 @@
 from pathlib import Path
 
 USE_LEGACY_DATA_FORMATS = True  # Or False
+# Trial pipelines run concurrently. None uses one worker per CPU.
+PIPELINE_WORKERS = None
+PIPELINE_BACKEND = "process"  # Or "thread" or "serial"
 CURRENT_DIR = Path(__file__).resolve().parent
 DATA_DIR = CURRENT_DIR / "../data/"
 APP_DATA_DIR = CURRENT_DIR / "../dashboard/data/"
+# Processed outputs are written once and published to each of these
+OUTPUT_DIRS = [APP_DATA_DIR, DATA_DIR]
+# Any of "csv", "parquet" and "arrow". The dashboard reads the CSVs.
+OUTPUT_FORMATS = ["csv"]
+# Parsed worksheets are cached here, keyed on the source file's content
+USE_WORKBOOK_CACHE = True
+WORKBOOK_CACHE_DIR = DATA_DIR / ".cache"
+# The least recently used entries are removed once the cache is larger
+WORKBOOK_CACHE_MAX_BYTES = 1 << 30
+# Item descriptions that do not match exactly are suggested a match with
+# the most similar known description, if the trigram similarity is at
+# least this. Suggestions are only applied once accepted in the cache file.
+ITEM_MATCH_THRESHOLD = 0.8
+ITEM_MATCH_CACHE_PATH = DATA_DIR / "item_matches.json"
+# Rows of the standardized template CSV read and preprocessed at a time.
+# None reads the whole file at once.
+NEW_TEMPLATE_CHUNK_SIZE = 50_000
 
 # TODO: Can also keep bags, etc if we want them
 TRIAL_COLS = [
@@ -22,6 +42,64 @@ TRIAL_COLS = [
     "% Residuals (Mass)",
     "% Residuals (Area)",
 ]
+# Output schema of every trial pipeline. Repetitive text columns are
+# categorical and missing residuals are NaN.
+TRIAL_COL_DTYPES = {
+    "Trial ID": "category",
+    "Test Method": "category",
+    "Item ID": "object",
+    "Item Format": "category",
+    "Item Brand": "category",
+    "Item Name": "object",
+    "Item Description Refined": "object",
+    "Material Class I": "category",
+    "Material Class II": "category",
+    "Material Class III": "category",
+    "% Residuals (Mass)": "float64",
+    "% Residuals (Area)": "float64",
+}
+
+# Columns of the standardized template CSV are read as text. Residuals are
+# entered as percentages like "42.5%" or "no data" and parsed later.
+NEW_TEMPLATE_DTYPES = {
+    "Trial": str,
+    "Item Name": str,
+    "% Residuals (Dry Weight)": str,
+    "% Residuals (Wet Weight)": str,
+    "% Residuals (Area)": str,
+}
+
+# Files in a submissions directory that are read as new template trials
+SUBMISSION_PATTERN = "*.csv"
+
+# Repetitive text columns that are dictionary encoded in columnar outputs
+CATEGORICAL_OUTPUT_COLS = [
+    "Trial ID",
+    "Test Method",
+    "Technology",
+    "Timepoint",
+    "Item Format",
+    "Item Brand",
+    "Material Class I",
+    "Material Class II",
+    "Material Class III",
+    "Operating Condition",
+    "Time Unit",
+]
+
+# Processed tables can also be loaded into a SQLite database, with an index
+# on each column the dashboard filters by
+STORE_PATH = DATA_DIR / "cftp.sqlite"
+STORE_INDEX_COLS = [
+    "Trial ID",
+    "Test Method",
+    "Technology",
+    "Timepoint",
+    "Material Class II",
+    "Material Class III",
+    "Item Format",
+    "Item Brand",
+]
 
 TRIAL_TO_ID_MAP = {
     "Facility 1 (Windrow)": "WR004-01",
@@ -46,6 +124,54 @@ TRIAL_TO_ID_MAP = {
     "Facility 10": "WR005-01",
 }
 
+# Sheets of the operating conditions workbook (OPERATING_CONDITIONS_PATH).
+# Each sheet has a time step column and one column per trial, headed with
+# the facility name from TRIAL_TO_ID_MAP (optionally marked with a "*").
+#   time_col: Column of time steps.
+#   time_unit: Unit of the time steps.
+#   numeric_steps_only: Drop rows whose time step is not a number.
+#   known_trials_only: Ignore columns that are not in TRIAL_TO_ID_MAP
+#       instead of raising an error.
+#   average_col: If set, the average of each trial is reported under this
+#       name, over the first average_steps rows (or all rows if None).
+OPERATING_CONDITION_SHEETS = {
+    "Temperature": {
+        "sheet_name": 3,
+        "skiprows": 1,
+        "time_col": "Time Step",
+        "time_unit": "Day",
+        "numeric_steps_only": False,
+        "known_trials_only": True,
+        "average_col": "Average Temperature (F)",
+        # ONLY USE THE FIRST 45 DAYS
+        "average_steps": 45,
+    },
+    "Moisture": {
+        "sheet_name": 4,
+        "skiprows": 1,
+        "time_col": "Week",
+        "time_unit": "Week",
+        "numeric_steps_only": True,
+        "known_trials_only": False,
+        "average_col": "Average % Moisture (In Field)",
+        "average_steps": None,
+    },
+    "Oxygen": {
+        "sheet_name": 6,
+        "skiprows": 1,
+        "time_col": "Week",
+        "time_unit": "Week",
+        "numeric_steps_only": True,
+        "known_trials_only": False,
+        "average_col": None,
+        "average_steps": None,
+    },
+}
+
+# Daily operating conditions are also averaged over these periods, in days.
+# Months are 30 day periods counted from the start of each trial.
+OPERATING_CONDITION_ROLLUPS = {"Week": 7, "Month": 30}
+
 OUTLIER_THRESHOLD = 10
 
 DATA_SHEET_PATHS = {
@@ -80,6 +206,52 @@ ID_TO_TECHNOLOGY_MAP = {
 
 EXCLUDED_TECHNOLOGIES = ["Anaerobic Digestion"]
 
+# Box plot statistics are precomputed for these dashboard options
+# (see prepareData in dashboard/app/api/utils.js)
+AGGREGATE_GROUP_COLS = [
+    "Material Class I",
+    "Material Class II",
+    "Material Class III",
+    "Item Format",
+]
+AGGREGATE_VALUE_COLS = ["% Residuals (Mass)", "% Residuals (Area)"]
+# Results are hidden unless they come from at least this many trials,
+# except for bulk dose trials
+MIN_TRIALS_FOR_DISPLAY = 3
+MATERIAL_CLASS_I_ORDER = [
+    "Fiber",
+    "Biopolymer",
+    "Mixed Materials",
+    "Positive Control",
+]
+
+# Operating condition filters of the dashboard (see lib/constants.js), as
+# (low, high, inclusive) ranges of each trial's average
+OPERATING_CONDITION_FILTERS = {
+    "Average % Moisture (In Field)": {
+        "<40%": (-float("inf"), 0.4, False),
+        "40-45%": (0.4, 0.45, True),
+        "45-50%": (0.45, 0.5, True),
+        "50-55%": (0.5, 0.55, True),
+        "55-60%": (0.55, 0.6, True),
+        ">60%": (0.6, float("inf"), False),
+    },
+    "Average Temperature (F)": {
+        "<140F": (-float("inf"), 140, False),
+        "140-150F": (140, 150, True),
+        "150-160F": (150, 160, True),
+        ">160F": (160, float("inf"), False),
+    },
+    "Trial Duration": {
+        "40-59 Days": (40, 59, True),
+        "60-90 Days": (59, 89, True),
+        "90+ Days": (89, float("inf"), False),
+    },
+}
+# Number of distinct queries whose results the query service keeps
+QUERY_CACHE_SIZE = 1024
+QUERY_SERVICE_PORT = 8000
+
 # CANONICAL_COLUMNS = {
 #   "TRIAL_DETAILS": {
 #     "Technology": "Technology",
@@ -0,0 +1,187 @@
+"""Finds and merges facility submissions in the new template format.
+
+Each facility submits its results as a CSV in the new template. Instead of
+adding a pipeline per file, a directory or glob of submissions is turned
+into one SubmissionPipeline per distinct file. The pipelines run with the
+other trials, and a submission that fails is skipped rather than stopping
+the run. A trial is taken from the first file it is in, so a corrected
+resubmission has to replace the file it corrects.
+"""
+import glob
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from constants import SUBMISSION_PATTERN
+from pipeline_template import AbstractDataPipeline, NewTemplatePipeline
+from schema import concat_tables
+from utils import DefaultDataFrames
+from workbooks import file_hash
+
+
+def discover_submissions(
+    source: str, pattern: str = SUBMISSION_PATTERN
+) -> List[Path]:
+    """Finds the submission files in a directory or matching a glob.
+
+    Pipeline outputs saved next to the submissions (*_clean.csv) are not
+    submissions, so they are left out.
+
+    Args:
+        source: Directory of submissions, or a glob such as
+            "data/submissions/*.csv".
+        pattern: Glob for submissions in a directory. Defaults to
+            SUBMISSION_PATTERN.
+
+    Returns:
+        The submission files, sorted by path.
+
+    Raises:
+        FileNotFoundError: If no submission files are found.
+    """
+    if Path(source).is_dir():
+        paths = Path(source).glob(pattern)
+    else:
+        paths = map(Path, glob.glob(source, recursive=True))
+    paths = [
+        path
+        for path in paths
+        if path.is_file() and not path.stem.endswith("_clean")
+    ]
+    if not paths:
+        raise FileNotFoundError(f"No submissions found in {source}")
+    return sorted(paths)
+
+
+class SubmissionPipeline(NewTemplatePipeline):
+    """Pipeline for a facility submission in the new template format.
+
+    Submissions are optional, so one that fails is skipped. A submission
+    file can hold trials of any technology, whatever its name, so the
+    technology filters are applied to its rows by Trial ID instead.
+    """
+
+    optional = True
+
+    @property
+    def technology(self) -> str:
+        """Always "Unknown", since a submission can hold several trials."""
+        return "Unknown"
+
+
+def submission_pipelines(
+    paths: Sequence[Path],
+    default_dfs: Optional[DefaultDataFrames] = None,
+    exclude: Iterable[Optional[Path]] = (),
+) -> List[SubmissionPipeline]:
+    """Builds a pipeline for each distinct submission file.
+
+    Files with the same contents as an earlier file, or as a file in
+    exclude, are skipped, so a submission that is copied twice is only
+    read once.
+
+    Args:
+        paths: Submission files.
+        default_dfs: Reference data shared by the pipelines. Defaults to
+            None.
+        exclude: Files that are already processed, eg NEW_TEMPLATE_PATH.
+            Missing files are ignored. Defaults to ().
+
+    Returns:
+        One pipeline per distinct submission, named after its file.
+    """
+    seen = {
+        file_hash(path)
+        for path in exclude
+        if path is not None and Path(path).is_file()
+    }
+    pipelines = []
+    for path in paths:
+        digest = file_hash(path)
+        if digest in seen:
+            print(f"Skipping duplicate submission {path}")
+            continue
+        seen.add(digest)
+        pipelines.append(
+            SubmissionPipeline(
+                Path(path), trial_name=Path(path).stem, default_dfs=default_dfs
+            )
+        )
+    return pipelines
+
+
+def _same_rows(rows: pd.DataFrame, other: pd.DataFrame) -> bool:
+    """Whether two tables have the same columns and rows, in any row order.
+
+    >>> rows = pd.DataFrame({"Trial ID": ["A", "A"], "Value": [1, 2]})
+    >>> _same_rows(rows, rows.iloc[::-1])
+    True
+    >>> _same_rows(rows, rows.iloc[:1])
+    False
+    """
+    if list(rows.columns) != list(other.columns) or len(rows) != len(other):
+        return False
+    return np.array_equal(
+        np.sort(pd.util.hash_pandas_object(rows, index=False).to_numpy()),
+        np.sort(pd.util.hash_pandas_object(other, index=False).to_numpy()),
+    )
+
+
+def merge_trial_results(
+    pipelines: Sequence[AbstractDataPipeline],
+    results: Sequence[Optional[pd.DataFrame]],
+) -> pd.DataFrame:
+    """Combines pipeline outputs, taking each trial from one submission.
+
+    Outputs of failed pipelines (None) are left out. A trial ID is taken
+    from the first new template pipeline whose output has it, in pipeline
+    order, so the configured new template file comes before submissions
+    and submissions are in path order. Later copies of a trial are dropped:
+    silently if they have the same rows, and otherwise with a message
+    naming both files, like a submission that failed.
+
+    Args:
+        pipelines: Pipelines that were run.
+        results: Output of each pipeline, in the same order.
+
+    Returns:
+        The combined outputs, in pipeline order.
+
+    Raises:
+        ValueError: If no pipelines were selected, or every pipeline failed.
+    """
+    if not pipelines:
+        raise ValueError("No trials were selected, so there are no results")
+    ran = [
+        (pipeline, result)
+        for pipeline, result in zip(pipelines, results)
+        if result is not None
+    ]
+    if not ran:
+        raise ValueError("Every pipeline failed, so there are no results")
+    # File name and output of the submission each trial is taken from
+    first: Dict[str, Tuple[str, pd.DataFrame]] = {}
+    tables = []
+    for pipeline, result in ran:
+        if isinstance(pipeline, NewTemplatePipeline):
+            name = pipeline.data_filepath.name
+            dropped = []
+            for trial_id in result["Trial ID"].dropna().unique():
+                if trial_id not in first:
+                    first[trial_id] = (name, result)
+                    continue
+                dropped.append(trial_id)
+                first_name, first_result = first[trial_id]
+                if not _same_rows(
+                    result[result["Trial ID"] == trial_id],
+                    first_result[first_result["Trial ID"] == trial_id],
+                ):
+                    print(
+                        f"Skipping trial {trial_id!r} in {name}, which is "
+                        f"already in {first_name}"
+                    )
+            if dropped:
+                result = result[~result["Trial ID"].isin(dropped)]
+        tables.append(result)
+    return concat_tables(tables)
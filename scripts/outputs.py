@@ -0,0 +1,184 @@
+"""Writes processed tables to disk in CSV and columnar formats."""
+import io
+import os
+import shutil
+from pathlib import Path
+from typing import Optional, Sequence
+
+import pandas as pd
+from constants import CATEGORICAL_OUTPUT_COLS
+
+SUPPORTED_OUTPUT_FORMATS = ("csv", "parquet", "arrow")
+
+
+def to_columnar(
+    data: pd.DataFrame, index_label: Optional[str] = None
+) -> pd.DataFrame:
+    """Prepares a table for typed, columnar storage.
+
+    The index is written as a regular column so the schema matches the CSV
+    output, and repetitive text columns are dictionary encoded.
+
+    >>> df = pd.DataFrame({"Trial ID": ["A", "A", "B"], "x": [1.0, 2.0, 3.0]})
+    >>> str(to_columnar(df)["Trial ID"].dtype)
+    'category'
+
+    Args:
+        data: Table to prepare.
+        index_label: Name of the index column. If None, the index is
+            dropped. Defaults to None.
+
+    Returns:
+        The prepared table.
+    """
+    if index_label is not None:
+        data = data.rename_axis(index_label).reset_index()
+        if data[index_label].dtype == object:
+            # eg weekly time steps that were read alongside text labels
+            converted = pd.to_numeric(data[index_label], errors="coerce")
+            if converted.notna().all():
+                data[index_label] = converted
+    else:
+        data = data.reset_index(drop=True)
+    categorical_cols = [
+        col for col in CATEGORICAL_OUTPUT_COLS if col in data.columns
+    ]
+    return data.astype(dict.fromkeys(categorical_cols, "category"))
+
+
+def serialize_table(
+    data: pd.DataFrame, output_format: str, index_label: Optional[str] = None
+) -> bytes:
+    """Serializes a table to the bytes of an output file.
+
+    >>> df = pd.DataFrame({"a": [1, 2]})
+    >>> serialize_table(df, "csv").splitlines()
+    [b'a', b'1', b'2']
+
+    Args:
+        data: Table to serialize.
+        output_format: One of "csv", "parquet" and "arrow" (Arrow IPC).
+        index_label: Name of the index column. If None, the index is not
+            written. Defaults to None.
+
+    Returns:
+        The file contents.
+
+    Raises:
+        ValueError: If the format is not recognized.
+    """
+    if output_format == "csv":
+        return data.to_csv(
+            index=index_label is not None, index_label=index_label
+        ).encode("utf-8")
+    buffer = io.BytesIO()
+    if output_format == "parquet":
+        to_columnar(data, index_label).to_parquet(
+            buffer, compression="zstd", index=False
+        )
+    elif output_format == "arrow":
+        to_columnar(data, index_label).to_feather(buffer, compression="zstd")
+    else:
+        raise ValueError(f"Unknown output format {output_format!r}")
+    return buffer.getvalue()
+
+
+def _temp_path(path: Path) -> Path:
+    """Returns a temporary path next to path, on the same filesystem."""
+    return path.with_name(f".{path.name}.{os.getpid()}.tmp")
+
+
+def write_atomic(content: bytes, path: Path) -> None:
+    """Writes a file so readers only ever see the old or the new contents.
+
+    Args:
+        content: File contents.
+        path: Path to write.
+    """
+    tmp = _temp_path(path)
+    try:
+        tmp.write_bytes(content)
+        tmp.replace(path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def link_or_copy_atomic(source: Path, path: Path) -> None:
+    """Atomically replaces path with a hardlink to, or a copy of, source.
+
+    A hardlink is used when both paths are on the same filesystem, so the
+    contents are not written twice. Source files are only ever replaced,
+    never modified in place, so linked copies cannot change underneath.
+
+    Args:
+        source: File to link or copy.
+        path: Path to replace.
+    """
+    tmp = _temp_path(path)
+    try:
+        tmp.unlink(missing_ok=True)
+        try:
+            os.link(source, tmp)
+        except OSError:
+            shutil.copyfile(source, tmp)
+        tmp.replace(path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+class OutputSink:
+    """Writes each output artifact once and publishes it to every destination.
+
+    Attributes:
+        destinations: Directories each artifact is written to.
+        formats: Formats each table is written in.
+    """
+
+    def __init__(
+        self, destinations: Sequence[Path], formats: Sequence[str] = ("csv",)
+    ) -> None:
+        """Initializes the OutputSink.
+
+        Args:
+            destinations: Directories each artifact is written to.
+            formats: Any of "csv", "parquet" and "arrow" (Arrow IPC).
+                Defaults to ("csv",).
+
+        Raises:
+            ValueError: If there are no destinations or a format is not
+                recognized.
+        """
+        if not destinations:
+            raise ValueError("At least one output destination is required")
+        unknown = set(formats) - set(SUPPORTED_OUTPUT_FORMATS)
+        if unknown:
+            raise ValueError(f"Unknown output formats {sorted(unknown)}")
+        self.destinations = [Path(destination) for destination in destinations]
+        self.formats = list(formats)
+
+    def write(
+        self,
+        data: pd.DataFrame,
+        name: str,
+        index_label: Optional[str] = None,
+    ) -> None:
+        """Writes a table in every format to every destination.
+
+        Each format is serialized once and written atomically to the first
+        destination, then hardlinked or copied to the others.
+
+        Args:
+            data: Table to write.
+            name: File name without extension.
+            index_label: Name of the index column. If None, the index is
+                not written. Defaults to None.
+        """
+        first, *others = self.destinations
+        for output_format in self.formats:
+            filename = f"{name}.{output_format}"
+            write_atomic(
+                serialize_table(data, output_format, index_label),
+                first / filename,
+            )
+            for destination in others:
+                link_or_copy_atomic(first / filename, destination / filename)
@@ -1,12 +1,76 @@
 """Processes data from the CFTP for display on a public dashboard."""
+import cProfile
+import hashlib
+import inspect
+import json
+import re
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple
 
 import numpy as np
 import pandas as pd
-from constants import TRIAL_COLS, TRIAL_TO_ID_MAP
-from utils import DefaultDataFrames
+from constants import (
+    CURRENT_DIR,
+    DATA_SHEET_PATHS,
+    ITEM_MATCH_CACHE_PATH,
+    NEW_TEMPLATE_CHUNK_SIZE,
+    NEW_TEMPLATE_DTYPES,
+    TRIAL_COL_DTYPES,
+    TRIAL_COLS,
+    TRIAL_TO_ID_MAP,
+)
+from profiling import StageProfiler
+from resolver import ItemResolver, accepted_matches
+from schema import apply_schema
+from utils import (
+    DefaultDataFrames,
+    check_unique_keys,
+    checked_merge,
+    get_default_dfs,
+    index_items,
+    join_items,
+    map_technology,
+    normalize_item_names,
+)
+from workbooks import file_hash, read_excel, read_excel_sheets
+
+# Changes to any of these modules can change the output of every trial
+SHARED_CODE_PATHS = [
+    CURRENT_DIR / "constants.py",
+    CURRENT_DIR / "pipeline_template.py",
+    CURRENT_DIR / "resolver.py",
+    CURRENT_DIR / "schema.py",
+    CURRENT_DIR / "utils.py",
+    CURRENT_DIR / "workbooks.py",
+]
+
+
+class _RowsUntilBlank:
+    """File-like view of a CSV file that ends before its first empty row.
+
+    A row is empty when it only contains delimiters, like the row that
+    separates the template's data from its comments. Blank lines are
+    passed through since read_csv skips them.
+    """
+
+    def __init__(self, f: TextIO) -> None:
+        self._lines = iter(f)
+        self._buffer = ""
+        self._done = False
+
+    def read(self, size: int = -1) -> str:
+        while not self._done and (size < 0 or len(self._buffer) < size):
+            line = next(self._lines, "")
+            row = line.rstrip("\r\n")
+            if not line or (row and not row.strip(",")):
+                self._done = True
+            else:
+                self._buffer += line
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
 
 
 class AbstractDataPipeline(ABC):
@@ -19,12 +83,26 @@ class AbstractDataPipeline(ABC):
     Attributes:
         data_filepath: Path to the data file.
         items: DataFrame containing item information.
+        items_by_id: Item information indexed by Item ID.
+        items_by_name: Item information indexed by normalized Item Name.
         item2id: Dictionary mapping items to IDs.
         trial: Trial identifier.
         output_filepath: Path to save the output file.
-        data: Loaded data.
+        fingerprint_filepath: Path to save the fingerprint of the inputs
+            that produced the output file.
+        raw_data: Loaded data, read from the data file on first access.
+        default_dfs: Reference data, loaded on first access.
+        technology: Technology of the trial, from its trial name.
+        legacy: Whether the pipeline reads a legacy data format.
+        optional: Whether a run carries on without the pipeline's output
+            if it fails, rather than stopping.
+        stage_report: Timing, memory and row counts of each stage of the
+            last run.
     """
 
+    legacy = False
+    optional = False
+
     def __init__(
         self,
         data_filepath: Path,
@@ -34,6 +112,7 @@ class AbstractDataPipeline(ABC):
         trial_name: Optional[str] = None,
         sheet_name: int = 0,
         skiprows: int = 0,
+        default_dfs: Optional[DefaultDataFrames] = None,
     ) -> None:
         """Initializes the AbstractDataPipeline with the given parameters.
 
@@ -45,27 +124,166 @@ class AbstractDataPipeline(ABC):
             trials: DataFrame containing trial information. Defaults to TRIALS.
             sheet_name: Sheet name or index to load. Defaults to 0.
             skiprows: Number of rows to skip at the start of the file. Defaults to 0.
+            default_dfs: Reference data to use. Defaults to the shared
+                instance returned by get_default_dfs, loaded when first
+                needed.
         """
-
-        default_dfs = DefaultDataFrames()
-
         self.data_filepath = data_filepath
         filename = self.data_filepath.stem
         self.trial_name = trial_name
-        self.trials = default_dfs.df_trials if trials is None else trials
         file_suffix = (
             f"_{trial_name}_clean.csv" if self.trial_name else "_clean.csv"
         )
         self.output_filepath = self.data_filepath.with_name(
             filename + file_suffix
         )
-
-        # TODO: This is kind of messy and could probably be better
-        self.raw_data = self.load_data(
-            data_filepath, sheet_name=sheet_name, skiprows=skiprows
+        self.fingerprint_filepath = self.output_filepath.with_suffix(
+            ".fingerprint.json"
         )
-        self.items = default_dfs.df_items if items is None else items
-        self.item2id = default_dfs.item2id if item2id is None else item2id
+
+        # Raw and reference data are loaded on first access, so building a
+        # pipeline does no I/O and pipelines can be handed to worker
+        # processes before any file is parsed
+        self.sheet_name = sheet_name
+        self.skiprows = skiprows
+        self._raw_data = None
+        self._default_dfs = default_dfs
+        self._trials = trials
+        self._items = items
+        self._item_index = None
+        self._item2id = item2id
+        self._item_resolver = None
+        self.stage_report = []
+
+    @property
+    def default_dfs(self) -> DefaultDataFrames:
+        """Reference data, loaded on first access."""
+        if self._default_dfs is None:
+            self._default_dfs = get_default_dfs()
+        return self._default_dfs
+
+    @property
+    def reference_paths(self) -> Dict[str, Path]:
+        """Paths to the reference data files."""
+        if self._default_dfs is None:
+            return DATA_SHEET_PATHS
+        return self._default_dfs.paths
+
+    @property
+    def trials(self) -> pd.DataFrame:
+        """DataFrame containing trial information."""
+        if self._trials is None:
+            return self.default_dfs.df_trials
+        return self._trials
+
+    @property
+    def items(self) -> pd.DataFrame:
+        """DataFrame containing item information."""
+        if self._items is None:
+            return self.default_dfs.df_items
+        return self._items
+
+    @property
+    def items_by_id(self) -> pd.DataFrame:
+        """Item information indexed by Item ID."""
+        return self._get_item_index()[0]
+
+    @property
+    def items_by_name(self) -> pd.DataFrame:
+        """Item information indexed by normalized Item Name."""
+        return self._get_item_index()[1]
+
+    def _get_item_index(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Returns the item lookup tables, building them on first access."""
+        if self._item_index is None:
+            if self._items is None:
+                self._item_index = (
+                    self.default_dfs.items_by_id,
+                    self.default_dfs.items_by_name,
+                )
+            else:
+                self._item_index = (
+                    index_items(self._items, self._items["Item ID"]),
+                    index_items(
+                        self._items,
+                        normalize_item_names(self._items["Item Name"]),
+                    ),
+                )
+        return self._item_index
+
+    @property
+    def item2id(self) -> Dict[str, Any]:
+        """Dictionary mapping item descriptions to IDs."""
+        if self._item2id is None:
+            return self.default_dfs.item2id
+        return self._item2id
+
+    @property
+    def technology(self) -> str:
+        """Technology of the trial, from its trial name (eg "wr001").
+
+        "Unknown" if the name does not start with a technology prefix and
+        a number, eg for files with several trials.
+        """
+        name = (self.trial_name or "").upper()
+        if re.match(r"[A-Z]+\d", name) is None:
+            return "Unknown"
+        return map_technology(name)
+
+    @property
+    def item_resolver(self) -> ItemResolver:
+        """Resolver of item descriptions to IDs, built on first access."""
+        if self._item_resolver is None:
+            self._item_resolver = ItemResolver(self.item2id)
+        return self._item_resolver
+
+    def resolve_item_ids(self, descriptions: pd.Series) -> pd.Series:
+        """Maps item descriptions to item IDs.
+
+        Args:
+            descriptions: Item descriptions from the trial data.
+
+        Returns:
+            The item IDs, aligned with descriptions.
+
+        Raises:
+            ValueError: If any description could not be resolved, including
+                descriptions with a candidate match awaiting review.
+        """
+        item_ids = self.item_resolver.resolve(descriptions)
+        if item_ids.isna().any():
+            missing = descriptions[item_ids.isna()].unique().tolist()
+            message = f"There are null items after mapping: {missing[:10]}"
+            if self.item_resolver.candidates:
+                message += (
+                    ". Review the suggested matches in "
+                    f"{self.item_resolver.cache_path}"
+                )
+            raise ValueError(message)
+        return item_ids
+
+    @property
+    def raw_data(self) -> pd.DataFrame:
+        """Data loaded from the data file, read on first access."""
+        if self._raw_data is None:
+            self._raw_data = self.load_data(
+                self.data_filepath,
+                sheet_name=self.sheet_name,
+                skiprows=self.skiprows,
+            )
+        return self._raw_data
+
+    def iter_raw_chunks(self) -> Optional[Iterator[pd.DataFrame]]:
+        """Streams the raw data in chunks, for pipelines that support it.
+
+        When this returns chunks, each one is preprocessed as it is read
+        instead of loading all of the raw data first.
+
+        Returns:
+            An iterator over chunks of raw data, or None to load the raw
+            data in one go.
+        """
+        return None
 
     @abstractmethod
     def load_data(
@@ -109,7 +327,7 @@ class AbstractDataPipeline(ABC):
         Returns:
             Data joined with item information.
         """
-        return self.items.merge(data, on="Item ID")
+        return join_items(data, self.items_by_id, data["Item ID"])
 
     def calculate_results(self, data: pd.DataFrame) -> pd.DataFrame:
         """Calculates results from the data.
@@ -133,34 +351,222 @@ class AbstractDataPipeline(ABC):
 
         Returns:
             Data merged with trial information.
+
+        Raises:
+            JoinCardinalityError: If a trial ID appears more than once in
+                the trials table.
         """
-        return data.merge(
-            self.trials, left_on="Trial ID", right_on="Public Trial ID"
+        return checked_merge(
+            data,
+            self.trials,
+            "many_to_one",
+            left_on="Trial ID",
+            right_on="Public Trial ID",
         )
 
-    def run(self, save: bool = False) -> pd.DataFrame:
+    def fingerprint_params(self) -> Dict[str, Any]:
+        """Returns the pipeline options that affect its output.
+
+        Subclasses with extra options should extend this.
+
+        Returns:
+            Mapping of option names to JSON-serializable values.
+        """
+        return {
+            "trial_name": self.trial_name,
+            "sheet_name": self.sheet_name,
+            "skiprows": self.skiprows,
+        }
+
+    def fingerprint_inputs(self) -> Dict[str, Any]:
+        """Describes every input that determines the pipeline's output.
+
+        This covers the source file contents, the read options, the
+        reference data files, the accepted item matches and the code of the
+        pipeline class and the shared modules it depends on.
+
+        Returns:
+            Mapping of input names to content hashes or option values.
+        """
+        code_paths = SHARED_CODE_PATHS + [
+            Path(inspect.getfile(cls))
+            for cls in type(self).__mro__
+            if issubclass(cls, AbstractDataPipeline)
+        ]
+        return {
+            "pipeline": type(self).__qualname__,
+            "params": self.fingerprint_params(),
+            "source": file_hash(self.data_filepath),
+            "reference_data": {
+                name: file_hash(path)
+                for name, path in sorted(self.reference_paths.items())
+            },
+            "item_matches": accepted_matches(ITEM_MATCH_CACHE_PATH),
+            "code": {
+                path.name: file_hash(path) for path in sorted(set(code_paths))
+            },
+        }
+
+    def fingerprint(self) -> str:
+        """Returns a hash of every input that determines the output.
+
+        Returns:
+            Hex digest of the pipeline inputs.
+        """
+        inputs = json.dumps(self.fingerprint_inputs(), sort_keys=True)
+        return hashlib.sha256(inputs.encode()).hexdigest()
+
+    def is_up_to_date(self) -> bool:
+        """Checks whether the saved output was produced from the same inputs.
+
+        Returns:
+            True if the output file exists and its saved fingerprint matches
+            the current inputs.
+        """
+        if not (
+            self.output_filepath.exists() and self.fingerprint_filepath.exists()
+        ):
+            return False
+        saved = json.loads(self.fingerprint_filepath.read_text())
+        return saved.get("fingerprint") == self.fingerprint()
+
+    def load_output(self) -> pd.DataFrame:
+        """Loads the saved output file.
+
+        Returns:
+            The previously processed data.
+        """
+        text_cols = [col for col in TRIAL_COLS if not col.startswith("%")]
+        return pd.read_csv(
+            self.output_filepath,
+            dtype=dict.fromkeys(text_cols, str),
+            float_precision="round_trip",
+        )
+
+    def save_output(self, data: pd.DataFrame) -> None:
+        """Saves the output file along with the fingerprint of its inputs.
+
+        Args:
+            data: Processed data to save.
+        """
+        data.to_csv(self.output_filepath, index=False)
+        self.fingerprint_filepath.write_text(
+            json.dumps(
+                {
+                    "fingerprint": self.fingerprint(),
+                    "inputs": self.fingerprint_inputs(),
+                },
+                indent=2,
+                sort_keys=True,
+            )
+        )
+        print(f"Saved to {self.output_filepath}")
+
+    def run(
+        self,
+        save: bool = False,
+        incremental: bool = False,
+        profile_memory: bool = False,
+        profile_dir: Optional[Path] = None,
+    ) -> pd.DataFrame:
         """Runs the data pipeline.
 
         This method runs the entire data pipeline, including loading data,
         preprocessing, joining with item information, calculating results,
         and optionally saving the output to a file.
 
+        The wall time and row counts in and out of each stage are recorded
+        in stage_report, which is also attached to the returned data as
+        data.attrs["stage_report"] so it survives a trip through a worker
+        process.
+
         Args:
             save: Whether to save the output to a file. Defaults to False.
+            incremental: Whether to reuse the saved output if none of the
+                pipeline inputs have changed since it was saved. The output
+                is always saved in incremental mode. Defaults to False.
+            profile_memory: Whether to record the peak memory of each stage.
+                Defaults to False.
+            profile_dir: If set, a cProfile dump for the run is written to
+                this directory as <trial name>.prof. Defaults to None.
+
+        Returns:
+            Final processed data.
+        """
+        profiler = StageProfiler(self.trial_name, track_memory=profile_memory)
+        if profile_dir is None:
+            data = self._run_stages(profiler, save, incremental)
+        else:
+            with cProfile.Profile() as cprofiler:
+                data = self._run_stages(profiler, save, incremental)
+            cprofiler.dump_stats(
+                Path(profile_dir)
+                / f"{self.trial_name or self.data_filepath.stem}.prof"
+            )
+        self.stage_report = profiler.records
+        data.attrs["stage_report"] = profiler.records
+        return data
+
+    def _run_stages(
+        self, profiler: StageProfiler, save: bool, incremental: bool
+    ) -> pd.DataFrame:
+        """Runs each pipeline stage through the profiler.
+
+        Args:
+            profiler: Profiler that records each stage.
+            save: Whether to save the output to a file.
+            incremental: Whether to reuse the saved output if none of the
+                pipeline inputs have changed since it was saved.
 
         Returns:
             Final processed data.
         """
+        if incremental and self.is_up_to_date():
+            print(f"Reusing unchanged output for {self.trial_name}")
+            data = profiler.run_stage(
+                "load_output", lambda _: self.load_output()
+            )
+            return profiler.run_stage(
+                "apply_schema",
+                lambda data: apply_schema(data, TRIAL_COL_DTYPES),
+                data,
+            )
+
         print(f"Running data pipeline for {self.trial_name}")
-        data = self.raw_data.copy()
-        data = self.preprocess_data(data)
-        data = self.join_with_items(data)
-        data = self.calculate_results(data)
-        data = self.merge_with_trials(data)
-        data = data[TRIAL_COLS]
-        if save:
-            data.to_csv(self.output_filepath, index=False)
-            print(f"Saved to {self.output_filepath}")
+        chunks = self.iter_raw_chunks()
+        if chunks is None:
+            # Under copy-on-write, as in run-pipeline.py, a shallow copy
+            # keeps the cached raw data unchanged, as columns are only
+            # copied if a stage modifies them
+            deep = not pd.get_option("mode.copy_on_write")
+            data = profiler.run_stage(
+                "load_data", lambda _: self.raw_data.copy(deep=deep)
+            )
+            data = profiler.run_stage(
+                "preprocess_data", self.preprocess_data, data
+            )
+        else:
+            # Only one raw chunk is held in memory at a time
+            data = profiler.run_stage(
+                "load_and_preprocess_data",
+                lambda _: pd.concat(
+                    self.preprocess_data(chunk) for chunk in chunks
+                ),
+            )
+        data = profiler.run_stage("join_with_items", self.join_with_items, data)
+        data = profiler.run_stage(
+            "calculate_results", self.calculate_results, data
+        )
+        data = profiler.run_stage(
+            "merge_with_trials", self.merge_with_trials, data
+        )
+        data = profiler.run_stage(
+            "apply_schema",
+            lambda data: apply_schema(data, TRIAL_COL_DTYPES),
+            data,
+        )
+        if save or incremental:
+            profiler.run_stage("save", self.save_output, data)
         print("Complete!")
         return data
 
@@ -168,6 +574,60 @@ class AbstractDataPipeline(ABC):
 class NewTemplatePipeline(AbstractDataPipeline):
     """Pipeline for processing data from the new template."""
 
+    def __init__(
+        self,
+        *args: Any,
+        chunksize: Optional[int] = NEW_TEMPLATE_CHUNK_SIZE,
+        **kwargs: Any,
+    ) -> None:
+        """Initializes the NewTemplatePipeline with the given parameters.
+
+        Args:
+            *args: Variable length argument list.
+            chunksize: Number of rows to read and preprocess at a time. If
+                None, the whole file is read at once. Defaults to
+                NEW_TEMPLATE_CHUNK_SIZE.
+            **kwargs: Arbitrary keyword arguments.
+        """
+        super().__init__(*args, **kwargs)
+        self.chunksize = chunksize
+
+    def read_chunks(
+        self, data_filepath: Path, chunksize: Optional[int] = None
+    ) -> Iterator[pd.DataFrame]:
+        """Reads the data rows of the CSV file in chunks.
+
+        The template has a comment section below the data, separated by an
+        empty row. Reading stops at that row, so the comments are never
+        parsed.
+
+        Args:
+            data_filepath: Path to the data file.
+            chunksize: Number of rows per chunk. If None, the data is read
+                as a single chunk. Defaults to None.
+
+        Yields:
+            Chunks of data, indexed by row number.
+        """
+        # With fix utf-8 encoding issue
+        # TODO: Change to Excel
+        with open(data_filepath, encoding="ISO-8859-1", newline="") as f:
+            reader = pd.read_csv(
+                _RowsUntilBlank(f),
+                dtype=NEW_TEMPLATE_DTYPES,
+                chunksize=chunksize,
+            )
+            if chunksize is None:
+                reader = [reader]
+            for chunk in reader:
+                # Rows that are empty once parsed, eg only quotes, also
+                # end the data
+                empty_rows = chunk.index[chunk.isna().all(axis=1)]
+                if len(empty_rows):
+                    yield chunk[chunk.index < empty_rows[0]]
+                    return
+                yield chunk
+
     def load_data(
         self, data_filepath: Path, sheet_name: int = 0, skiprows: int = 0
     ) -> pd.DataFrame:
@@ -181,20 +641,18 @@ class NewTemplatePipeline(AbstractDataPipeline):
         Returns:
             Loaded data.
         """
-        # Read the CSV file into a DataFrame
-        # With fix utf-8 encoding issue
-        # TODO: Change to Excel
-        data = pd.read_csv(data_filepath, encoding="ISO-8859-1")
+        return pd.concat(self.read_chunks(data_filepath, self.chunksize))
 
-        # Find the index of the first completely empty row — formatted
-        # so there's comments below the data
-        first_empty_row_index = data[data.isna().all(axis=1)].index.min()
+    def iter_raw_chunks(self) -> Optional[Iterator[pd.DataFrame]]:
+        """Streams the raw data in chunks of chunksize rows.
 
-        # If an empty row is found, drop all rows below it
-        if pd.notna(first_empty_row_index):
-            data = data[:first_empty_row_index]
-
-        return data
+        Returns:
+            An iterator over chunks of raw data, or None if chunksize is
+            None or the raw data has already been loaded.
+        """
+        if self.chunksize is None or self._raw_data is not None:
+            return None
+        return self.read_chunks(self.data_filepath, self.chunksize)
 
     def preprocess_data(self, data):
         """Preprocesses the data.
@@ -204,7 +662,19 @@ class NewTemplatePipeline(AbstractDataPipeline):
 
         Returns:
             The preprocess data.
+
+        Raises:
+            ValueError: If any template column is missing, eg in a
+                submission that does not follow the template.
         """
+        missing = [
+            col for col in NEW_TEMPLATE_DTYPES if col not in data.columns
+        ]
+        if missing:
+            raise ValueError(
+                f"{self.data_filepath.name} is missing template columns "
+                f"{missing}"
+            )
         data = data.rename(
             columns={
                 "Trial": "Trial ID",
@@ -238,26 +708,18 @@ class NewTemplatePipeline(AbstractDataPipeline):
         Returns:
             The joined data
         """
-        return self.items.drop_duplicates(subset="Item Name").merge(
-            data, on="Item Name"
+        # Use the item's own spelling of the name
+        return join_items(
+            data.drop(columns="Item Name"),
+            self.items_by_name,
+            normalize_item_names(data["Item Name"]),
         )
 
 
 class CASP004Pipeline(AbstractDataPipeline):
     """Pipeline for processing CASP004 trial data."""
 
-    def __init__(self, *args: Any, **kwargs: Any) -> None:
-        """Initializes the CASP004Pipeline with the given parameters.
-
-        Args:
-            *args: Variable length argument list.
-            **kwargs: Arbitrary keyword arguments.
-        """
-        super().__init__(*args, **kwargs)
-        # We are using the start weight specific to this trial
-        # so drop the Start Weight column
-        # Start weight is set in preprocess_data
-        self.items = self.items.drop("Start Weight", axis=1)
+    legacy = True
 
     def load_data(
         self, data_filepath: Path, sheet_name: int = 0, skiprows: int = 0
@@ -273,7 +735,7 @@ class CASP004Pipeline(AbstractDataPipeline):
         Returns:
             Loaded data.
         """
-        return pd.read_excel(
+        return read_excel(
             data_filepath, sheet_name=sheet_name, skiprows=skiprows
         )
 
@@ -295,11 +757,13 @@ class CASP004Pipeline(AbstractDataPipeline):
             Preprocessed data.
         """
         # Only use observations at the end
-        data = data[data["Stage"] == "End"].copy()
         # Bags A-5 and A-6 were not found
-        data = data[~data["Bag Id"].isin(["A-5", "A-6"])]
-
-        data["Trial"] = data["Trial Id"]
+        data = data[
+            (data["Stage"] == "End") & ~data["Bag Id"].isin(["A-5", "A-6"])
+        ]
+        # assign gives a frame of its own, so the columns set below never
+        # write to a slice. It only copies data without copy-on-write.
+        data = data.assign(Trial=data["Trial Id"])
 
         # Take the average of the three weight observations
         data["End Weight"] = data[["Weight 1", "Weight 2", "Weight 3"]].mean(
@@ -310,19 +774,21 @@ class CASP004Pipeline(AbstractDataPipeline):
         data["End Weight"] = data["End Weight"].fillna(0)
 
         # Ok...we need to do some weird items work arounds here...this might work?
-        casp004_items = pd.read_excel(
+        casp004_items = read_excel(
             self.data_filepath, sheet_name=2
         ).drop_duplicates(subset=["Item Name"])
         casp004_weights = casp004_items.set_index("Item Name")[
             "Weight (average)"
         ].to_dict()
+        # We are using the start weight specific to this trial, which
+        # takes precedence over the inventory's when joining with items
         data["Start Weight"] = data["Product Name"].map(casp004_weights)
         # rename so this matches the other trials
         data["Item Description Refined"] = data["Product Name"]
 
         # TODO: Some of this should be in the abstract method...
-        data["Item ID"] = (
-            data["Item Description Refined"].str.strip().map(self.item2id)
+        data["Item ID"] = self.resolve_item_ids(
+            data["Item Description Refined"]
         )
         # Prevent duplicate columns when merging with items
         data = data.rename(
@@ -331,16 +797,15 @@ class CASP004Pipeline(AbstractDataPipeline):
             }
         )
         data["Trial ID"] = "CASP004-01"
-        if data["Item ID"].isna().sum() > 0:
-            raise ValueError("There are null items after mapping")
 
         return data
 
     def calculate_results(self, data: pd.DataFrame) -> pd.DataFrame:
         """Calculates results from the data.
 
-        This method calculates the percentage of residuals by mass and sets
-        residuals by area to None.
+        This method calculates the percentage of residuals by mass from the
+        end weight averaged in preprocess_data and sets residuals by area to
+        None.
 
         Args:
             data: Data to calculate results from.
@@ -348,11 +813,6 @@ class CASP004Pipeline(AbstractDataPipeline):
         Returns:
             Data with calculated results.
         """
-        data["End Weight"] = data[["Weight 1", "Weight 2", "Weight 3"]].mean(
-            axis=1
-        )
-        data["End Weight"] = data["End Weight"].fillna(0)
-
         data["% Residuals (Area)"] = None
         data["% Residuals (Mass)"] = data["End Weight"] / data["Start Weight"]
         return data
@@ -361,46 +821,69 @@ class CASP004Pipeline(AbstractDataPipeline):
 class ClosedLoopPipeline(AbstractDataPipeline):
     """Pipeline for processing Closed Loop trial data."""
 
-    def melt_trial(self, data: pd.DataFrame, value_name: str) -> pd.DataFrame:
-        """Helper method to melt DataFrames.
+    legacy = True
+
+    # Columns identifying a bag in the weight and area sheets
+    id_cols = ["Trial ID", "Trial Stage", "Bag Set", "Bag Number"]
+
+    def item_columns(self, columns: pd.Index) -> List[Any]:
+        """Finds the item columns of a results sheet.
+
+        Items are pivoted to columns named by item ID. Other columns, and
+        IDs missing from the item inventory, are left out, as their rows
+        could not be joined with item information.
 
         Args:
-            data (pd.DataFrame): DataFrame to melt.
-            value_name (str): Name of the value column after melting.
+            columns: Columns of the sheet.
 
         Returns:
-            Melted DataFrame.
-        """
-        item_ids = [
-            "N",
-            "O",
-            "Q",
-            "V",
-            "B",
-            "D",
-            "H",
-            "I",
-            "J",
-            "K",
-            "K1",
-            "K2",
-            "K3",
-            "N",
-            "O",
-            "P",
-            "Q",
-            "S",
-            "V",
-        ]
+            The item columns, each once, in sheet order.
+        """
+        item_ids = set(self.items_by_id.index.astype(str))
+        return list(dict.fromkeys(c for c in columns if str(c) in item_ids))
+
+    def stack_items(self, sheets: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+        """Reshapes results sheets with one column per item to long format.
+
+        The sheets are aligned on id_cols and stacked together, so each bag
+        and item is one row with a column for each sheet's value. Rows with
+        a missing id_col, eg blank rows or facilities without a trial ID,
+        identify no bag and are left out.
+
+        Args:
+            sheets: Mapping of value names to sheets. Each sheet has id_cols
+                and one column per item.
+
+        Returns:
+            One row per bag and item with a value in any sheet, ordered by
+            id_cols and Item ID.
+
+        Raises:
+            JoinCardinalityError: If a bag appears more than once in a
+                sheet.
+        """
+        # The sheets are joined one to one on their bags
+        sheets = {
+            value_name: sheet.dropna(subset=self.id_cols)
+            for value_name, sheet in sheets.items()
+        }
+        for value_name, sheet in sheets.items():
+            check_unique_keys(sheet[self.id_cols], value_name, "one_to_one")
+        wide = pd.concat(
+            {
+                value_name: sheet.set_index(self.id_cols)[
+                    self.item_columns(sheet.columns)
+                ]
+                for value_name, sheet in sheets.items()
+            },
+            axis=1,
+            names=[None, "Item ID"],
+        )
         return (
-            data.melt(
-                id_vars=["Trial ID", "Trial Stage", "Bag Set", "Bag Number"],
-                value_vars=item_ids,
-                var_name="Item ID",
-                value_name=value_name,
-            )
-            .dropna(subset=[value_name])
-            .reset_index(drop=True)
+            wide.stack("Item ID", future_stack=True)
+            .dropna(how="all")
+            .sort_index()
+            .reset_index()
         )
 
     def load_data(
@@ -414,19 +897,15 @@ class ClosedLoopPipeline(AbstractDataPipeline):
             skiprows: Number of rows to skip at the start of the file. Defaults to 0.
 
         Returns:
-            Loaded and merged data.
+            Loaded data, with one row per bag and item.
         """
-        df_weight = pd.read_excel(data_filepath, sheet_name=3, skiprows=2)
-        weight_melted = self.melt_trial(df_weight, "% Residuals (Mass)")
-
-        df_area = pd.read_excel(data_filepath, sheet_name=4, skiprows=2)
-        df_area["Trial ID"] = df_area["Facility Name"].map(TRIAL_TO_ID_MAP)
-        area_melted = self.melt_trial(df_area, "% Residuals (Area)")
-
-        return weight_melted.merge(
-            area_melted,
-            on=["Trial ID", "Trial Stage", "Bag Set", "Bag Number", "Item ID"],
-            how="outer",
+        # Weight and area sheets share a layout, so read them in one pass
+        sheets = read_excel_sheets(data_filepath, [3, 4], skiprows=2)
+        df_area = sheets[4].assign(
+            **{"Trial ID": sheets[4]["Facility Name"].map(TRIAL_TO_ID_MAP)}
+        )
+        return self.stack_items(
+            {"% Residuals (Mass)": sheets[3], "% Residuals (Area)": df_area}
         )
 
     def preprocess_data(self, data: pd.DataFrame) -> pd.DataFrame:
@@ -449,6 +928,8 @@ class ClosedLoopPipeline(AbstractDataPipeline):
 class PDFPipeline(AbstractDataPipeline):
     """Pipeline for processing PDF trial data."""
 
+    legacy = True
+
     def __init__(
         self,
         *args: Any,
@@ -466,6 +947,14 @@ class PDFPipeline(AbstractDataPipeline):
         super().__init__(*args, **kwargs)
         self.weight_col = weight_col
 
+    def fingerprint_params(self) -> Dict[str, Any]:
+        """Returns the pipeline options that affect its output.
+
+        Returns:
+            Mapping of option names to JSON-serializable values.
+        """
+        return super().fingerprint_params() | {"weight_col": self.weight_col}
+
     def load_data(
         self, data_filepath: Path, sheet_name: int = 0, skiprows: int = 0
     ) -> pd.DataFrame:
@@ -479,7 +968,7 @@ class PDFPipeline(AbstractDataPipeline):
         Returns:
             Loaded data.
         """
-        return pd.read_excel(
+        return read_excel(
             data_filepath, sheet_name=sheet_name, skiprows=skiprows
         )
 
@@ -496,8 +985,8 @@ class PDFPipeline(AbstractDataPipeline):
             Data joined with item information.
         """
         # TODO: Merge on ID or should we just merge on description if we have it?
-        data["Item ID"] = (
-            data["Item Description Refined"].str.strip().map(self.item2id)
+        data["Item ID"] = self.resolve_item_ids(
+            data["Item Description Refined"]
         )
         # Prevent duplicate columns when merging with items
         data = data.rename(
@@ -507,9 +996,7 @@ class PDFPipeline(AbstractDataPipeline):
         )
         drop_cols = ["Item Description From Trial"]
         data = data.drop(drop_cols, axis=1)
-        if data["Item ID"].isna().sum() > 0:
-            raise ValueError("There are null items after mapping")
-        return self.items.merge(data, on="Item ID")
+        return join_items(data, self.items_by_id, data["Item ID"])
 
     def calculate_results(self, data: pd.DataFrame) -> pd.DataFrame:
         """Calculates results from the data.
@@ -0,0 +1,125 @@
+"""Records timing, memory and row counts for pipeline stages."""
+import json
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import pandas as pd
+
+StageRecord = Dict[str, Any]
+
+
+def _num_rows(data: Any) -> Optional[int]:
+    """Returns the number of rows in data, or None if it is not a table."""
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        return len(data)
+    return None
+
+
+class StageProfiler:
+    """Runs pipeline stages and records how long and how large each one was.
+
+    Wall time and row counts are always recorded. Peak memory is tracked
+    with tracemalloc, which slows the pipeline down, so it is opt-in.
+    tracemalloc is process wide, so peaks are only meaningful when a single
+    pipeline runs per process (the serial and process runner backends).
+
+    >>> profiler = StageProfiler("example")
+    >>> df = profiler.run_stage("double", lambda d: pd.concat([d, d]),
+    ...                         pd.DataFrame({"a": [1, 2]}))
+    >>> record = profiler.records[0]
+    >>> record["stage"], record["rows_in"], record["rows_out"]
+    ('double', 2, 4)
+
+    Attributes:
+        trial_name: Name of the trial being profiled.
+        track_memory: Whether peak memory is recorded.
+        records: One record per stage run, in order.
+    """
+
+    def __init__(self, trial_name: Optional[str], track_memory: bool = False):
+        """Initializes the StageProfiler.
+
+        Args:
+            trial_name: Name of the trial being profiled.
+            track_memory: Whether to record peak memory with tracemalloc.
+                Defaults to False.
+        """
+        self.trial_name = trial_name
+        self.track_memory = track_memory
+        self.records: List[StageRecord] = []
+
+    def run_stage(
+        self, stage: str, func: Callable[[Any], Any], data: Any = None
+    ) -> Any:
+        """Runs a stage and records its wall time, peak memory and rows.
+
+        Args:
+            stage: Name of the stage.
+            func: Function to run on data.
+            data: Input to the stage. Defaults to None.
+
+        Returns:
+            The output of func.
+        """
+        started_tracing = False
+        if self.track_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+            memory_before, _ = tracemalloc.get_traced_memory()
+
+        start = time.perf_counter()
+        try:
+            result = func(data)
+        finally:
+            seconds = time.perf_counter() - start
+            peak_memory_mb = None
+            if self.track_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                peak_memory_mb = (peak - memory_before) / 2**20
+                if started_tracing:
+                    tracemalloc.stop()
+
+        rows_out = _num_rows(result)
+        self.records.append(
+            {
+                "trial": self.trial_name,
+                "stage": stage,
+                "seconds": seconds,
+                "peak_memory_mb": peak_memory_mb,
+                "rows_in": _num_rows(data),
+                "rows_out": _num_rows(data) if rows_out is None else rows_out,
+            }
+        )
+        return result
+
+
+def write_run_report(
+    records: Sequence[StageRecord], output_dir: Path, name: str = "run_report"
+) -> None:
+    """Writes stage records as JSON and CSV run reports.
+
+    Args:
+        records: Stage records from every pipeline in the run.
+        output_dir: Directory to write to.
+        name: File name without extension. Defaults to "run_report".
+    """
+    (output_dir / f"{name}.json").write_text(
+        json.dumps(list(records), indent=2)
+    )
+    pd.DataFrame(
+        list(records),
+        columns=[
+            "trial",
+            "stage",
+            "seconds",
+            "peak_memory_mb",
+            "rows_in",
+            "rows_out",
+        ],
+    ).astype({"rows_in": "Int64", "rows_out": "Int64"}).to_csv(
+        output_dir / f"{name}.csv", index=False
+    )
@@ -0,0 +1,446 @@
+"""Answers dashboard box plot queries from the processed pipeline outputs.
+
+The dashboard API (prepareData in dashboard/app/api/utils.js) reloads the
+processed trials, filters them one filter at a time and computes the box
+plot of each group on every request. BoxPlotQueryService takes the same
+query parameters, filters with a single vectorized mask, computes and
+orders the boxes the same way as the precomputed box_plot_aggregates (see
+aggregates.class_box_plot_stats) and keeps the results of the most recent
+distinct queries in an LRU cache, so repeated queries are answered from
+memory.
+
+The data is loaded from the CSV outputs, or from the SQLite store written
+with run-pipeline.py --store. It can be used as a library, or served
+locally over HTTP:
+    python scripts/query_service.py --port 8000
+    curl 'localhost:8000/api/data?technologies=All&materials=All&...'
+"""
+import argparse
+import json
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Mapping, Optional, Sequence, Set, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import pandas as pd
+from aggregates import (
+    BOX_COLS,
+    class_box_plot_stats,
+    class_rank,
+    display_values,
+)
+from constants import (
+    AGGREGATE_VALUE_COLS,
+    DATA_DIR,
+    MIN_TRIALS_FOR_DISPLAY,
+    OPERATING_CONDITION_FILTERS,
+    QUERY_CACHE_SIZE,
+    QUERY_SERVICE_PORT,
+    STORE_PATH,
+)
+from store import TrialStore
+
+Query = Tuple[Tuple[str, Any], ...]
+
+# Query parameters that filter trial data, and the columns they filter
+TRIAL_FILTER_PARAMS = {
+    "technologies": "Technology",
+    "materials": "Material Class II",
+    "specificMaterials": "Material Class III",
+    "formats": "Item Format",
+    "brands": "Item Brand",
+}
+# Query parameters that filter trials by their average operating conditions
+CONDITION_FILTER_PARAMS = {
+    "moisture": "Average % Moisture (In Field)",
+    "temperature": "Average Temperature (F)",
+    "trialdurations": "Trial Duration",
+}
+# Single-valued query parameters and their defaults
+QUERY_DEFAULTS = {
+    "aggcol": "Material Class I",
+    "displaycol": "% Residuals (Mass)",
+    "testmethod": "Mesh Bag",
+    "timepoint": "Final",
+}
+
+NO_FILTER_MESSAGE = (
+    "”None” is selected for at least one filtering criteria. Please "
+    "ensure you have at least one option selected for each filter."
+)
+NOT_ENOUGH_TRIALS_MESSAGE = (
+    "There are not enough trials for the selected technology. Please select "
+    "more options."
+)
+NOT_ENOUGH_DATA_MESSAGE = (
+    "There is not enough data for the selected options. Please select more "
+    "options."
+)
+
+
+def normalize_query(params: Mapping[str, str]) -> Query:
+    """Normalizes dashboard query parameters into a hashable cache key.
+
+    Missing parameters take their dashboard defaults, and the values of
+    list parameters are split on commas, deduplicated and sorted, as their
+    order does not change the result.
+
+    >>> query = dict(normalize_query({"brands": "B,A,B", "uncapresults": "true"}))
+    >>> query["brands"], query["uncapresults"], query["testmethod"]
+    (('A', 'B'), True, 'Mesh Bag')
+
+    Args:
+        params: Query parameters, as in the dashboard's /api/data route.
+
+    Returns:
+        The normalized query.
+    """
+    query = {
+        name: params.get(name) or default
+        for name, default in QUERY_DEFAULTS.items()
+    }
+    query["uncapresults"] = params.get("uncapresults") == "true"
+    query["displayresiduals"] = params.get("displayresiduals") == "true"
+    for name in [*TRIAL_FILTER_PARAMS, *CONDITION_FILTER_PARAMS]:
+        values = params.get(name)
+        query[name] = tuple(sorted(set(values.split(",")))) if values else ()
+    return tuple(query.items())
+
+
+class BoxPlotQueryService:
+    """Computes the dashboard's box plots for filtered trial data.
+
+    >>> trials = pd.DataFrame(
+    ...     {
+    ...         "Trial ID": ["A", "B", "C", "C"],
+    ...         "Test Method": "Mesh Bag",
+    ...         "Timepoint": "Final",
+    ...         "Technology": "Windrow",
+    ...         "Material Class I": ["Fiber", "Fiber", "Biopolymer", "Fiber"],
+    ...         "% Residuals (Mass)": [0.2, 0.4, 0.6, 0.1],
+    ...     }
+    ... )
+    >>> conditions = pd.DataFrame(
+    ...     {"Trial ID": ["A", "B", "C"], "Trial Duration": [45, 45, 100]}
+    ... )
+    >>> service = BoxPlotQueryService(trials, conditions)
+    >>> params = dict.fromkeys(
+    ...     ["technologies", "materials", "specificMaterials", "formats"],
+    ...     "All",
+    ... ) | {
+    ...     "brands": "All",
+    ...     "moisture": "<40%,40-45%,45-50%,50-55%,55-60%,>60%",
+    ...     "temperature": "<140F,140-150F,150-160F,>160F",
+    ...     "trialdurations": "90+ Days",
+    ... }
+    >>> result = service.query(params)
+    >>> result["numTrials"], [box["aggCol"] for box in result["data"]]
+    (1, ['Fiber', 'Biopolymer'])
+    >>> service.query(params | {"technologies": "In-Vessel"}) == {
+    ...     "message": NOT_ENOUGH_TRIALS_MESSAGE
+    ... }
+    True
+
+    Attributes:
+        all_trials: Processed trial data, as the dashboard reads it from
+            CSV, with missing text as empty strings.
+        operating_conditions: Average operating conditions of each trial.
+    """
+
+    def __init__(
+        self,
+        all_trials: pd.DataFrame,
+        operating_conditions: pd.DataFrame,
+        cache_size: Optional[int] = QUERY_CACHE_SIZE,
+    ) -> None:
+        """Initializes the BoxPlotQueryService.
+
+        Args:
+            all_trials: Processed trial data (all_trials_processed).
+            operating_conditions: Average operating conditions of each
+                trial (operating_conditions_avg), with a Trial ID column.
+            cache_size: Number of distinct queries whose results are
+                cached. If None, the cache is unbounded. Defaults to
+                QUERY_CACHE_SIZE.
+        """
+        # Filters and groups compare strings, like the dashboard does with
+        # the values it reads from the CSV
+        self.all_trials = all_trials.astype(str).where(all_trials.notna(), "")
+        self.operating_conditions = operating_conditions
+        self._values = {
+            col: pd.to_numeric(all_trials[col], errors="coerce")
+            for col in AGGREGATE_VALUE_COLS
+            if col in all_trials.columns
+        }
+        self._condition_values = {
+            col: pd.to_numeric(operating_conditions[col], errors="coerce")
+            for col in CONDITION_FILTER_PARAMS.values()
+            if col in operating_conditions.columns
+        }
+        self._cached_query = lru_cache(maxsize=cache_size)(self._query)
+
+    @classmethod
+    def from_outputs(
+        cls, data_dir: Path = DATA_DIR, suffix: str = "", **kwargs: Any
+    ) -> "BoxPlotQueryService":
+        """Loads the service from the CSV outputs of run-pipeline.py.
+
+        Args:
+            data_dir: Directory of the outputs. Defaults to DATA_DIR.
+            suffix: Suffix of the output file names. Defaults to "".
+            **kwargs: Other arguments to BoxPlotQueryService.
+
+        Returns:
+            The query service.
+        """
+        data_dir = Path(data_dir)
+        return cls(
+            pd.read_csv(
+                data_dir / f"all_trials_processed{suffix}.csv",
+                dtype=str,
+                keep_default_na=False,
+            ),
+            pd.read_csv(data_dir / f"operating_conditions_avg{suffix}.csv"),
+            **kwargs,
+        )
+
+    @classmethod
+    def from_store(
+        cls, path: Path = STORE_PATH, **kwargs: Any
+    ) -> "BoxPlotQueryService":
+        """Loads the service from a store written by run-pipeline.py.
+
+        Args:
+            path: Path to the database. Defaults to STORE_PATH.
+            **kwargs: Other arguments to BoxPlotQueryService.
+
+        Returns:
+            The query service.
+        """
+        with TrialStore(path) as store:
+            return cls(store.trials(), store.operating_conditions(), **kwargs)
+
+    def query(self, params: Mapping[str, str]) -> Dict[str, Any]:
+        """Answers a dashboard query, from the cache if possible.
+
+        Args:
+            params: Query parameters, as in the dashboard's /api/data route.
+
+        Returns:
+            The same response as prepareData: the box of each group and the
+            number of trials, or a message if the data can't be shown.
+            Boxes have no color, which the dashboard sets from Material
+            Class I. Responses are shared by cached queries, so they should
+            not be modified.
+
+        Raises:
+            ValueError: If a column or operating condition filter does not
+                exist.
+        """
+        return self._cached_query(normalize_query(params))
+
+    def cache_info(self) -> Any:
+        """Returns the hits, misses and size of the query cache."""
+        return self._cached_query.cache_info()
+
+    def _values_of(self, col: str) -> pd.Series:
+        """Returns the numeric values of a column."""
+        if col not in self._values:
+            if col not in self.all_trials.columns:
+                raise ValueError(f"Unknown column {col!r}")
+            self._values[col] = pd.to_numeric(
+                self.all_trials[col], errors="coerce"
+            )
+        return self._values[col]
+
+    def _matches(self, col: str, conditions: Sequence[str]) -> pd.Series:
+        """Returns which rows match any condition, like filterData."""
+        if any("All" in condition for condition in conditions):
+            return pd.Series(True, index=self.all_trials.index)
+        if col not in self.all_trials.columns:
+            raise ValueError(f"Unknown column {col!r}")
+        return self.all_trials[col].isin(conditions)
+
+    def _condition_trial_ids(self, col: str, buckets: Sequence[str]) -> Set:
+        """Returns the trials whose average of col is in any bucket.
+
+        As in the dashboard, selecting every bucket selects every trial
+        with operating conditions, even those without a value of col.
+        """
+        ranges = OPERATING_CONDITION_FILTERS[col]
+        unknown = [bucket for bucket in buckets if bucket not in ranges]
+        if unknown:
+            raise ValueError(f"Unknown {col} filters {unknown}")
+        trial_ids = self.operating_conditions["Trial ID"]
+        if len(buckets) == len(ranges):
+            return set(trial_ids)
+        if col not in self._condition_values:
+            return set()
+        values = self._condition_values[col]
+        in_buckets = pd.Series(False, index=values.index)
+        for bucket in buckets:
+            low, high, inclusive = ranges[bucket]
+            if inclusive:
+                in_buckets |= (values >= low) & (values <= high)
+            else:
+                in_buckets |= (values > low) & (values < high)
+        return set(trial_ids[in_buckets])
+
+    def _query(self, query: Query) -> Dict[str, Any]:
+        """Answers a normalized query."""
+        params = dict(query)
+        if any(
+            not params[name]
+            for name in [*TRIAL_FILTER_PARAMS, *CONDITION_FILTER_PARAMS]
+        ):
+            return {"message": NO_FILTER_MESSAGE}
+
+        trials = self.all_trials
+        values = self._values_of(params["displaycol"])
+        mask = (
+            values.notna()
+            & self._matches("Test Method", [params["testmethod"]])
+            & self._matches("Timepoint", [params["timepoint"]])
+            & self._matches("Technology", params["technologies"])
+        )
+        # Hide results from too few trials to preserve privacy, except for
+        # bulk dose trials
+        if (
+            params["testmethod"] != "Bulk Dose"
+            and trials.loc[mask, "Trial ID"].nunique() < MIN_TRIALS_FOR_DISPLAY
+        ):
+            return {"message": NOT_ENOUGH_TRIALS_MESSAGE}
+
+        for name, col in TRIAL_FILTER_PARAMS.items():
+            if name != "technologies":
+                mask &= self._matches(col, params[name])
+        trial_ids = set.intersection(
+            *(
+                self._condition_trial_ids(col, params[name])
+                for name, col in CONDITION_FILTER_PARAMS.items()
+            )
+        )
+        mask &= trials["Trial ID"].isin(trial_ids)
+        if not mask.any():
+            return {"message": NOT_ENOUGH_DATA_MESSAGE}
+
+        if params["aggcol"] not in trials.columns:
+            raise ValueError(f"Unknown column {params['aggcol']!r}")
+        rows = trials[mask]
+        data = pd.DataFrame(
+            {
+                "aggCol": rows[params["aggcol"]],
+                "Value": display_values(
+                    values[mask],
+                    params["uncapresults"],
+                    params["displayresiduals"],
+                ),
+                "material_class_i": rows["Material Class I"],
+            }
+        )
+        stats = class_box_plot_stats(data, ["aggCol"])
+        stats = stats.sort_values(
+            "Material Class I", key=class_rank, kind="stable"
+        )
+        boxes = stats[BOX_COLS].to_dict("records")
+        for box in boxes:
+            box["outliers"] = json.loads(box["outliers"])
+        return {"data": boxes, "numTrials": rows["Trial ID"].nunique()}
+
+
+def make_handler(service: BoxPlotQueryService) -> type:
+    """Builds an HTTP request handler that answers /api/data queries.
+
+    Args:
+        service: Service that answers the queries.
+
+    Returns:
+        The request handler class.
+    """
+
+    class QueryHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            url = urlsplit(self.path)
+            if url.path != "/api/data":
+                self.send_json(404, {"message": f"Not found: {url.path}"})
+                return
+            try:
+                response = service.query(
+                    dict(parse_qsl(url.query, keep_blank_values=True))
+                )
+            except ValueError as error:
+                self.send_json(400, {"message": str(error)})
+                return
+            self.send_json(200, response)
+
+        def send_json(self, status: int, body: Dict[str, Any]) -> None:
+            content = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+    return QueryHandler
+
+
+def serve(
+    service: BoxPlotQueryService,
+    host: str = "127.0.0.1",
+    port: int = QUERY_SERVICE_PORT,
+) -> None:
+    """Serves queries over HTTP until interrupted.
+
+    Args:
+        service: Service that answers the queries.
+        host: Address to listen on. Defaults to "127.0.0.1".
+        port: Port to listen on. Defaults to QUERY_SERVICE_PORT.
+    """
+    with ThreadingHTTPServer((host, port), make_handler(service)) as server:
+        print(f"Serving box plot queries on http://{host}:{port}/api/data")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve dashboard box plot queries from pipeline outputs"
+    )
+    parser.add_argument(
+        "--data-dir",
+        type=Path,
+        default=DATA_DIR,
+        help="Directory of the run-pipeline.py outputs",
+    )
+    parser.add_argument(
+        "--suffix", default="", help="Suffix of the output file names"
+    )
+    parser.add_argument(
+        "--store",
+        nargs="?",
+        type=Path,
+        const=STORE_PATH,
+        help="Load the data from the SQLite store written with "
+        "run-pipeline.py --store instead of the CSV outputs",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=QUERY_SERVICE_PORT)
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=QUERY_CACHE_SIZE,
+        help="Number of distinct queries to cache",
+    )
+    args = parser.parse_args()
+    if args.store is not None:
+        service = BoxPlotQueryService.from_store(
+            args.store, cache_size=args.cache_size
+        )
+    else:
+        service = BoxPlotQueryService.from_outputs(
+            args.data_dir, args.suffix, cache_size=args.cache_size
+        )
+    serve(service, host=args.host, port=args.port)
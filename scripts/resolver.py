@@ -0,0 +1,311 @@
+"""Resolves free-text item descriptions from trial sheets to item IDs.
+
+Descriptions are normalized (case, whitespace and punctuation) and looked
+up exactly first. Descriptions that still do not match are compared with
+the known descriptions through a trigram index, so each lookup only scores
+the descriptions that share a trigram with it. Descriptions that differ
+in any number, eg a size such as 12oz, are never matched.
+
+Approximate matches are never applied automatically. Each one is saved to
+ITEM_MATCH_CACHE_PATH as a candidate, and descriptions stay unresolved
+until a person reviews the candidate and sets "accepted" to true. To
+correct a candidate, change its "match" or add the description to the
+extra items workbook, since exact matches always take precedence.
+"""
+import json
+import re
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import IO, Any, Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+from constants import ITEM_MATCH_CACHE_PATH, ITEM_MATCH_THRESHOLD
+from outputs import write_atomic
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_WHITESPACE = re.compile(r"\s+")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def normalize_description(description: str) -> str:
+    """Normalizes an item description for matching.
+
+    >>> normalize_description("  Compostable Cup, 12oz. (Clear) ")
+    'compostable cup 12oz clear'
+
+    Args:
+        description: The item description.
+
+    Returns:
+        The description in lower case with punctuation removed and runs of
+        whitespace collapsed to single spaces.
+    """
+    description = _PUNCTUATION.sub(" ", description.casefold())
+    return _WHITESPACE.sub(" ", description).strip()
+
+
+def trigrams(text: str) -> Set[str]:
+    """Returns the character trigrams of text, padded to include its ends.
+
+    >>> sorted(trigrams("cup"))
+    ['  c', ' cu', 'cup', 'up ']
+
+    Args:
+        text: Normalized text.
+
+    Returns:
+        The set of trigrams.
+    """
+    padded = f"  {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def numbers(text: str) -> List[str]:
+    """Returns the numbers in text, eg sizes and counts, in sorted order.
+
+    >>> numbers("pla lid 16oz 2 pack")
+    ['16', '2']
+
+    Args:
+        text: Normalized text.
+
+    Returns:
+        The numbers, as strings.
+    """
+    return sorted(_NUMBER.findall(text))
+
+
+def load_matches(path: Optional[Path]) -> Dict[str, Dict[str, Any]]:
+    """Loads the saved approximate matches, reviewed or not.
+
+    Args:
+        path: JSON file the matches are saved to, or None.
+
+    Returns:
+        Mapping of normalized descriptions to their candidate match, its
+        similarity and whether it was accepted. Empty if there is no file.
+    """
+    if path is None or not Path(path).exists():
+        return {}
+    return json.loads(Path(path).read_text())
+
+
+def accepted_matches(path: Optional[Path]) -> Dict[str, str]:
+    """Loads the approximate matches a person has accepted.
+
+    Args:
+        path: JSON file the matches are saved to, or None.
+
+    Returns:
+        Mapping of normalized descriptions to the known descriptions they
+        were matched to.
+    """
+    return {
+        description: saved["match"]
+        for description, saved in load_matches(path).items()
+        if saved.get("accepted") is True
+    }
+
+
+def _lock_file(lock: IO) -> None:
+    """Waits for an exclusive lock on an open file, released when closed.
+
+    fcntl is only available on POSIX systems, so Windows locks the first
+    byte of the file with msvcrt instead.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        import msvcrt
+
+        # LK_LOCK gives up after 10 attempts, a second apart
+        while True:
+            try:
+                msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+    fcntl.flock(lock, fcntl.LOCK_EX)
+
+
+class ItemResolver:
+    """Maps item descriptions to item IDs, exactly or approximately.
+
+    >>> resolver = ItemResolver(
+    ...     {"Compostable Cup 12oz": 1, "Paper Plate": 2},
+    ...     threshold=0.7,
+    ...     cache_path=None,
+    ... )
+    >>> descriptions = pd.Series(
+    ...     ["Compostable cup, 12 oz", "PAPER PLATE", "Compostable Cup 20 oz"]
+    ... )
+    >>> resolver.resolve(descriptions).tolist()
+    Item 'Compostable cup, 12 oz' may be 'compostable cup 12oz' (0.79)
+    [nan, 2.0, nan]
+    >>> resolver.accept("compostable cup 12 oz")
+    >>> resolver.resolve(descriptions).tolist()
+    [1.0, 2.0, nan]
+
+    Attributes:
+        item2id: Mapping of known descriptions to item IDs.
+        threshold: Minimum similarity of a candidate match.
+        cache_path: JSON file candidate matches are saved to.
+        candidates: Candidate matches found in this process that have not
+            been accepted, by normalized description.
+    """
+
+    def __init__(
+        self,
+        item2id: Dict[str, Any],
+        threshold: float = ITEM_MATCH_THRESHOLD,
+        cache_path: Optional[Path] = ITEM_MATCH_CACHE_PATH,
+    ) -> None:
+        """Initializes the ItemResolver and indexes the known descriptions.
+
+        Args:
+            item2id: Mapping of known descriptions to item IDs.
+            threshold: Minimum trigram similarity (Jaccard index, between 0
+                and 1) of a candidate match. Defaults to
+                ITEM_MATCH_THRESHOLD.
+            cache_path: JSON file candidate matches are saved to and
+                accepted matches are read from. If None, nothing is saved.
+                Defaults to ITEM_MATCH_CACHE_PATH.
+        """
+        self.item2id = item2id
+        self.threshold = threshold
+        self.cache_path = cache_path
+
+        # Later descriptions win, as they do in item2id
+        self._exact = {
+            normalize_description(str(description)): item_id
+            for description, item_id in item2id.items()
+        }
+        self._descriptions = list(self._exact)
+        self._description_trigrams = []
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        for i, description in enumerate(self._descriptions):
+            grams = trigrams(description)
+            self._description_trigrams.append(len(grams))
+            for gram in grams:
+                self._postings[gram].append(i)
+
+        self._accepted = accepted_matches(cache_path)
+        self.candidates: Dict[str, Dict[str, Any]] = {}
+        self._new_candidates = False
+
+    def match(self, description: str) -> Optional[Tuple[str, float]]:
+        """Finds the known description most similar to a description.
+
+        Only known descriptions that share a trigram with description are
+        scored, and known descriptions with different numbers are skipped,
+        so eg a 20oz cup is never matched to a 12oz cup.
+
+        Args:
+            description: Normalized description.
+
+        Returns:
+            The best matching known description and its similarity, or None
+            if no known description reaches the threshold.
+        """
+        grams = trigrams(description)
+        shared = Counter(
+            i for gram in grams for i in self._postings.get(gram, ())
+        )
+        description_numbers = numbers(description)
+        best = None
+        for i, count in shared.items():
+            score = count / (len(grams) + self._description_trigrams[i] - count)
+            if (
+                score >= self.threshold
+                and (best is None or score > best[1])
+                and numbers(self._descriptions[i]) == description_numbers
+            ):
+                best = (self._descriptions[i], score)
+        return best
+
+    def resolve_one(self, description: Any) -> Any:
+        """Resolves a single description to an item ID.
+
+        Args:
+            description: The item description.
+
+        Returns:
+            The item ID, or None if the description could not be resolved,
+            including when its candidate match has not been accepted.
+        """
+        if not isinstance(description, str):
+            return None
+        if description.strip() in self.item2id:
+            return self.item2id[description.strip()]
+        normalized = normalize_description(description)
+        if normalized in self._exact:
+            return self._exact[normalized]
+        # An accepted match is ignored if its known description is gone
+        if self._accepted.get(normalized) in self._exact:
+            return self._exact[self._accepted[normalized]]
+        if normalized not in self.candidates:
+            best = self.match(normalized)
+            if best is None:
+                return None
+            matched, score = best
+            print(f"Item {description!r} may be {matched!r} ({score:.2f})")
+            self.candidates[normalized] = {
+                "match": matched,
+                "score": round(score, 2),
+                "accepted": False,
+            }
+            self._new_candidates = True
+        return None
+
+    def accept(self, description: str) -> None:
+        """Accepts the candidate match of a description in this process.
+
+        Candidates saved to cache_path are accepted by editing the file.
+
+        Args:
+            description: Normalized description with a candidate match.
+        """
+        candidate = self.candidates.pop(description)
+        self._accepted[description] = candidate["match"]
+
+    def resolve(self, descriptions: pd.Series) -> pd.Series:
+        """Resolves a column of descriptions to item IDs.
+
+        Each distinct description is resolved once, and any new candidate
+        matches are saved for review.
+
+        Args:
+            descriptions: The item descriptions.
+
+        Returns:
+            The item IDs, aligned with descriptions. Descriptions that could
+            not be resolved are NaN.
+        """
+        codes, uniques = pd.factorize(descriptions)
+        item_ids = pd.Series([self.resolve_one(d) for d in uniques])
+        self.save()
+        return pd.Series(
+            item_ids.reindex(codes).to_numpy(),
+            index=descriptions.index,
+            name=descriptions.name,
+        )
+
+    def save(self) -> None:
+        """Adds new candidate matches to cache_path for review.
+
+        The file is read and rewritten under a lock, so candidates saved by
+        concurrent pipelines are merged rather than lost. Saved entries are
+        never overwritten, so reviewed matches are kept as they are.
+        """
+        if self.cache_path is None or not self._new_candidates:
+            return
+        path = Path(self.cache_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.with_name(f"{path.name}.lock").open("w") as lock:
+            _lock_file(lock)
+            saved = load_matches(path)
+            matches = self.candidates | saved
+            write_atomic(
+                json.dumps(matches, indent=2, sort_keys=True).encode(), path
+            )
+        self._new_candidates = False
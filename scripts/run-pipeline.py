@@ -1,148 +1,424 @@
 # %%
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
 import pandas as pd
+from aggregates import box_plot_aggregates
 from constants import (
-    APP_DATA_DIR,
     DATA_DIR,
+    DATA_SHEET_PATHS,
     EXCLUDED_TECHNOLOGIES,
+    OPERATING_CONDITION_ROLLUPS,
     OUTLIER_THRESHOLD,
+    OUTPUT_DIRS,
+    OUTPUT_FORMATS,
+    PIPELINE_BACKEND,
+    PIPELINE_WORKERS,
+    STORE_PATH,
     TRIAL_DATA_PATHS,
     USE_LEGACY_DATA_FORMATS,
 )
+from intake import (
+    discover_submissions,
+    merge_trial_results,
+    submission_pipelines,
+)
+from outputs import SUPPORTED_OUTPUT_FORMATS, OutputSink
 from pipeline_template import (
+    AbstractDataPipeline,
     CASP003Pipeline,
     CASP004Pipeline,
     ClosedLoopPipeline,
     NewTemplatePipeline,
     PDFPipeline,
 )
-from utils import DefaultDataFrames, anonymize_brand, map_technology
+from profiling import write_run_report
+from runner import BACKENDS, run_pipelines, select_trials
+from store import write_store
+from utils import (
+    DefaultDataFrames,
+    anonymize_brands,
+    checked_merge,
+    get_default_dfs,
+    map_technologies,
+    roll_up_conditions,
+)
+from workbooks import close_workbooks
 
 
-def main(suffix: str = ""):
-    default_dfs = DefaultDataFrames()
+def get_trials_to_run(
+    trial_data_paths: Dict[str, Path] = TRIAL_DATA_PATHS,
+    default_dfs: Optional[DefaultDataFrames] = None,
+) -> List[AbstractDataPipeline]:
+    """Builds the pipeline for every trial, in the legacy and new formats.
 
-    trials_to_run = [
+    Pipelines load their data when they run, so this does no I/O. Use
+    runner.select_trials to pick the ones to run.
+
+    Args:
+        trial_data_paths: Paths to the trial data files.
+            Defaults to TRIAL_DATA_PATHS.
+        default_dfs: Reference data shared by the pipelines. If None, each
+            pipeline loads the shared instance returned by get_default_dfs
+            when it runs. Defaults to None.
+
+    Returns:
+        The trial pipelines, in output order.
+    """
+    return [
         NewTemplatePipeline(
-            TRIAL_DATA_PATHS.get("NEW_TEMPLATE_PATH"),
+            trial_data_paths.get("NEW_TEMPLATE_PATH"),
             trial_name="OCT_22_PARTIAL",
-        )
+            default_dfs=default_dfs,
+        ),
+        CASP004Pipeline(
+            trial_data_paths.get("CASP004_PATH"),
+            sheet_name=1,
+            trial_name="casp004",
+            default_dfs=default_dfs,
+        ),
+        ClosedLoopPipeline(
+            trial_data_paths.get("TEN_TRIALS_PATH"),
+            trial_name="closed_loop",
+            default_dfs=default_dfs,
+        ),
+        PDFPipeline(
+            trial_data_paths.get("PDF_TRIALS"),
+            trial_name="ad001",
+            sheet_name=0,
+            skiprows=1,
+            default_dfs=default_dfs,
+        ),
+        PDFPipeline(
+            trial_data_paths.get("PDF_TRIALS"),
+            trial_name="wr001",
+            sheet_name=1,
+            default_dfs=default_dfs,
+        ),
+        PDFPipeline(
+            trial_data_paths.get("PDF_TRIALS"),
+            trial_name="casp001",
+            sheet_name=2,
+            default_dfs=default_dfs,
+        ),
+        CASP003Pipeline(
+            trial_data_paths.get("PDF_TRIALS"),
+            trial_name="casp003",
+            sheet_name=3,
+            weight_col="Final Residual Weight - wet - aggregate",
+            default_dfs=default_dfs,
+        ),
+        PDFPipeline(
+            trial_data_paths.get("PDF_TRIALS"),
+            trial_name="wr003",
+            sheet_name=4,
+            weight_col="Final Residual Weight - wet",
+            default_dfs=default_dfs,
+        ),
     ]
 
-    if USE_LEGACY_DATA_FORMATS is True:
-        trials_to_run.extend(
-            [
-                CASP004Pipeline(
-                    TRIAL_DATA_PATHS.get("CASP004_PATH"),
-                    sheet_name=1,
-                    trial_name="casp004",
-                ),
-                ClosedLoopPipeline(
-                    TRIAL_DATA_PATHS.get("TEN_TRIALS_PATH"),
-                    trial_name="closed_loop",
-                ),
-                PDFPipeline(
-                    TRIAL_DATA_PATHS.get("PDF_TRIALS"),
-                    trial_name="ad001",
-                    sheet_name=0,
-                    skiprows=1,
-                ),
-                PDFPipeline(
-                    TRIAL_DATA_PATHS.get("PDF_TRIALS"),
-                    trial_name="wr001",
-                    sheet_name=1,
-                ),
-                PDFPipeline(
-                    TRIAL_DATA_PATHS.get("PDF_TRIALS"),
-                    trial_name="casp001",
-                    sheet_name=2,
-                ),
-                CASP003Pipeline(
-                    TRIAL_DATA_PATHS.get("PDF_TRIALS"),
-                    trial_name="casp003",
-                    sheet_name=3,
-                    weight_col="Final Residual Weight - wet - aggregate",
-                ),
-                PDFPipeline(
-                    TRIAL_DATA_PATHS.get("PDF_TRIALS"),
-                    trial_name="wr003",
-                    sheet_name=4,
-                    weight_col="Final Residual Weight - wet",
-                ),
-            ]
-        )
 
-    all_trials = pd.concat(
-        [trial.run() for trial in trials_to_run], ignore_index=True
-    )
-    # Exclude mixed materials and multi-laminate pouches
-    all_trials = all_trials[
+def clean_trials(
+    all_trials: pd.DataFrame,
+    brand_mapping: dict,
+    technologies: Optional[Sequence[str]] = None,
+) -> Tuple[pd.DataFrame, dict]:
+    """Filters and labels the combined trial data for the dashboard.
+
+    Every row filter is combined into a single mask, so the rows are only
+    copied once.
+
+    Args:
+        all_trials: Processed data of every trial.
+        brand_mapping: Mapping of brand names to display names or numeric
+            brand IDs. It is not modified.
+        technologies: If set, only rows of these technologies are kept.
+            Defaults to None.
+
+    Returns:
+        The rows to display, with Technology and Timepoint columns and
+        anonymized brands, and a copy of brand_mapping with any new brands
+        added.
+    """
+    # Trials are excluded by ID, so each distinct ID is classified once
+    trial_ids = pd.Series(all_trials["Trial ID"].unique())
+    trial_technologies = map_technologies(trial_ids)
+    # CFTP as of 2025 is excluding AD data from the dashboard, may include
+    # in future
+    excluded = trial_technologies.isin(EXCLUDED_TECHNOLOGIES)
+    if technologies is not None:
+        # Files with several trials may include other technologies
+        excluded |= ~trial_technologies.isin(technologies)
+    keep = (
+        # Exclude mixed materials and multi-laminate pouches
         ~(all_trials["Material Class II"] == "Mixed Materials")
-    ]
-    all_trials = all_trials[
-        ~(
+        & ~(
             all_trials["Item Name"]
             == "Multi-laminate stand-up pounch with zipper"
         )
-    ]
-    # Exclude anything over 1000% as outlier
-    all_trials = all_trials[
-        all_trials["% Residuals (Mass)"] < OUTLIER_THRESHOLD
-    ]
+        # Exclude anything over 1000% as outlier
+        & (all_trials["% Residuals (Mass)"] < OUTLIER_THRESHOLD)
+        & ~all_trials["Trial ID"].isin(trial_ids[excluded])
+    )
+    all_trials = all_trials[keep]
     # Map Trial IDs to the technology used in the trial
-    all_trials["Technology"] = all_trials["Trial ID"].apply(map_technology)
+    all_trials["Technology"] = map_technologies(all_trials["Trial ID"])
 
-    all_trials["Item Brand"] = all_trials["Item Brand"].apply(
-        lambda brand: anonymize_brand(brand, default_dfs.brand_mapping)
+    # The mapping is shared reference data, so new brands go in a copy
+    brand_mapping = dict(brand_mapping)
+    all_trials["Item Brand"] = anonymize_brands(
+        all_trials["Item Brand"], brand_mapping
     )
     # Ensure all Item Format columns are title case
     all_trials["Item Format"] = all_trials["Item Format"].str.title()
 
     # TODO incorporate actual data
     all_trials["Timepoint"] = "Final"
+    return all_trials, brand_mapping
 
-    # CFTP as of 2025 is excluding AD data from the dashboard, may include in future
-    all_trials = all_trials[
-        ~all_trials["Technology"].isin(EXCLUDED_TECHNOLOGIES)
-    ]
 
-    # Make sure all trial IDs are represented in operating conditions
-    unique_trial_ids = pd.DataFrame(
-        all_trials["Trial ID"].unique(), columns=["Trial ID"]
-    ).set_index("Trial ID")
-    df_operating_conditions_avg = unique_trial_ids.merge(
-        default_dfs.df_operating_conditions_avg,
-        left_index=True,
-        right_index=True,
-        how="left",
-    )
-    df_operating_conditions = pd.concat(
-        [default_dfs.df_temps, default_dfs.df_moisture, default_dfs.df_o2],
-        axis=0,
-    )
-    for OUTPUT_DIR in [APP_DATA_DIR, DATA_DIR]:
-        trials_outpath = OUTPUT_DIR / f"all_trials_processed{suffix}.csv"
-        operating_conditions_avg_outpath = (
-            OUTPUT_DIR / f"operating_conditions_avg{suffix}.csv"
-        )
-        operating_conditions_outpath = (
-            OUTPUT_DIR / f"operating_conditions_full{suffix}.csv"
+def main(
+    suffix: str = "",
+    max_workers: Optional[int] = PIPELINE_WORKERS,
+    backend: str = PIPELINE_BACKEND,
+    incremental: bool = False,
+    output_formats: Sequence[str] = OUTPUT_FORMATS,
+    output_dirs: Sequence[Path] = OUTPUT_DIRS,
+    report: bool = False,
+    profile_dir: Optional[Path] = None,
+    trial_data_paths: Dict[str, Path] = TRIAL_DATA_PATHS,
+    data_sheet_paths: Dict[str, Path] = DATA_SHEET_PATHS,
+    rollups: Dict[str, int] = OPERATING_CONDITION_ROLLUPS,
+    trial_names: Optional[Sequence[str]] = None,
+    technologies: Optional[Sequence[str]] = None,
+    include_legacy: bool = USE_LEGACY_DATA_FORMATS,
+    store_path: Optional[Path] = None,
+    submissions: Optional[str] = None,
+):
+    # Filtered frames and renamed or reassigned columns share memory with
+    # the frame they came from until they are modified, so the pipeline
+    # stages and cleaning work on one frame without defensive copies
+    with pd.option_context("mode.copy_on_write", True):
+        try:
+            # Reference workbooks are parsed once and shared by every pipeline
+            default_dfs = get_default_dfs(data_sheet_paths)
+            # Trials are selected before any trial data is read
+            trials_to_run = get_trials_to_run(trial_data_paths, default_dfs)
+            if submissions is not None:
+                # Every distinct template file in the batch is its own trial
+                trials_to_run += submission_pipelines(
+                    discover_submissions(submissions),
+                    default_dfs,
+                    exclude=[trial_data_paths.get("NEW_TEMPLATE_PATH")],
+                )
+            trials_to_run = select_trials(
+                trials_to_run,
+                trial_names=trial_names,
+                technologies=technologies,
+                exclude_technologies=EXCLUDED_TECHNOLOGIES,
+                include_legacy=include_legacy,
+            )
+            if not trials_to_run:
+                raise ValueError(
+                    f"No trials match the selection (trial names: "
+                    f"{trial_names}, technologies: {technologies})"
+                )
+
+            if profile_dir is not None:
+                Path(profile_dir).mkdir(parents=True, exist_ok=True)
+            trial_results = run_pipelines(
+                trials_to_run,
+                max_workers=max_workers,
+                backend=backend,
+                incremental=incremental,
+                profile_memory=report,
+                profile_dir=profile_dir,
+            )
+            if report:
+                write_run_report(
+                    [
+                        record
+                        for result in trial_results
+                        if result is not None
+                        for record in result.attrs.get("stage_report", [])
+                    ],
+                    DATA_DIR,
+                    f"run_report{suffix}",
+                )
+            # Categorical columns stay categorical across trials
+            all_trials = merge_trial_results(trials_to_run, trial_results)
+        finally:
+            # All source sheets have been read, or the run failed, so
+            # release the open workbooks
+            close_workbooks()
+        all_trials, _ = clean_trials(
+            all_trials, default_dfs.brand_mapping, technologies=technologies
         )
 
-        print(f"Saving data to {OUTPUT_DIR}")
-        all_trials.to_csv(trials_outpath, index=False)
-        df_operating_conditions_avg.to_csv(
-            operating_conditions_avg_outpath,
+        # Make sure all trial IDs are represented in operating conditions
+        unique_trial_ids = pd.DataFrame(
+            all_trials["Trial ID"].unique(), columns=["Trial ID"]
+        ).set_index("Trial ID")
+        df_operating_conditions_avg = checked_merge(
+            unique_trial_ids,
+            default_dfs.df_operating_conditions_avg,
+            "one_to_one",
+            left_index=True,
+            right_index=True,
+            how="left",
+        )
+        df_operating_conditions = pd.concat(
+            [default_dfs.df_temps, default_dfs.df_moisture, default_dfs.df_o2],
+            axis=0,
+        )
+        sink = OutputSink(output_dirs, output_formats)
+        print(f"Saving data to {', '.join(str(d) for d in sink.destinations)}")
+        sink.write(all_trials, f"all_trials_processed{suffix}")
+        sink.write(
+            df_operating_conditions_avg,
+            f"operating_conditions_avg{suffix}",
             index_label="Trial ID",
         )
-        df_operating_conditions.to_csv(
-            operating_conditions_outpath,
-            index=True,
+        sink.write(
+            df_operating_conditions,
+            f"operating_conditions_full{suffix}",
             index_label="Time Step",
         )
+        # Tidy operating conditions: one row per measurement, no NaN padding
+        sink.write(
+            default_dfs.df_operating_conditions_long,
+            f"operating_conditions_long{suffix}",
+        )
+        df_rollups = None
+        if rollups:
+            df_rollups = roll_up_conditions(
+                default_dfs.df_operating_conditions_long, rollups
+            )
+            sink.write(df_rollups, f"operating_conditions_rollups{suffix}")
+        # Box plot statistics for the dashboard's default filters, so requests
+        # don't have to recompute them
+        sink.write(
+            box_plot_aggregates(all_trials), f"box_plot_aggregates{suffix}"
+        )
 
-    print("Complete!")
+        if store_path is not None:
+            # Indexed copies of the tables for filtered queries
+            tables = {
+                "all_trials_processed": all_trials,
+                "operating_conditions_avg": df_operating_conditions_avg,
+                "operating_conditions_full": df_operating_conditions,
+                "operating_conditions_long": (
+                    default_dfs.df_operating_conditions_long
+                ),
+            }
+            if df_rollups is not None:
+                tables["operating_conditions_rollups"] = df_rollups
+            write_store(
+                store_path,
+                tables,
+                index_labels={
+                    "operating_conditions_avg": "Trial ID",
+                    "operating_conditions_full": "Time Step",
+                },
+            )
+            print(f"Saved to {store_path}")
+
+        print("Complete!")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=PIPELINE_WORKERS,
+        help="Number of trial pipelines to run concurrently",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default=PIPELINE_BACKEND,
+        help="How to run trial pipelines concurrently",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Reuse saved trial outputs whose inputs have not changed",
+    )
+    parser.add_argument(
+        "--output-format",
+        dest="output_formats",
+        action="append",
+        choices=SUPPORTED_OUTPUT_FORMATS,
+        help="Output format to write, may be repeated (default: CSV only)",
+    )
+    parser.add_argument(
+        "--report",
+        action="store_true",
+        help="Write the time, peak memory and rows of each pipeline stage "
+        "to data/run_report.json and data/run_report.csv",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        type=Path,
+        help="Write a cProfile dump for each trial to this directory",
+    )
+    parser.add_argument(
+        "--no-rollups",
+        action="store_true",
+        help="Skip the weekly and monthly rollups of daily operating "
+        "conditions",
+    )
+    parser.add_argument(
+        "--trial",
+        dest="trial_names",
+        action="append",
+        help="Only run this trial (eg wr001), may be repeated",
+    )
+    parser.add_argument(
+        "--technology",
+        dest="technologies",
+        action="append",
+        help="Only include this technology (eg Windrow), may be repeated",
+    )
+    parser.add_argument(
+        "--no-legacy",
+        action="store_true",
+        help="Only run trials in the standardized template format",
+    )
+    parser.add_argument(
+        "--suffix",
+        default="",
+        help="Suffix for the output file names, eg for a partial run",
+    )
+    parser.add_argument(
+        "--store",
+        nargs="?",
+        const=STORE_PATH,
+        type=Path,
+        help="Also load the processed tables into a SQLite database with "
+        "indexed filter columns (default: data/cftp.sqlite)",
+    )
+    parser.add_argument(
+        "--submissions",
+        help="Directory or glob of facility submissions in the new "
+        "template to process alongside the configured trials",
+    )
+    args = parser.parse_args()
+    main(
+        suffix=args.suffix,
+        max_workers=args.workers,
+        backend=args.backend,
+        incremental=args.incremental,
+        output_formats=args.output_formats or OUTPUT_FORMATS,
+        report=args.report,
+        profile_dir=args.profile_dir,
+        rollups={} if args.no_rollups else OPERATING_CONDITION_ROLLUPS,
+        trial_names=args.trial_names,
+        technologies=args.technologies,
+        include_legacy=USE_LEGACY_DATA_FORMATS and not args.no_legacy,
+        store_path=args.store,
+        submissions=args.submissions,
+    )
 # %%
@@ -0,0 +1,187 @@
+"""Runs trial pipelines concurrently."""
+import os
+from concurrent.futures import (
+    FIRST_EXCEPTION,
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from typing import Any, Iterable, List, Optional, Sequence
+
+import pandas as pd
+from pipeline_template import AbstractDataPipeline
+
+BACKENDS = ("process", "thread", "serial")
+
+
+class PipelineError(RuntimeError):
+    """Raised when a trial pipeline fails.
+
+    Attributes:
+        trial_name: Name of the trial whose pipeline failed.
+    """
+
+    def __init__(self, trial_name: Optional[str], error: BaseException):
+        """Initializes the PipelineError.
+
+        Args:
+            trial_name: Name of the trial whose pipeline failed.
+            error: The exception raised by the pipeline.
+        """
+        super().__init__(f"Pipeline for trial {trial_name!r} failed: {error!r}")
+        self.trial_name = trial_name
+
+
+def select_trials(
+    pipelines: Sequence[AbstractDataPipeline],
+    trial_names: Optional[Iterable[str]] = None,
+    technologies: Optional[Iterable[str]] = None,
+    exclude_technologies: Iterable[str] = (),
+    include_legacy: bool = True,
+) -> List[AbstractDataPipeline]:
+    """Selects pipelines to run without loading any data.
+
+    A pipeline's technology comes from its trial name. Pipelines for files
+    with several trials have an "Unknown" technology and are kept by the
+    technology filters, so their rows need filtering after they run.
+
+    Args:
+        pipelines: Pipelines to select from.
+        trial_names: If set, only pipelines for these trial names (case
+            insensitive) are kept. Defaults to None.
+        technologies: If set, pipelines for other technologies are dropped.
+            Defaults to None.
+        exclude_technologies: Pipelines for these technologies are
+            dropped. Defaults to ().
+        include_legacy: Whether to keep pipelines for legacy data formats.
+            Defaults to True.
+
+    Returns:
+        The selected pipelines, in their original order.
+    """
+    if trial_names is not None:
+        trial_names = {name.lower() for name in trial_names}
+    if technologies is not None:
+        technologies = set(technologies) | {"Unknown"}
+    exclude_technologies = set(exclude_technologies)
+    return [
+        pipeline
+        for pipeline in pipelines
+        if (include_legacy or not pipeline.legacy)
+        and (
+            trial_names is None
+            or (pipeline.trial_name or "").lower() in trial_names
+        )
+        and (technologies is None or pipeline.technology in technologies)
+        and pipeline.technology not in exclude_technologies
+    ]
+
+
+def _run_pipeline(
+    pipeline: AbstractDataPipeline, **run_kwargs: Any
+) -> pd.DataFrame:
+    """Runs a single pipeline. Module level so process pools can pickle it."""
+    return pipeline.run(**run_kwargs)
+
+
+def _make_executor(backend: str, max_workers: int) -> Executor:
+    """Creates the executor for a backend.
+
+    Worker processes use the caller's copy-on-write setting, which spawned
+    processes would not otherwise inherit.
+    """
+    if backend == "process":
+        return ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=pd.set_option,
+            initargs=(
+                "mode.copy_on_write",
+                pd.get_option("mode.copy_on_write"),
+            ),
+        )
+    return ThreadPoolExecutor(max_workers=max_workers)
+
+
+def run_pipelines(
+    pipelines: Sequence[AbstractDataPipeline],
+    max_workers: Optional[int] = None,
+    backend: str = "process",
+    **run_kwargs: Any,
+) -> List[Optional[pd.DataFrame]]:
+    """Runs pipelines concurrently and returns their results in input order.
+
+    The process backend is the default since loading is dominated by
+    openpyxl parsing, which holds the GIL. Pipelines must load their raw
+    data lazily so that the parsing happens in the workers.
+
+    A failing optional pipeline, eg a facility submission, is reported and
+    skipped. Any other failure stops the run.
+
+    cProfile can only profile one thread at a time, so pipelines run in
+    processes instead of threads when a profile_dir is passed to run().
+
+    Args:
+        pipelines: Pipelines to run.
+        max_workers: Maximum number of concurrent pipelines. Defaults to
+            the number of CPUs, capped at the number of pipelines.
+        backend: One of "process", "thread" or "serial".
+            Defaults to "process".
+        **run_kwargs: Keyword arguments passed to each pipeline's run().
+
+    Returns:
+        The output of each pipeline, in the same order as pipelines. The
+        output of a failed optional pipeline is None.
+
+    Raises:
+        ValueError: If backend is not recognized.
+        PipelineError: If a pipeline that is not optional fails. The first
+            failure is raised with its trial name and any pipelines not yet
+            started are cancelled.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, expected {BACKENDS}")
+    if backend == "thread" and run_kwargs.get("profile_dir") is not None:
+        print("Profiling pipelines in processes, since threads can't be")
+        backend = "process"
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = min(max_workers, len(pipelines))
+
+    def failed(pipeline: AbstractDataPipeline, error: BaseException) -> None:
+        if not pipeline.optional:
+            raise PipelineError(pipeline.trial_name, error) from error
+        print(
+            f"Skipping trial {pipeline.trial_name!r}, which failed: {error!r}"
+        )
+
+    if backend == "serial" or max_workers <= 1:
+        results = []
+        for pipeline in pipelines:
+            try:
+                results.append(_run_pipeline(pipeline, **run_kwargs))
+            except Exception as e:
+                failed(pipeline, e)
+                results.append(None)
+        return results
+
+    with _make_executor(backend, max_workers) as executor:
+        futures = [
+            executor.submit(_run_pipeline, pipeline, **run_kwargs)
+            for pipeline in pipelines
+        ]
+        failures = set()
+        not_done = set(futures)
+        while not_done:
+            done, not_done = wait(not_done, return_when=FIRST_EXCEPTION)
+            for future, pipeline in zip(futures, pipelines):
+                if future in done and future.exception() is not None:
+                    if not pipeline.optional:
+                        for pending in not_done:
+                            pending.cancel()
+                    failed(pipeline, future.exception())
+                    failures.add(future)
+        return [
+            None if future in failures else future.result()
+            for future in futures
+        ]
@@ -0,0 +1,62 @@
+"""Enforces the column schema of processed trial data."""
+from typing import Dict, Sequence
+
+import pandas as pd
+
+
+def apply_schema(data: pd.DataFrame, dtypes: Dict[str, str]) -> pd.DataFrame:
+    """Selects and casts the columns of a schema.
+
+    >>> df = pd.DataFrame({"Trial ID": ["A", "A"], "x": [0.5, None], "y": 1})
+    >>> apply_schema(df, {"Trial ID": "category", "x": "float64"}).dtypes
+    Trial ID    category
+    x            float64
+    dtype: object
+
+    Args:
+        data: Data to cast.
+        dtypes: Mapping of column names to dtypes, in output order.
+
+    Returns:
+        The columns of the schema, cast to their dtypes.
+
+    Raises:
+        ValueError: If any column of the schema is missing from data.
+    """
+    missing = [col for col in dtypes if col not in data.columns]
+    if missing:
+        raise ValueError(f"Missing output columns {missing}")
+    return data[list(dtypes)].astype(dtypes)
+
+
+def concat_tables(frames: Sequence[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenates tables, keeping columns that are categorical in each.
+
+    pd.concat falls back to object dtype when categorical columns have
+    different categories, so the categories are unioned first.
+
+    >>> a = pd.DataFrame({"c": pd.Categorical(["x"])})
+    >>> b = pd.DataFrame({"c": pd.Categorical(["y"])})
+    >>> concat_tables([a, b])["c"].cat.categories.tolist()
+    ['x', 'y']
+
+    Args:
+        frames: Tables with the same columns.
+
+    Returns:
+        The concatenated table, with a fresh index.
+    """
+    frames = list(frames)
+    if not frames:
+        return pd.DataFrame()
+    dtypes = {}
+    for col in frames[0].columns:
+        columns = [frame[col] for frame in frames]
+        if all(isinstance(c.dtype, pd.CategoricalDtype) for c in columns):
+            categories = columns[0].cat.categories.append(
+                [c.cat.categories for c in columns[1:]]
+            )
+            dtypes[col] = pd.CategoricalDtype(categories.unique())
+    return pd.concat(
+        [frame.astype(dtypes) for frame in frames], ignore_index=True
+    )
@@ -0,0 +1,237 @@
+"""Loads processed tables into a SQLite database and queries them.
+
+The CSV outputs have to be read in full by every consumer. The store keeps
+the same tables in one database file, with an index on each column the
+dashboard filters by (STORE_INDEX_COLS), so a filtered read only touches
+matching rows. SQLite is part of the standard library, so the store needs
+no extra dependencies.
+"""
+import os
+import sqlite3
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import pandas as pd
+from constants import STORE_INDEX_COLS
+from outputs import to_columnar
+
+TRIALS_TABLE = "all_trials_processed"
+OPERATING_CONDITIONS_TABLE = "operating_conditions_avg"
+# Filter values that select every row, as in the dashboard
+ALL = "All"
+
+
+def quote(identifier: str) -> str:
+    """Quotes a table or column name for SQL.
+
+    >>> quote('% Residuals (Mass)')
+    '"% Residuals (Mass)"'
+
+    Args:
+        identifier: Table or column name.
+
+    Returns:
+        The quoted name.
+    """
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def write_store(
+    path: Path,
+    tables: Dict[str, pd.DataFrame],
+    index_labels: Optional[Dict[str, str]] = None,
+    index_cols: Sequence[str] = STORE_INDEX_COLS,
+) -> None:
+    """Writes tables to a new SQLite database.
+
+    The database is built in a temporary file next to path and then moved
+    over it, so readers only ever see the old or the new database, and
+    concurrent writers each replace it with a complete database.
+
+    Args:
+        path: Path to the database file.
+        tables: Mapping of table names to tables.
+        index_labels: Mapping of table names to the name their index is
+            stored as. The index of other tables is not stored. Defaults to
+            None.
+        index_cols: Columns to index in every table that has them.
+            Defaults to STORE_INDEX_COLS.
+    """
+    index_labels = index_labels or {}
+    path = Path(path)
+    # Per process, so concurrent runs don't write to the same file
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    # Left behind if an earlier process with the same pid was killed
+    tmp.unlink(missing_ok=True)
+    try:
+        with sqlite3.connect(tmp) as connection:
+            for name, data in tables.items():
+                data = to_columnar(data, index_labels.get(name))
+                data.to_sql(name, connection, index=False)
+                for col in index_cols:
+                    if col in data.columns:
+                        connection.execute(
+                            f"CREATE INDEX {quote(f'ix_{name}_{col}')} "
+                            f"ON {quote(name)} ({quote(col)})"
+                        )
+            # Statistics let the query planner pick the most selective index
+            connection.execute("ANALYZE")
+        connection.close()
+        tmp.replace(path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+class TrialStore:
+    """Reads filtered tables from a database written by write_store.
+
+    >>> import tempfile
+    >>> trials = pd.DataFrame(
+    ...     {"Trial ID": ["A", "B"], "Technology": ["Windrow", "In-Vessel"]}
+    ... )
+    >>> with tempfile.TemporaryDirectory() as tmp:
+    ...     write_store(Path(tmp) / "store.sqlite", {TRIALS_TABLE: trials})
+    ...     with TrialStore(Path(tmp) / "store.sqlite") as store:
+    ...         print(store.trials({"Technology": ["Windrow"]}))
+      Trial ID Technology
+    0        A    Windrow
+
+    Attributes:
+        path: Path to the database file.
+        connection: Read-only connection to the database.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """Opens the database read-only.
+
+        Args:
+            path: Path to the database file.
+        """
+        self.path = Path(path)
+        self.connection = sqlite3.connect(
+            f"{self.path.resolve().as_uri()}?mode=ro", uri=True
+        )
+
+    def __enter__(self) -> "TrialStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Closes the database."""
+        self.connection.close()
+
+    def columns(self, table: str) -> List[str]:
+        """Returns the columns of a table.
+
+        Args:
+            table: Table name.
+
+        Returns:
+            Column names, in table order.
+
+        Raises:
+            ValueError: If the table does not exist.
+        """
+        columns = [
+            row[1]
+            for row in self.connection.execute(
+                f"PRAGMA table_info({quote(table)})"
+            )
+        ]
+        if not columns:
+            raise ValueError(f"Unknown table {table!r} in {self.path}")
+        return columns
+
+    def query(
+        self,
+        table: str,
+        filters: Optional[Dict[str, Sequence]] = None,
+        not_null: Sequence[str] = (),
+        columns: Optional[Sequence[str]] = None,
+    ) -> pd.DataFrame:
+        """Reads the rows of a table that match filters.
+
+        Filters work like filterData in the dashboard API: a row matches if
+        its value is one of the filter's values, and a filter that
+        includes "All" matches every row.
+
+        Args:
+            table: Table name.
+            filters: Mapping of columns to the values to keep. Defaults to
+                None.
+            not_null: Columns that must have a value. Defaults to ().
+            columns: Columns to read. Defaults to every column.
+
+        Returns:
+            The matching rows, in table order.
+
+        Raises:
+            ValueError: If the table or a column does not exist.
+        """
+        table_columns = self.columns(table)
+        filters = {
+            col: list(values)
+            for col, values in (filters or {}).items()
+            if ALL not in values
+        }
+        unknown = [
+            col
+            for col in [*filters, *not_null, *(columns or [])]
+            if col not in table_columns
+        ]
+        if unknown:
+            raise ValueError(f"Unknown columns {unknown} in {table!r}")
+
+        conditions = [
+            f"{quote(col)} IN ({', '.join('?' * len(values))})"
+            for col, values in filters.items()
+        ] + [f"{quote(col)} IS NOT NULL" for col in not_null]
+        selected = ", ".join(map(quote, columns)) if columns else "*"
+        sql = f"SELECT {selected} FROM {quote(table)}"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return pd.read_sql_query(
+            sql + " ORDER BY rowid",
+            self.connection,
+            params=[value for values in filters.values() for value in values],
+        )
+
+    def trials(
+        self,
+        filters: Optional[Dict[str, Sequence]] = None,
+        display_col: Optional[str] = None,
+    ) -> pd.DataFrame:
+        """Reads processed trial data, filtered like the dashboard.
+
+        Args:
+            filters: Mapping of columns, eg Test Method or Technology, to
+                the values to keep. Defaults to None.
+            display_col: If set, only rows with a value in this column are
+                read. Defaults to None.
+
+        Returns:
+            The matching rows.
+        """
+        return self.query(
+            TRIALS_TABLE,
+            filters,
+            not_null=[] if display_col is None else [display_col],
+        )
+
+    def operating_conditions(
+        self, trial_ids: Optional[Sequence[str]] = None
+    ) -> pd.DataFrame:
+        """Reads the average operating conditions of trials.
+
+        Args:
+            trial_ids: Trials to read. Defaults to every trial.
+
+        Returns:
+            One row per trial.
+        """
+        return self.query(
+            OPERATING_CONDITIONS_TABLE,
+            None if trial_ids is None else {"Trial ID": trial_ids},
+        )
@@ -0,0 +1,448 @@
+"""Generates synthetic CFTP-shaped input files for benchmarking.
+
+The real trial data is private, so this writes workbooks and CSVs with the
+same file names, sheets, skipped header rows, column names and layouts as
+the files in DATA_SHEET_PATHS and TRIAL_DATA_PATHS, filled with random
+values. The number of trials and items can be scaled independently.
+"""
+import json
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from constants import DATA_SHEET_PATHS, TRIAL_DATA_PATHS, TRIAL_TO_ID_MAP
+
+# Item ID columns of the closed loop weight and area sheets
+CLOSED_LOOP_ITEM_IDS = [
+    "N",
+    "O",
+    "Q",
+    "V",
+    "B",
+    "D",
+    "H",
+    "I",
+    "J",
+    "K",
+    "K1",
+    "K2",
+    "K3",
+    "P",
+    "S",
+]
+MATERIAL_CLASSES = [
+    ("Fiber", "Paper", "Uncoated Paper"),
+    ("Biopolymer", "PLA", "PLA Film"),
+    ("Biopolymer", "PBAT", "PBAT Blend"),
+    ("Mixed Materials", "Mixed Materials", "Multi-laminate"),
+    ("Positive Control", "Positive Control", "Positive Control"),
+]
+ITEM_FORMATS = ["cup", "Bag", "film", "Utensil", "Food Tray"]
+TECHNOLOGY_PREFIXES = ["WR", "CASP", "EASP", "ASP", "IV"]
+PDF_TRIAL_IDS = ["AD001-01", "WR001-01", "CASP001-01", "CASP003-01", "WR003-01"]
+# Items tested in each trial, at every scale
+ITEMS_PER_TRIAL = 40
+# Base sizes, multiplied by the scale factors
+BASE_ITEMS = 60
+BASE_NEW_TEMPLATE_TRIALS = 6
+BASE_BAGS_PER_FACILITY = 3
+BASE_CASP004_ROWS = 60
+BASE_PDF_ROWS = 50
+
+
+def synthetic_paths(
+    output_dir: Path,
+) -> Tuple[Dict[str, Path], Dict[str, Path]]:
+    """Returns synthetic equivalents of DATA_SHEET_PATHS and TRIAL_DATA_PATHS.
+
+    >>> data_sheet_paths, _ = synthetic_paths(Path("out"))
+    >>> data_sheet_paths["TRIALS_PATH"].name
+    'CFTP-TrialDetails-Oct22-2024.xlsx'
+
+    Args:
+        output_dir: Directory the synthetic files are written to.
+
+    Returns:
+        The reference data paths and the trial data paths.
+    """
+    output_dir = Path(output_dir)
+    return (
+        {key: output_dir / path.name for key, path in DATA_SHEET_PATHS.items()},
+        {key: output_dir / path.name for key, path in TRIAL_DATA_PATHS.items()},
+    )
+
+
+def _write_sheet(
+    writer: pd.ExcelWriter,
+    data: pd.DataFrame,
+    sheet_name: str,
+    skiprows: int = 0,
+) -> None:
+    """Writes a sheet with skiprows note rows above the header."""
+    if skiprows:
+        pd.DataFrame([[f"{sheet_name} notes"]] * skiprows).to_excel(
+            writer, sheet_name=sheet_name, index=False, header=False
+        )
+    data.to_excel(writer, sheet_name=sheet_name, index=False, startrow=skiprows)
+
+
+def _write_unused_sheet(writer: pd.ExcelWriter, sheet_name: str) -> None:
+    """Writes a sheet that the pipeline skips over by index."""
+    pd.DataFrame({"Notes": ["Not used by the pipeline"]}).to_excel(
+        writer, sheet_name=sheet_name, index=False
+    )
+
+
+def _facilities() -> List[str]:
+    """Returns the long facility names of the closed loop trials."""
+    return [name for name in TRIAL_TO_ID_MAP if "(" in name]
+
+
+def _make_items(num_items: int) -> pd.DataFrame:
+    """Makes the item inventory, starting with the closed loop item IDs."""
+    item_ids = CLOSED_LOOP_ITEM_IDS + [
+        f"T{i:04d}" for i in range(num_items - len(CLOSED_LOOP_ITEM_IDS))
+    ]
+    classes = [
+        MATERIAL_CLASSES[i % len(MATERIAL_CLASSES)] for i in range(num_items)
+    ]
+    return pd.DataFrame(
+        {
+            "Item ID": item_ids,
+            "Item Name": [f"Test Item {item_id}" for item_id in item_ids],
+            # Trailing whitespace as in the real inventory
+            "Item Description Refined": [
+                f"Test item {item_id} description " for item_id in item_ids
+            ],
+            "Average Initial Weight, g": np.round(
+                np.linspace(2, 20, num_items), 2
+            ),
+            "Brand": [f"Company {i % 25}" for i in range(num_items)],
+            "Item Format": [
+                ITEM_FORMATS[i % len(ITEM_FORMATS)] for i in range(num_items)
+            ],
+            "Material Class I": [c[0] for c in classes],
+            "Material Class II": [c[1] for c in classes],
+            "Material Class III": [c[2] for c in classes],
+        }
+    )
+
+
+def _write_reference_data(
+    paths: Dict[str, Path], items: pd.DataFrame, trial_ids: List[str]
+) -> None:
+    """Writes the item inventory, trial details and related reference files."""
+    # Some inventory rows are missing IDs, which are filled from old_items.json
+    inventory = items.copy()
+    missing_id = inventory.index[len(CLOSED_LOOP_ITEM_IDS) :: 10]
+    paths["OLD_ITEMS_JSON"].write_text(
+        json.dumps(
+            inventory.loc[missing_id]
+            .set_index("Item Description Refined")["Item ID"]
+            .to_dict()
+        )
+    )
+    inventory.loc[missing_id, "Item ID"] = None
+
+    brands = pd.DataFrame({"Brand": [f"Company {i}" for i in range(25)]})
+    # Only some brands have a display name, the rest are numbered
+    brands["Brand for Display"] = [
+        f"Brand {chr(ord('A') + i)}" if i % 2 == 0 else None for i in range(25)
+    ]
+    with pd.ExcelWriter(paths["ITEMS_PATH"]) as writer:
+        _write_sheet(writer, inventory, "Item Inventory", skiprows=3)
+        _write_sheet(writer, brands, "Company Anonymization")
+
+    pd.DataFrame(
+        {
+            "OG Description": [
+                f"Legacy name for {item_id}" for item_id in items["Item ID"]
+            ],
+            "Item ID": items["Item ID"],
+        }
+    ).to_excel(paths["EXTRA_ITEMS_PATH"], index=False)
+
+    pd.DataFrame(
+        {
+            "Public Trial ID": trial_ids,
+            "Test Method": [
+                "Bulk Dose" if i % 8 == 7 else "Mesh Bag"
+                for i in range(len(trial_ids))
+            ],
+            "Display Method": "Mesh Bag",
+        }
+    ).to_excel(paths["TRIALS_PATH"], index=False)
+
+
+def _write_operating_conditions(path: Path, rng: np.random.Generator) -> None:
+    """Writes the facility conditions workbook."""
+    facilities = _facilities()
+    trial_duration = pd.DataFrame(
+        {
+            "Facility \nDesignation": [
+                name.replace("(", "( ") for name in facilities
+            ],
+            "Endpoint Analysis \n(trial length)": rng.integers(
+                30, 120, len(facilities)
+            ),
+        }
+    )
+    temperatures = pd.DataFrame(
+        rng.normal(130, 15, (120, len(facilities))).round(1),
+        columns=facilities,
+    )
+    temperatures.insert(0, "Time Step", range(1, 121))
+
+    def weekly(mean: float) -> pd.DataFrame:
+        # Some facility headers are starred and there is a summary row
+        columns = [
+            name + "*" if i % 3 == 0 else name
+            for i, name in enumerate(facilities)
+        ]
+        weeks = pd.DataFrame(
+            rng.normal(mean, 5, (16, len(facilities))).round(1),
+            columns=columns,
+        )
+        weeks.insert(0, "Week", list(range(1, 16)) + ["Average"])
+        return weeks
+
+    with pd.ExcelWriter(path) as writer:
+        _write_unused_sheet(writer, "Overview")
+        _write_unused_sheet(writer, "Facility Details")
+        _write_sheet(writer, trial_duration, "Trial Duration", skiprows=3)
+        _write_sheet(writer, temperatures, "Temperature", skiprows=1)
+        _write_sheet(writer, weekly(55), "Moisture", skiprows=1)
+        _write_unused_sheet(writer, "Notes")
+        _write_sheet(writer, weekly(12), "Oxygen", skiprows=1)
+
+
+def _percentages(rng: np.random.Generator, size: int) -> List[str]:
+    """Makes residual percentages as text, with some missing values."""
+    values = rng.uniform(0, 110, size)
+    return [
+        "no data" if rng.uniform() < 0.05 else f"{value:.1f}%"
+        for value in values
+    ]
+
+
+def _write_new_template(
+    path: Path,
+    items: pd.DataFrame,
+    trial_ids: List[str],
+    rng: np.random.Generator,
+) -> None:
+    """Writes the standardized template CSV with its trailing comments."""
+    frames = []
+    for trial_id in trial_ids:
+        tested = items.sample(
+            min(ITEMS_PER_TRIAL, len(items)), random_state=rng
+        )
+        size = len(tested)
+        frames.append(
+            pd.DataFrame(
+                {
+                    "Trial": trial_id,
+                    "Item Name": tested["Item Name"].to_numpy(),
+                    "% Residuals (Dry Weight)": _percentages(rng, size),
+                    "% Residuals (Wet Weight)": _percentages(rng, size),
+                    "% Residuals (Area)": _percentages(rng, size),
+                    "Notes": None,
+                }
+            )
+        )
+    data = pd.concat(frames, ignore_index=True)
+    # Dry weight is often not measured
+    data.loc[data.index % 3 == 0, "% Residuals (Dry Weight)"] = None
+    comments = (
+        ",,,,,\n"
+        "Instructions,Enter one row per item per trial,,,,\n"
+        "Contact,cftp@example.org,,,,\n"
+    )
+    path.write_text(data.to_csv(index=False) + comments, encoding="ISO-8859-1")
+
+
+def _write_casp004(
+    path: Path, items: pd.DataFrame, num_rows: int, rng: np.random.Generator
+) -> None:
+    """Writes the CASP004 workbook with its own item weights sheet."""
+    product_names = items["Item Description Refined"].str.strip()
+    products = product_names.sample(
+        num_rows, replace=True, random_state=rng
+    ).to_numpy()
+    weights = pd.DataFrame(
+        rng.uniform(0, 5, (num_rows, 3)).round(2),
+        columns=["Weight 1", "Weight 2", "Weight 3"],
+    )
+    # Fully disintegrated items have no weights recorded
+    weights[rng.uniform(size=num_rows) < 0.2] = np.nan
+    data = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "Trial Id": "CASP004-01",
+                    "Stage": rng.choice(["Start", "End"], num_rows),
+                    "Bag Id": [f"A-{i % 12 + 1}" for i in range(num_rows)],
+                    "Product Name": products,
+                }
+            ),
+            weights,
+        ],
+        axis=1,
+    )
+    casp004_items = pd.DataFrame(
+        {
+            "Item Name": product_names,
+            "Weight (average)": rng.uniform(3, 8, len(items)).round(2),
+        }
+    )
+    with pd.ExcelWriter(path) as writer:
+        _write_unused_sheet(writer, "Overview")
+        _write_sheet(writer, data, "Results")
+        _write_sheet(writer, casp004_items, "Items")
+
+
+def _write_closed_loop(
+    path: Path, bags_per_facility: int, rng: np.random.Generator
+) -> None:
+    """Writes the donated field results with item IDs pivoted to columns."""
+
+    def results(facility_col: str) -> pd.DataFrame:
+        records = []
+        for name in _facilities():
+            for stage in ["First Removal", "Second Removal"]:
+                for bag in range(bags_per_facility):
+                    records.append(
+                        {
+                            facility_col: TRIAL_TO_ID_MAP[name]
+                            if facility_col == "Trial ID"
+                            else name,
+                            "Trial Stage": stage,
+                            "Bag Set": bag // 3 + 1,
+                            "Bag Number": bag + 1,
+                        }
+                    )
+        data = pd.DataFrame(records)
+        values = rng.uniform(0, 1.2, (len(data), len(CLOSED_LOOP_ITEM_IDS)))
+        # Not every item is in every bag
+        values[rng.uniform(size=values.shape) < 0.2] = np.nan
+        return pd.concat(
+            [data, pd.DataFrame(values.round(3), columns=CLOSED_LOOP_ITEM_IDS)],
+            axis=1,
+        )
+
+    with pd.ExcelWriter(path) as writer:
+        for sheet_name in ["Overview", "Facilities", "Items"]:
+            _write_unused_sheet(writer, sheet_name)
+        _write_sheet(writer, results("Trial ID"), "Weight", skiprows=2)
+        _write_sheet(writer, results("Facility Name"), "Area", skiprows=2)
+
+
+def _write_pdf_trials(
+    path: Path, items: pd.DataFrame, num_rows: int, rng: np.random.Generator
+) -> None:
+    """Writes the gathered field results, one sheet per PDF trial."""
+    with pd.ExcelWriter(path) as writer:
+        for sheet_index, trial_id in enumerate(PDF_TRIAL_IDS):
+            tested = items.sample(num_rows, replace=True, random_state=rng)
+            descriptions = tested["Item Description Refined"].to_numpy(
+                copy=True
+            )
+            # Some trials describe items by their legacy names
+            legacy = rng.uniform(size=num_rows) < 0.1
+            descriptions[legacy] = [
+                f"Legacy name for {item_id}"
+                for item_id in tested["Item ID"].to_numpy()[legacy]
+            ]
+            weights = rng.uniform(0, 15, (num_rows, 3)).round(2)
+            data = pd.DataFrame(
+                {
+                    "Trial ID": trial_id,
+                    "Item Description From Trial": tested[
+                        "Item Name"
+                    ].str.upper(),
+                    "Item Description Refined": descriptions,
+                    "Number of Items per bag": rng.integers(1, 4, num_rows),
+                    "Trial Bag Colour": rng.choice(
+                        ["Blue", "Red", "Green"], num_rows
+                    ),
+                    "Residual Weight - Oven-dry": weights[:, 0],
+                    "Final Residual Weight - wet - aggregate": weights[:, 1],
+                    "Final Residual Weight - wet": weights[:, 2],
+                }
+            )
+            _write_sheet(
+                writer,
+                data,
+                trial_id,
+                # Only the first sheet has a title row above the header
+                skiprows=1 if sheet_index == 0 else 0,
+            )
+
+
+def generate_synthetic_data(
+    output_dir: Path,
+    trial_scale: int = 1,
+    item_scale: int = 1,
+    seed: int = 0,
+) -> Tuple[Dict[str, Path], Dict[str, Path]]:
+    """Writes a full set of synthetic pipeline inputs.
+
+    At scale 1 the files are roughly the size of the current CFTP data.
+    trial_scale multiplies the number of new template trials and the rows
+    of every legacy trial, item_scale multiplies the item inventory.
+
+    Args:
+        output_dir: Directory to write the files to. Created if missing.
+        trial_scale: Multiplier for the number of trials and trial rows.
+            Defaults to 1.
+        item_scale: Multiplier for the number of inventory items.
+            Defaults to 1.
+        seed: Random seed. Defaults to 0.
+
+    Returns:
+        The reference data paths and the trial data paths, keyed like
+        DATA_SHEET_PATHS and TRIAL_DATA_PATHS.
+    """
+    rng = np.random.default_rng(seed)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    data_sheet_paths, trial_data_paths = synthetic_paths(output_dir)
+
+    items = _make_items(BASE_ITEMS * item_scale)
+    new_template_trials = [
+        f"{TECHNOLOGY_PREFIXES[i % len(TECHNOLOGY_PREFIXES)]}{100 + i:03d}-01"
+        for i in range(BASE_NEW_TEMPLATE_TRIALS * trial_scale)
+    ]
+    trial_ids = (
+        new_template_trials
+        + ["CASP004-01"]
+        + [TRIAL_TO_ID_MAP[name] for name in _facilities()]
+        + PDF_TRIAL_IDS
+    )
+
+    _write_reference_data(data_sheet_paths, items, trial_ids)
+    _write_operating_conditions(
+        data_sheet_paths["OPERATING_CONDITIONS_PATH"], rng
+    )
+    _write_new_template(
+        trial_data_paths["NEW_TEMPLATE_PATH"], items, new_template_trials, rng
+    )
+    _write_casp004(
+        trial_data_paths["CASP004_PATH"],
+        items,
+        BASE_CASP004_ROWS * trial_scale,
+        rng,
+    )
+    _write_closed_loop(
+        trial_data_paths["TEN_TRIALS_PATH"],
+        BASE_BAGS_PER_FACILITY * trial_scale,
+        rng,
+    )
+    _write_pdf_trials(
+        trial_data_paths["PDF_TRIALS"],
+        items,
+        BASE_PDF_ROWS * trial_scale,
+        rng,
+    )
+    return data_sheet_paths, trial_data_paths
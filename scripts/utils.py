@@ -3,10 +3,21 @@
 # This class and functions only work with access to
 # data that are not present in the repo during testing.
 import json
+import re
+from functools import lru_cache
 from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
-from constants import DATA_SHEET_PATHS, ID_TO_TECHNOLOGY_MAP, TRIAL_TO_ID_MAP
+from constants import (
+    DATA_SHEET_PATHS,
+    ID_TO_TECHNOLOGY_MAP,
+    OPERATING_CONDITION_ROLLUPS,
+    OPERATING_CONDITION_SHEETS,
+    TRIAL_TO_ID_MAP,
+)
+from workbooks import read_excel, read_excel_sheets
 
 
 def anonymize_brand(brand: str, brand_mapping: dict):
@@ -36,6 +47,62 @@ def anonymize_brand(brand: str, brand_mapping: dict):
         return anon_brand
 
 
+def anonymize_brands(brands: pd.Series, brand_mapping: dict) -> pd.Series:
+    """Anonymizes a column of brand names.
+
+    Gives the same labels as applying anonymize_brand to each row in order,
+    but looks up each distinct brand once. Brands missing from brand_mapping
+    are numbered in order of first appearance and added to brand_mapping in
+    place, so the updated mapping can be persisted.
+
+    >>> brand_mapping = {"Brand 1": "Brand A", "Brand 2": 3}
+    >>> brands = pd.Series(["New 1", "Brand 1", "New 2", "New 1", "Brand 2"])
+    >>> anonymize_brands(brands, brand_mapping).tolist()
+    ['Brand 4', 'Brand A', 'Brand 5', 'Brand 4', 'Brand 3']
+    >>> brand_mapping["New 2"]
+    5
+
+    Args:
+        brands: The brand names.
+        brand_mapping: Mapping of brand names to display names or numeric
+            brand IDs. Updated in place with any new brands.
+
+    Returns:
+        The anonymized brand names (eg "Brand A"), aligned with brands.
+    """
+    codes, uniques = pd.factorize(brands, use_na_sentinel=False)
+    numeric_brands = [
+        value for value in brand_mapping.values() if isinstance(value, int)
+    ]
+    next_numeric = (max(numeric_brands) if numeric_brands else 0) + 1
+    labels = []
+    for brand in uniques:
+        if brand not in brand_mapping:
+            brand_mapping[brand] = next_numeric
+            next_numeric += 1
+        anon_brand = brand_mapping[brand]
+        labels.append(
+            f"Brand {anon_brand}" if isinstance(anon_brand, int) else anon_brand
+        )
+    return pd.Series(
+        np.array(labels, dtype=object)[codes],
+        index=brands.index,
+        name=brands.name,
+    )
+
+
+# Trial IDs start with a technology prefix (eg "CASP004-01"). Longer
+# prefixes are tried first so that "CASP" and "EASP" are never read as "ASP".
+TECHNOLOGY_PREFIX_PATTERN = re.compile(
+    "^("
+    + "|".join(
+        re.escape(prefix)
+        for prefix in sorted(ID_TO_TECHNOLOGY_MAP, key=len, reverse=True)
+    )
+    + ")"
+)
+
+
 def map_technology(trial_id: str) -> str:
     """Maps trial IDs to the technology used in the trial.
     >>> map_technology('EASP')
@@ -47,10 +114,457 @@ def map_technology(trial_id: str) -> str:
     Returns:
         The technology used in the trial.
     """
-    for key in ID_TO_TECHNOLOGY_MAP:
-        if key in trial_id:
-            return ID_TO_TECHNOLOGY_MAP[key]
-    return "Unknown"
+    match = TECHNOLOGY_PREFIX_PATTERN.match(trial_id)
+    if match is None:
+        return "Unknown"
+    return ID_TO_TECHNOLOGY_MAP[match.group(1)]
+
+
+def map_technologies(trial_ids: pd.Series) -> pd.Series:
+    """Maps a column of trial IDs to the technology used in each trial.
+
+    Each distinct trial ID is classified once by its prefix.
+
+    >>> trial_ids = pd.Series(["CASP004-01", "ASP001-01", "WR004-01", "X1"])
+    >>> map_technologies(trial_ids).tolist()
+    ['Aerated Static Pile', 'Aerated Static Pile', 'Windrow', 'Unknown']
+
+    Args:
+        trial_ids: The trial IDs.
+
+    Returns:
+        The technology used in each trial, aligned with trial_ids.
+    """
+    codes, uniques = pd.factorize(trial_ids, use_na_sentinel=False)
+    technologies = (
+        pd.Series(uniques, dtype=object)
+        .str.extract(TECHNOLOGY_PREFIX_PATTERN, expand=False)
+        .map(ID_TO_TECHNOLOGY_MAP)
+        .fillna("Unknown")
+    )
+    return pd.Series(
+        technologies.to_numpy()[codes],
+        index=trial_ids.index,
+        name=trial_ids.name,
+    )
+
+
+def normalize_item_names(names: pd.Series) -> pd.Series:
+    """Normalizes item names or descriptions for lookups.
+
+    >>> normalize_item_names(pd.Series([" Compostable Cup ", "LID"])).tolist()
+    ['compostable cup', 'lid']
+
+    Args:
+        names: The item names.
+
+    Returns:
+        The names without surrounding whitespace, in lower case.
+    """
+    return names.str.strip().str.casefold()
+
+
+# Whether the left and right keys must be unique for each join cardinality
+JOIN_CARDINALITIES = {
+    "one_to_one": (True, True),
+    "one_to_many": (True, False),
+    "many_to_one": (False, True),
+    "many_to_many": (False, False),
+}
+
+
+class JoinCardinalityError(ValueError):
+    """Raised when the keys of a join are not as unique as declared.
+
+    Attributes:
+        side: Which side of the join has duplicate keys, "left" or "right".
+        duplicates: Number of rows with each duplicate key.
+    """
+
+    def __init__(self, side: str, duplicates: pd.Series, validate: str):
+        """Initializes the JoinCardinalityError.
+
+        Args:
+            side: Which side of the join has duplicate keys.
+            duplicates: Number of rows with each duplicate key.
+            validate: The declared cardinality of the join.
+        """
+        self.side = side
+        self.duplicates = duplicates
+        shown = duplicates.head(10).to_dict()
+        more = len(duplicates) - len(shown)
+        super().__init__(
+            f"{len(duplicates)} {side} keys of a {validate} join are "
+            f"duplicated and would multiply rows (rows per key: {shown}"
+            + (f" and {more} more" if more > 0 else "")
+            + ")"
+        )
+
+
+def duplicate_keys(keys: Union[pd.DataFrame, pd.Index, pd.Series]) -> pd.Series:
+    """Counts the rows of each duplicated join key.
+
+    Only the key columns are compared. Missing keys count as equal to each
+    other, as they are in a pandas index and in merge, so callers that
+    leave out rows without a key drop them before checking.
+
+    >>> duplicate_keys(pd.Series(["a", "b", "a", None, None])).to_dict()
+    {'a': 2, None: 2}
+
+    Args:
+        keys: Key columns, or the key of each row.
+
+    Returns:
+        Number of rows with each key that appears more than once, indexed
+        by key.
+    """
+    if isinstance(keys, pd.Index):
+        keys = keys.to_series()
+    duplicated = keys[keys.duplicated(keep=False)]
+    if isinstance(duplicated, pd.DataFrame):
+        return duplicated.value_counts(sort=False, dropna=False)
+    return duplicated.value_counts(sort=False, dropna=False).rename(None)
+
+
+def check_unique_keys(
+    keys: Union[pd.DataFrame, pd.Index, pd.Series], side: str, validate: str
+) -> None:
+    """Raises if any join key appears more than once.
+
+    Args:
+        keys: Key columns, or the key of each row.
+        side: Which side of the join the keys are from.
+        validate: The declared cardinality of the join.
+
+    Raises:
+        JoinCardinalityError: If any key is duplicated.
+    """
+    if isinstance(keys, pd.Index) and keys.is_unique:
+        return
+    duplicates = duplicate_keys(keys)
+    if len(duplicates):
+        raise JoinCardinalityError(side, duplicates, validate)
+
+
+def checked_merge(
+    left: pd.DataFrame,
+    right: pd.DataFrame,
+    validate: str,
+    on: Optional[Union[str, List[str]]] = None,
+    left_on: Optional[Union[str, List[str]]] = None,
+    right_on: Optional[Union[str, List[str]]] = None,
+    left_index: bool = False,
+    right_index: bool = False,
+    **kwargs: Any,
+) -> pd.DataFrame:
+    """Merges two tables after checking the declared cardinality.
+
+    Like DataFrame.merge(validate=...), but the keys are checked before
+    joining, using only the key columns, and the error reports the
+    duplicated keys.
+
+    >>> trials = pd.DataFrame({"Trial": ["A", "B", "A"], "Days": [1, 2, 3]})
+    >>> data = pd.DataFrame({"Trial": ["A", "B"]})
+    >>> try:
+    ...     checked_merge(data, trials, "many_to_one", on="Trial")
+    ... except JoinCardinalityError as error:
+    ...     print(error.side, error.duplicates.to_dict())
+    right {'A': 2}
+
+    Args:
+        left: Left table.
+        right: Right table.
+        validate: Expected cardinality, "one_to_one", "one_to_many",
+            "many_to_one" or "many_to_many".
+        on: Key columns of both tables. Defaults to None.
+        left_on: Key columns of left. Defaults to None.
+        right_on: Key columns of right. Defaults to None.
+        left_index: Whether the index of left is its key. Defaults to False.
+        right_index: Whether the index of right is its key. Defaults to
+            False.
+        **kwargs: Other arguments to DataFrame.merge, such as how.
+
+    Returns:
+        The merged table.
+
+    Raises:
+        JoinCardinalityError: If the keys of a side declared "one" are
+            duplicated.
+    """
+
+    def keys(
+        frame: pd.DataFrame, cols: Optional[Union[str, List[str]]], index: bool
+    ) -> Union[pd.DataFrame, pd.Index, pd.Series]:
+        if index:
+            return frame.index
+        return frame[cols]
+
+    if validate not in JOIN_CARDINALITIES:
+        raise ValueError(f"Unknown join cardinality {validate!r}")
+    left_unique, right_unique = JOIN_CARDINALITIES[validate]
+    if left_unique:
+        check_unique_keys(
+            keys(left, on if on is not None else left_on, left_index),
+            "left",
+            validate,
+        )
+    if right_unique:
+        check_unique_keys(
+            keys(right, on if on is not None else right_on, right_index),
+            "right",
+            validate,
+        )
+    return left.merge(
+        right,
+        on=on,
+        left_on=left_on,
+        right_on=right_on,
+        left_index=left_index,
+        right_index=right_index,
+        **kwargs,
+    )
+
+
+def index_items(
+    items: pd.DataFrame, keys: pd.Series, unique: bool = False
+) -> pd.DataFrame:
+    """Builds a lookup table of items with one row per key.
+
+    Args:
+        items: Item information.
+        keys: Lookup key of each item, aligned with items. Items with a
+            missing key are dropped, and only the first item with each key
+            is kept.
+        unique: Whether keys must be unique, eg item IDs. Defaults to
+            False.
+
+    Returns:
+        The items indexed by key.
+
+    Raises:
+        JoinCardinalityError: If unique and any key is duplicated.
+    """
+    if unique:
+        check_unique_keys(keys.dropna(), "item", "many_to_one")
+    keep = keys.notna() & ~keys.duplicated()
+    return items[keep].set_axis(pd.Index(keys[keep], name=keys.name))
+
+
+def join_items(
+    data: pd.DataFrame, item_index: pd.DataFrame, keys: pd.Series
+) -> pd.DataFrame:
+    """Joins each row of data with the item information for its key.
+
+    Each key is a hash lookup in the index of item_index. Rows whose key
+    is not in item_index are dropped. Rows are ordered like item_index, as
+    they would be from item_index.merge(data), and columns of data take
+    precedence over item columns with the same name.
+
+    >>> item_index = pd.DataFrame({"Name": ["a", "b"]}, index=[1, 2])
+    >>> data = pd.DataFrame({"Item ID": [2, 3, 1], "x": [0.2, 0.3, 0.1]})
+    >>> join_items(data, item_index, data["Item ID"])
+      Name  Item ID    x
+    0    a        1  0.1
+    1    b        2  0.2
+
+    Args:
+        data: Data to join.
+        item_index: Item information, indexed by a unique key.
+        keys: Key of each row of data.
+
+    Returns:
+        Item information followed by the columns of data.
+
+    Raises:
+        JoinCardinalityError: If item_index has duplicate keys.
+    """
+    check_unique_keys(item_index.index, "item", "many_to_one")
+    positions = item_index.index.get_indexer(keys)
+    found = np.flatnonzero(positions >= 0)
+    # Stable, so rows for the same item keep their order in data
+    order = found[np.argsort(positions[found], kind="stable")]
+    item_cols = [col for col in item_index.columns if col not in data.columns]
+    return pd.concat(
+        [
+            item_index[item_cols].iloc[positions[order]].reset_index(drop=True),
+            data.iloc[order].reset_index(drop=True),
+        ],
+        axis=1,
+    )
+
+
+def load_condition_sheets(
+    path: Path,
+    sheet_specs: Dict[str, Dict[str, Any]] = OPERATING_CONDITION_SHEETS,
+) -> Dict[str, pd.DataFrame]:
+    """Loads operating condition sheets described by sheet_specs.
+
+    All sheets are read from the workbook in one pass per skiprows value.
+    Each sheet is indexed by its time steps and its facility headers are
+    mapped to trial IDs.
+
+    Args:
+        path: Path to the operating conditions workbook.
+        sheet_specs: Mapping of condition names to sheet specs (see
+            OPERATING_CONDITION_SHEETS). Defaults to
+            OPERATING_CONDITION_SHEETS.
+
+    Returns:
+        Mapping of condition names to tables with one row per time step
+        and one column per trial ID.
+
+    Raises:
+        KeyError: If a sheet has a facility that is not in TRIAL_TO_ID_MAP
+            and the spec does not allow unknown trials.
+    """
+    sheets = {}
+    for skiprows in {spec["skiprows"] for spec in sheet_specs.values()}:
+        sheets[skiprows] = read_excel_sheets(
+            path,
+            [
+                spec["sheet_name"]
+                for spec in sheet_specs.values()
+                if spec["skiprows"] == skiprows
+            ],
+            skiprows=skiprows,
+        )
+
+    conditions = {}
+    for name, spec in sheet_specs.items():
+        sheet = sheets[spec["skiprows"]][spec["sheet_name"]]
+        steps = sheet[spec["time_col"]]
+        values = sheet.drop(columns=spec["time_col"])
+        if spec["numeric_steps_only"]:
+            # Drops notes and summary rows below the data
+            is_step = pd.to_numeric(steps, errors="coerce").notna()
+            steps, values = steps[is_step], values[is_step]
+        if spec["known_trials_only"]:
+            values = values.loc[:, values.columns.isin(TRIAL_TO_ID_MAP.keys())]
+        trial_ids = values.columns.str.replace("*", "", regex=False).map(
+            TRIAL_TO_ID_MAP
+        )
+        if trial_ids.isna().any():
+            unknown = values.columns[trial_ids.isna()].tolist()
+            raise KeyError(f"Unknown facilities in {name} sheet: {unknown}")
+        conditions[name] = values.set_axis(trial_ids, axis=1).set_axis(
+            pd.Index(steps, name=spec["time_col"]), axis=0
+        )
+    return conditions
+
+
+def conditions_to_long(conditions: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """Reshapes operating condition tables into one row per measurement.
+
+    >>> conditions = {
+    ...     "Moisture": pd.DataFrame(
+    ...         {"WR004-01": [50.0, None], "IV002-01": [40.0, 45.0]},
+    ...         index=pd.Index([1, 2], name="Week"),
+    ...     )
+    ... }
+    >>> conditions_to_long(conditions)
+       Trial ID Operating Condition Time Unit  Time Step  Value
+    0  WR004-01            Moisture      Week          1   50.0
+    1  IV002-01            Moisture      Week          1   40.0
+    2  IV002-01            Moisture      Week          2   45.0
+
+    Args:
+        conditions: Mapping of condition names to tables with one row per
+            time step and one column per trial ID, as returned by
+            load_condition_sheets. Condition names must be in
+            OPERATING_CONDITION_SHEETS.
+
+    Returns:
+        Measurements ordered by condition, time step and trial, without
+        missing values.
+    """
+    frames = []
+    for name, df_condition in conditions.items():
+        long = (
+            df_condition.rename_axis(index="Time Step", columns="Trial ID")
+            .stack(future_stack=True)
+            .dropna()
+            .rename("Value")
+            .reset_index()
+        )
+        long.insert(1, "Operating Condition", name)
+        long.insert(
+            2, "Time Unit", OPERATING_CONDITION_SHEETS[name]["time_unit"]
+        )
+        frames.append(long)
+    return pd.concat(frames, ignore_index=True)[
+        ["Trial ID", "Operating Condition", "Time Unit", "Time Step", "Value"]
+    ]
+
+
+def roll_up_conditions(
+    df_long: pd.DataFrame,
+    periods: Dict[str, int] = OPERATING_CONDITION_ROLLUPS,
+) -> pd.DataFrame:
+    """Averages daily operating conditions over longer periods.
+
+    >>> df_long = pd.DataFrame({
+    ...     "Trial ID": "WR004-01",
+    ...     "Operating Condition": "Temperature",
+    ...     "Time Unit": "Day",
+    ...     "Time Step": range(1, 11),
+    ...     "Value": [130.0] * 7 + [140.0] * 3,
+    ... })
+    >>> roll_up_conditions(df_long, {"Week": 7})[["Time Step", "Value", "Count"]]
+       Time Step  Value  Count
+    0          1  130.0      7
+    1          2  140.0      3
+
+    Args:
+        df_long: Measurements, as returned by conditions_to_long.
+            Measurements with a time unit other than "Day" are ignored.
+        periods: Mapping of period names to their length in days. Defaults
+            to OPERATING_CONDITION_ROLLUPS.
+
+    Returns:
+        The mean, minimum, maximum and number of measurements of each
+        trial and condition in each period, numbered from 1.
+    """
+    daily = df_long[df_long["Time Unit"] == "Day"]
+    days = pd.to_numeric(daily["Time Step"], errors="coerce")
+    daily, days = daily[days.notna()], days[days.notna()]
+    rollups = []
+    for period, length in periods.items():
+        rollup = (
+            daily.assign(
+                **{
+                    "Time Unit": period,
+                    "Time Step": ((days - 1) // length + 1).astype(int),
+                }
+            )
+            .groupby(
+                ["Trial ID", "Operating Condition", "Time Unit", "Time Step"],
+                sort=False,
+            )["Value"]
+            .agg(Value="mean", Min="min", Max="max", Count="count")
+            .reset_index()
+        )
+        rollups.append(rollup)
+    return pd.concat(rollups, ignore_index=True)
+
+
+def condition_averages(
+    df_condition: pd.DataFrame, spec: Dict[str, Any]
+) -> pd.DataFrame:
+    """Averages each trial's operating condition over its time steps.
+
+    Args:
+        df_condition: Table with one row per time step and one column per
+            trial ID, as returned by load_condition_sheets.
+        spec: Sheet spec with average_col and average_steps.
+
+    Returns:
+        The average of each trial, indexed by trial ID.
+    """
+    return (
+        df_condition.iloc[0 : spec["average_steps"]]
+        .mean()
+        .to_frame(spec["average_col"])
+    )
 
 
 class DefaultDataFrames:
@@ -58,10 +572,14 @@ class DefaultDataFrames:
     Class to store default dataframes for the pipeline.
     Methods
     -------
-    __init__():
-        Initializes the DefaultDataFrames class and loads all dataframes.
+    __init__(paths):
+        Initializes the DefaultDataFrames class and loads all dataframes
+        from the reference files in paths (defaults to DATA_SHEET_PATHS).
     load_items_df():
         Loads the items dataframe from an Excel file and processes it.
+    load_item_index():
+        Builds lookup tables of items keyed by Item ID and by normalized
+        Item Name.
     load_items2id():
         Loads a mapping of item descriptions to item
         IDs from the items dataframe and an additional Excel file.
@@ -75,27 +593,38 @@ class DefaultDataFrames:
 
     """
 
-    def __init__(self):
+    def __init__(self, paths: Optional[Dict[str, Path]] = None):
+        self.paths = DATA_SHEET_PATHS if paths is None else paths
         self.load_items_df()
+        self.load_item_index()
         self.load_items2id()
         self.load_df_trials()
         self.load_operating_conditions()
         self.load_brand_mapping()
 
     def load_items_df(self):
-        df_items = pd.read_excel(
-            DATA_SHEET_PATHS.get("ITEMS_PATH"),
+        df_items = read_excel(
+            self.paths.get("ITEMS_PATH"),
             sheet_name="Item Inventory",
             skiprows=3,
         )
         df_items["Start Weight"] = df_items["Average Initial Weight, g"]
-        old_json = json.load(Path.open(DATA_SHEET_PATHS.get("OLD_ITEMS_JSON")))
+        old_json = json.load(Path.open(self.paths.get("OLD_ITEMS_JSON")))
         df_items["Item ID"] = df_items["Item ID"].fillna(
             df_items["Item Description Refined"].map(old_json)
         )
         df_items = df_items.rename(columns={"Brand": "Item Brand"})
         self.df_items = df_items
 
+    def load_item_index(self):
+        # Pipelines join against these instead of merging df_items
+        self.items_by_id = index_items(
+            self.df_items, self.df_items["Item ID"], unique=True
+        )
+        self.items_by_name = index_items(
+            self.df_items, normalize_item_names(self.df_items["Item Name"])
+        )
+
     def load_items2id(self):
         item2id = {
             key.strip(): value
@@ -106,7 +635,7 @@ class DefaultDataFrames:
             .items()
         }
 
-        extra_items = pd.read_excel(DATA_SHEET_PATHS.get("EXTRA_ITEMS_PATH"))
+        extra_items = read_excel(self.paths.get("EXTRA_ITEMS_PATH"))
         extra_items = extra_items.set_index("OG Description")[
             "Item ID"
         ].to_dict()
@@ -114,7 +643,7 @@ class DefaultDataFrames:
         self.item2id = item2id | extra_items
 
     def load_df_trials(self):
-        self.df_trials = pd.read_excel(DATA_SHEET_PATHS.get("TRIALS_PATH"))[
+        self.df_trials = read_excel(self.paths.get("TRIALS_PATH"))[
             [
                 "Public Trial ID",
                 "Test Method",
@@ -124,8 +653,8 @@ class DefaultDataFrames:
 
     def load_brand_mapping(self):
         # read third sheet
-        brand_mapping_df = pd.read_excel(
-            DATA_SHEET_PATHS.get("BRAND_ANONYMIZATION_PATH"),
+        brand_mapping_df = read_excel(
+            self.paths.get("BRAND_ANONYMIZATION_PATH"),
             sheet_name="Company Anonymization",
         )
         brand_mapping_df = brand_mapping_df[
@@ -138,27 +667,20 @@ class DefaultDataFrames:
         self.brand_mapping = brand_mapping
 
     def load_operating_conditions(self):
-        df_temps = pd.read_excel(
-            DATA_SHEET_PATHS.get("OPERATING_CONDITIONS_PATH"),
-            sheet_name=3,
-            skiprows=1,
-            index_col="Time Step",
-        )
-        df_temps = df_temps[
-            [col for col in df_temps.columns if col in TRIAL_TO_ID_MAP]
-        ]
-        df_temps.columns = [
-            TRIAL_TO_ID_MAP[col.replace("*", "")] for col in df_temps.columns
-        ]
-        # ONLY USE THE FIRST 45 DAYS
-        df_temps_avg = (
-            df_temps.iloc[0:45].mean().to_frame("Average Temperature (F)")
+        conditions = load_condition_sheets(
+            self.paths.get("OPERATING_CONDITIONS_PATH")
         )
-        df_temps["Operating Condition"] = "Temperature"
-        df_temps["Time Unit"] = "Day"
+        self.df_operating_conditions_long = conditions_to_long(conditions)
+        condition_avgs = {
+            name: condition_averages(
+                df_condition, OPERATING_CONDITION_SHEETS[name]
+            )
+            for name, df_condition in conditions.items()
+            if OPERATING_CONDITION_SHEETS[name]["average_col"] is not None
+        }
 
-        df_trial_duration = pd.read_excel(
-            DATA_SHEET_PATHS.get("OPERATING_CONDITIONS_PATH"),
+        df_trial_duration = read_excel(
+            self.paths.get("OPERATING_CONDITIONS_PATH"),
             sheet_name=2,
             skiprows=3,
         )
@@ -181,49 +703,61 @@ class DefaultDataFrames:
         )
         df_trial_duration = df_trial_duration.set_index("Trial ID")
 
-        df_moisture = pd.read_excel(
-            DATA_SHEET_PATHS.get("OPERATING_CONDITIONS_PATH"),
-            sheet_name=4,
-            skiprows=1,
-            index_col="Week",
-        )
-        # Filter out rows with non-numeric week values
-        df_moisture = df_moisture.reset_index()
-        df_moisture = df_moisture[
-            pd.to_numeric(df_moisture["Week"], errors="coerce").notna()
-        ]
-        df_moisture = df_moisture.set_index("Week")
-        df_moisture.columns = [
-            TRIAL_TO_ID_MAP[col.replace("*", "")] for col in df_moisture.columns
-        ]
-        df_moisture_avg = df_moisture.mean().to_frame(
-            "Average % Moisture (In Field)"
-        )
-        df_moisture["Operating Condition"] = "Moisture"
-        df_moisture["Time Unit"] = "Week"
-
-        df_o2 = pd.read_excel(
-            DATA_SHEET_PATHS.get("OPERATING_CONDITIONS_PATH"),
-            sheet_name=6,
-            skiprows=1,
-            index_col="Week",
-        )
-        df_o2 = df_o2.reset_index()
-        df_o2 = df_o2[pd.to_numeric(df_o2["Week"], errors="coerce").notna()]
-        df_o2 = df_o2.set_index("Week")
-        df_o2.columns = [
-            TRIAL_TO_ID_MAP[col.replace("*", "")] for col in df_o2.columns
-        ]
-        df_o2["Operating Condition"] = "Oxygen"
-        df_o2["Time Unit"] = "Week"
-
-        self.df_temps = df_temps
-        self.df_temps_avg = df_temps_avg
-        self.df_moisture = df_moisture
-        self.df_moisture_avg = df_moisture_avg
-        self.df_o2 = df_o2
+        # Wide tables with one column per trial, as used by main()
+        for name, df_condition in conditions.items():
+            df_condition["Operating Condition"] = name
+            df_condition["Time Unit"] = OPERATING_CONDITION_SHEETS[name][
+                "time_unit"
+            ]
+        self.df_temps = conditions["Temperature"]
+        self.df_temps_avg = condition_avgs["Temperature"]
+        self.df_moisture = conditions["Moisture"]
+        self.df_moisture_avg = condition_avgs["Moisture"]
+        self.df_o2 = conditions["Oxygen"]
         self.df_trial_duration = df_trial_duration
 
         self.df_operating_conditions_avg = pd.concat(
-            [df_trial_duration, df_temps_avg, df_moisture_avg], axis=1
+            [df_trial_duration, *condition_avgs.values()], axis=1
+        )
+
+
+@lru_cache(maxsize=4)
+def _load_default_dfs(
+    source_files: Tuple[Tuple[str, str, int], ...]
+) -> DefaultDataFrames:
+    """Loads DefaultDataFrames once per set of (name, path, mtime) entries."""
+    return DefaultDataFrames(
+        {name: Path(path) for name, path, _ in source_files}
+    )
+
+
+def get_default_dfs(
+    paths: Optional[Dict[str, Path]] = None
+) -> DefaultDataFrames:
+    """Returns the shared DefaultDataFrames for the given reference files.
+
+    The reference workbooks are parsed once per process and the result is
+    reused by every pipeline. The cache is keyed on each file's path and
+    modification time, so editing a reference file triggers a reload on the
+    next call.
+
+    Args:
+        paths: Mapping of reference file names to paths.
+            Defaults to DATA_SHEET_PATHS.
+
+    Returns:
+        The shared DefaultDataFrames instance.
+    """
+    paths = DATA_SHEET_PATHS if paths is None else paths
+    source_files = tuple(
+        sorted(
+            (name, str(path), Path(path).stat().st_mtime_ns)
+            for name, path in paths.items()
         )
+    )
+    return _load_default_dfs(source_files)
+
+
+def clear_default_dfs() -> None:
+    """Forgets the shared reference data so the next load re-reads it."""
+    _load_default_dfs.cache_clear()
@@ -0,0 +1,474 @@
+"""Reads worksheets through shared workbook handles and an on-disk cache.
+
+Parsing .xlsx files with openpyxl is the slowest part of the pipeline, and
+the source workbooks rarely change between runs. Each parsed worksheet is
+stored under WORKBOOK_CACHE_DIR, keyed on the source file's content hash
+and the read arguments, so reruns against unchanged files skip parsing.
+Once the cache is larger than WORKBOOK_CACHE_MAX_BYTES, the least recently
+used entries are removed, eg those for files that no longer exist.
+
+On a cache miss, sheets are parsed from a Workbook handle that is opened
+once per file version and process, so several pipelines reading different
+sheets of the same file only pay the zip/XML setup cost once.
+"""
+import hashlib
+import io
+import os
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from constants import (
+    USE_WORKBOOK_CACHE,
+    WORKBOOK_CACHE_DIR,
+    WORKBOOK_CACHE_MAX_BYTES,
+)
+
+SheetName = Union[int, str]
+
+# Defaults come from constants.py and can be changed with configure_cache
+_cache_settings = {
+    "enabled": USE_WORKBOOK_CACHE,
+    "dir": WORKBOOK_CACHE_DIR,
+    "max_bytes": WORKBOOK_CACHE_MAX_BYTES,
+}
+
+
+def configure_cache(
+    enabled: Optional[bool] = None,
+    cache_dir: Optional[Path] = None,
+    max_bytes: Optional[int] = None,
+) -> None:
+    """Changes the worksheet cache settings for this process.
+
+    Forked worker processes inherit the settings in place when they start.
+
+    Args:
+        enabled: Whether reads go through the cache. Unchanged if None.
+        cache_dir: Default directory for cache entries. Unchanged if None.
+        max_bytes: Size the cache is trimmed to after new entries are
+            written. Unchanged if None.
+    """
+    if enabled is not None:
+        _cache_settings["enabled"] = enabled
+    if cache_dir is not None:
+        _cache_settings["dir"] = Path(cache_dir)
+    if max_bytes is not None:
+        _cache_settings["max_bytes"] = max_bytes
+
+
+def cache_settings() -> Dict[str, Any]:
+    """Returns the current worksheet cache settings.
+
+    The result can be passed back to configure_cache to restore them.
+
+    >>> settings = cache_settings()
+    >>> configure_cache(enabled=False)
+    >>> configure_cache(**settings)
+    >>> cache_settings() == settings
+    True
+
+    Returns:
+        The enabled, cache_dir and max_bytes settings.
+    """
+    return {
+        "enabled": _cache_settings["enabled"],
+        "cache_dir": _cache_settings["dir"],
+        "max_bytes": _cache_settings["max_bytes"],
+    }
+
+
+@lru_cache(maxsize=64)
+def _hash_file(path: str, mtime_ns: int, size: int) -> str:
+    """Hashes a file's contents once per (path, mtime, size)."""
+    digest = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_hash(path: Path) -> str:
+    """Returns the SHA-256 hex digest of a file's contents.
+
+    Args:
+        path: Path to the file.
+
+    Returns:
+        The hex digest of the file contents.
+    """
+    path = Path(path).resolve()
+    stat = path.stat()
+    return _hash_file(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+def _cache_prefix(path: Path) -> str:
+    """Returns the cache file prefix shared by all entries for a source file.
+
+    >>> len(_cache_prefix(Path("data.xlsx")))
+    12
+    """
+    resolved = str(Path(path).resolve()).encode()
+    return hashlib.sha256(resolved).hexdigest()[:12]
+
+
+def _args_key(
+    sheet_name: SheetName, skiprows: int, index_col: Optional[str]
+) -> str:
+    """Returns a short, stable key for the read arguments.
+
+    >>> _args_key(0, 1, None) == _args_key(0, 1, None)
+    True
+    >>> _args_key(0, 1, None) == _args_key(1, 0, None)
+    False
+    """
+    args = repr((sheet_name, skiprows, index_col)).encode()
+    return hashlib.sha256(args).hexdigest()[:12]
+
+
+def _evict_stale(cache_dir: Path, prefix: str, content_hash: str) -> None:
+    """Removes cached entries for a source file whose contents have changed."""
+    for entry in cache_dir.glob(f"{prefix}-*"):
+        if entry.suffix == ".tmp":
+            continue
+        if not entry.name.startswith(f"{prefix}-{content_hash[:16]}-"):
+            entry.unlink(missing_ok=True)
+
+
+def _sweep(cache_dir: Path, max_bytes: int) -> None:
+    """Removes the least recently used entries until the cache fits.
+
+    Entries are touched when they are read, so their modification time is
+    when they were last used.
+    """
+    entries = []
+    for entry in cache_dir.glob("*-*-*.*"):
+        if entry.suffix == ".tmp":
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, entry))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        entry.unlink(missing_ok=True)
+        total -= size
+
+
+def _write_entry(data: pd.DataFrame, entry: Path) -> None:
+    """Writes a parsed sheet to the cache.
+
+    Parquet is used whenever pyarrow can represent the frame. Sheets with
+    mixed-type columns (eg a "Week" column holding numbers and a trailing
+    "Average" label) or non-string headers fall back to pickle.
+    """
+    # Write to a per-process temp file so concurrent runs never see a
+    # partially written entry
+    tmp = entry.with_name(f"{entry.name}.{os.getpid()}.tmp")
+    try:
+        data.to_parquet(tmp)
+        tmp.replace(entry.with_suffix(".parquet"))
+    except (ImportError, ValueError, TypeError):
+        tmp.unlink(missing_ok=True)
+        data.to_pickle(tmp)
+        tmp.replace(entry.with_suffix(".pkl"))
+
+
+def _read_parquet_entry(entry: Path) -> pd.DataFrame:
+    """Reads a sheet cached as Parquet, with the dtypes read_excel gives.
+
+    Parquet stores NaN in text columns as null, which reads back as None,
+    so those are turned back into the NaN read_excel gives for empty cells.
+    """
+    data = pd.read_parquet(entry)
+    text_cols = data.select_dtypes(object).columns
+    if len(text_cols):
+        data[text_cols] = data[text_cols].where(data[text_cols].notna(), np.nan)
+    return data
+
+
+def _read_entry(entry: Path) -> Optional[pd.DataFrame]:
+    """Reads a cached sheet, returning None on a cache miss.
+
+    An entry that can't be read, eg one truncated by a full disk, is
+    removed and counts as a miss, so the sheet is parsed and cached again.
+    """
+    for suffix in (".parquet", ".pkl"):
+        path = entry.with_suffix(suffix)
+        try:
+            if suffix == ".parquet":
+                data = _read_parquet_entry(path)
+            else:
+                data = pd.read_pickle(path)  # noqa: S301
+            # Marks the entry as recently used for _sweep
+            os.utime(path)
+        except FileNotFoundError:
+            continue
+        # Parquet and pickle readers raise many error types for bad files
+        except Exception:
+            path.unlink(missing_ok=True)
+            return None
+        return data
+    return None
+
+
+class Workbook:
+    """An Excel file that is opened once and serves many sheet reads.
+
+    The file is read into memory when it is opened, so every sheet parsed
+    from one handle comes from the same version of the file, and the
+    content_hash of that version is known exactly.
+
+    Attributes:
+        path: Path to the Excel file.
+        version: The (st_mtime_ns, st_size) of the file when the handle
+            was created. get_workbook replaces the handle once it changes.
+        content_hash: SHA-256 hex digest of the contents that were opened,
+            or None until the file is opened.
+    """
+
+    def __init__(self, path: Path, version: Tuple[int, int] = (0, 0)) -> None:
+        """Initializes the Workbook without opening the file.
+
+        Args:
+            path: Path to the Excel file.
+            version: The file's (st_mtime_ns, st_size). Defaults to (0, 0).
+        """
+        self.path = Path(path)
+        self.version = version
+        self.content_hash: Optional[str] = None
+        self._excel_file = None
+        # openpyxl workbooks are not safe to read from several threads
+        self._lock = threading.Lock()
+
+    @property
+    def excel_file(self) -> pd.ExcelFile:
+        """The open ExcelFile, opened on first use."""
+        if self._excel_file is None:
+            contents = self.path.read_bytes()
+            self.content_hash = hashlib.sha256(contents).hexdigest()
+            self._excel_file = pd.ExcelFile(io.BytesIO(contents))
+        return self._excel_file
+
+    def parse(
+        self,
+        sheet_name: SheetName = 0,
+        skiprows: int = 0,
+        index_col: Optional[str] = None,
+    ) -> pd.DataFrame:
+        """Parses a single sheet.
+
+        Args:
+            sheet_name: Sheet name or index to load. Defaults to 0.
+            skiprows: Number of rows to skip at the start of the sheet.
+                Defaults to 0.
+            index_col: Column to use as the index. Defaults to None.
+
+        Returns:
+            The parsed sheet.
+        """
+        return self.parse_many([sheet_name], skiprows, index_col)[sheet_name]
+
+    def parse_many(
+        self,
+        sheet_names: Sequence[SheetName],
+        skiprows: int = 0,
+        index_col: Optional[str] = None,
+    ) -> Dict[SheetName, pd.DataFrame]:
+        """Parses several sheets that share read options in a single pass.
+
+        Args:
+            sheet_names: Sheet names or indexes to load.
+            skiprows: Number of rows to skip at the start of each sheet.
+                Defaults to 0.
+            index_col: Column to use as the index. Defaults to None.
+
+        Returns:
+            Mapping of each requested sheet to its parsed DataFrame.
+        """
+        with self._lock:
+            return pd.read_excel(
+                self.excel_file,
+                sheet_name=list(sheet_names),
+                skiprows=skiprows,
+                index_col=index_col,
+            )
+
+    def close(self) -> None:
+        """Closes the underlying file if it is open."""
+        with self._lock:
+            if self._excel_file is not None:
+                self._excel_file.close()
+                self._excel_file = None
+
+
+_workbooks: Dict[str, Workbook] = {}
+_workbooks_pid = os.getpid()
+_workbooks_lock = threading.Lock()
+
+
+def get_workbook(path: Path) -> Workbook:
+    """Returns the shared Workbook handle for the current version of a file.
+
+    Handles are per process: a forked worker never reuses its parent's open
+    file, since the two would share one file offset. Once the file's mtime
+    or size changes, the old handle is closed and a new one is returned.
+
+    Args:
+        path: Path to the Excel file.
+
+    Returns:
+        The Workbook for the file.
+    """
+    global _workbooks_pid
+    path = Path(path).resolve()
+    stat = path.stat()
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _workbooks_lock:
+        if _workbooks_pid != os.getpid():
+            _workbooks.clear()
+            _workbooks_pid = os.getpid()
+        workbook = _workbooks.get(str(path))
+        if workbook is None or workbook.version != version:
+            if workbook is not None:
+                workbook.close()
+            workbook = _workbooks[str(path)] = Workbook(path, version)
+        return workbook
+
+
+def close_workbooks() -> None:
+    """Closes every shared Workbook handle opened by this process."""
+    with _workbooks_lock:
+        if _workbooks_pid == os.getpid():
+            for workbook in _workbooks.values():
+                workbook.close()
+        _workbooks.clear()
+
+
+def _cache_entry(
+    cache_dir: Path,
+    prefix: str,
+    content_hash: str,
+    sheet_name: SheetName,
+    skiprows: int,
+    index_col: Optional[str],
+) -> Path:
+    """Returns the cache entry path, without suffix, for a sheet read."""
+    return cache_dir / (
+        f"{prefix}-{content_hash[:16]}-"
+        f"{_args_key(sheet_name, skiprows, index_col)}"
+    )
+
+
+def read_excel(
+    path: Path,
+    sheet_name: SheetName = 0,
+    skiprows: int = 0,
+    index_col: Optional[str] = None,
+    cache_dir: Optional[Path] = None,
+) -> pd.DataFrame:
+    """Reads a worksheet, using the on-disk cache when the file is unchanged.
+
+    Cache entries are keyed on the file's content hash, so touching or
+    moving a file does not invalidate them but editing it does. Entries for
+    previous versions of a file are evicted when a new version is cached.
+
+    Args:
+        path: Path to the Excel file.
+        sheet_name: Sheet name or index to load. Defaults to 0.
+        skiprows: Number of rows to skip at the start of the sheet.
+            Defaults to 0.
+        index_col: Column to use as the index. Defaults to None.
+        cache_dir: Directory for cache entries. Defaults to the configured
+            directory, initially WORKBOOK_CACHE_DIR.
+
+    Returns:
+        The parsed worksheet.
+    """
+    return read_excel_sheets(
+        path, [sheet_name], skiprows, index_col, cache_dir
+    )[sheet_name]
+
+
+def read_excel_sheets(
+    path: Path,
+    sheet_names: Sequence[SheetName],
+    skiprows: int = 0,
+    index_col: Optional[str] = None,
+    cache_dir: Optional[Path] = None,
+) -> Dict[SheetName, pd.DataFrame]:
+    """Reads several sheets that share read options from one workbook.
+
+    Cached sheets are read from disk. The remaining sheets are parsed
+    together in a single pass over the shared Workbook handle.
+
+    Args:
+        path: Path to the Excel file.
+        sheet_names: Sheet names or indexes to load.
+        skiprows: Number of rows to skip at the start of each sheet.
+            Defaults to 0.
+        index_col: Column to use as the index. Defaults to None.
+        cache_dir: Directory for cache entries. Defaults to the configured
+            directory, initially WORKBOOK_CACHE_DIR.
+
+    Returns:
+        Mapping of each requested sheet to its parsed DataFrame.
+    """
+    workbook = get_workbook(path)
+    if not _cache_settings["enabled"]:
+        return workbook.parse_many(sheet_names, skiprows, index_col)
+
+    cache_dir = _cache_settings["dir"] if cache_dir is None else cache_dir
+    content_hash = _hash_file(str(workbook.path), *workbook.version)
+    prefix = _cache_prefix(path)
+
+    def cache_entries(digest: str) -> Dict[SheetName, Path]:
+        return {
+            sheet_name: _cache_entry(
+                cache_dir, prefix, digest, sheet_name, skiprows, index_col
+            )
+            for sheet_name in sheet_names
+        }
+
+    entries = cache_entries(content_hash)
+    sheets = {
+        sheet_name: _read_entry(entry) for sheet_name, entry in entries.items()
+    }
+    missing: List[SheetName] = [
+        sheet_name for sheet_name, data in sheets.items() if data is None
+    ]
+    if missing:
+        parsed = workbook.parse_many(missing, skiprows, index_col)
+        if workbook.content_hash != content_hash:
+            # The file changed between hashing and opening it: cache what
+            # was parsed under the hash of the opened contents, and parse
+            # every sheet so they all come from that version
+            content_hash = workbook.content_hash
+            entries = cache_entries(content_hash)
+            missing = list(sheet_names)
+            parsed = workbook.parse_many(missing, skiprows, index_col)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        _evict_stale(cache_dir, prefix, content_hash)
+        for sheet_name, data in parsed.items():
+            _write_entry(data, entries[sheet_name])
+            sheets[sheet_name] = data
+        _sweep(cache_dir, _cache_settings["max_bytes"])
+    return sheets
+
+
+def clear_cache(cache_dir: Optional[Path] = None) -> None:
+    """Removes every cached worksheet.
+
+    Args:
+        cache_dir: Directory for cache entries. Defaults to the configured
+            directory, initially WORKBOOK_CACHE_DIR.
+    """
+    cache_dir = _cache_settings["dir"] if cache_dir is None else cache_dir
+    for entry in cache_dir.glob("*-*-*.*"):
+        entry.unlink(missing_ok=True)
@@ -0,0 +1,34 @@
+"""Shared fixtures for the pipeline tests.
+
+The real data files are private, so the tests run the pipeline against the
+synthetic data from scripts/synthetic_data.py.
+"""
+from pathlib import Path
+from types import ModuleType
+from typing import Dict, Tuple
+
+import pytest
+from benchmark import load_run_pipeline
+from synthetic_data import generate_synthetic_data
+
+# Synthetic data at this scale has a few thousand rows, enough for
+# differences in memory use and row handling to show
+SYNTHETIC_SCALE = 5
+
+
+@pytest.fixture(scope="session")
+def run_pipeline() -> ModuleType:
+    """The run-pipeline module."""
+    return load_run_pipeline()
+
+
+@pytest.fixture(scope="session")
+def synthetic_data(
+    tmp_path_factory: pytest.TempPathFactory,
+) -> Tuple[Dict[str, Path], Dict[str, Path]]:
+    """Paths to synthetic reference data and trial data files."""
+    return generate_synthetic_data(
+        tmp_path_factory.mktemp("synthetic"),
+        trial_scale=SYNTHETIC_SCALE,
+        item_scale=SYNTHETIC_SCALE,
+    )
@@ -0,0 +1,70 @@
+"""Checks that faster ways of running the pipeline give the same outputs.
+
+The baseline runs every pipeline serially with the worksheet cache off.
+Every other configuration has to write byte-for-byte identical outputs.
+"""
+import contextlib
+import io
+
+import pytest
+from workbooks import cache_settings, configure_cache
+
+CONFIGURATIONS = {
+    "process": {"backend": "process"},
+    "thread": {"backend": "thread"},
+    "incremental": {"backend": "process", "incremental": True},
+}
+
+
+@contextlib.contextmanager
+def worksheet_cache(**settings):
+    """Changes the worksheet cache settings, then restores them."""
+    previous = cache_settings()
+    configure_cache(**settings)
+    try:
+        yield
+    finally:
+        configure_cache(**previous)
+
+
+def run_main(run_pipeline, synthetic_data, output_dir, **kwargs):
+    """Runs main() and returns the contents of each output CSV."""
+    data_sheet_paths, trial_data_paths = synthetic_data
+    output_dir.mkdir(exist_ok=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_pipeline.main(
+            output_dirs=[output_dir],
+            data_sheet_paths=data_sheet_paths,
+            trial_data_paths=trial_data_paths,
+            **kwargs,
+        )
+    return {path.name: path.read_bytes() for path in output_dir.glob("*.csv")}
+
+
+@pytest.fixture(scope="module")
+def baseline_outputs(run_pipeline, synthetic_data, tmp_path_factory):
+    """Outputs of a serial run without the worksheet cache."""
+    with worksheet_cache(enabled=False):
+        return run_main(
+            run_pipeline,
+            synthetic_data,
+            tmp_path_factory.mktemp("baseline"),
+            backend="serial",
+        )
+
+
+@pytest.mark.parametrize("name", CONFIGURATIONS)
+def test_outputs_match_baseline(
+    name, run_pipeline, synthetic_data, baseline_outputs, tmp_path
+):
+    """Outputs match the baseline with a cold and then a warm cache."""
+    assert "all_trials_processed.csv" in baseline_outputs
+    with worksheet_cache(enabled=True, cache_dir=tmp_path / ".cache"):
+        for run in ["cold", "warm"]:
+            outputs = run_main(
+                run_pipeline,
+                synthetic_data,
+                tmp_path / run,
+                **CONFIGURATIONS[name],
+            )
+            assert outputs == baseline_outputs, run
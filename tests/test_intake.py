@@ -0,0 +1,76 @@
+"""Tests for merging the results of facility submissions."""
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from intake import SubmissionPipeline, discover_submissions, merge_trial_results
+
+
+def submission(name):
+    return SubmissionPipeline(Path(f"{name}.csv"), trial_name=name)
+
+
+def results(*trial_ids):
+    return pd.DataFrame(
+        {"Trial ID": list(trial_ids), "Value": range(len(trial_ids))}
+    )
+
+
+def test_merge_trial_results_leaves_out_failures():
+    """Failed pipelines have no results to merge."""
+    merged = merge_trial_results(
+        [submission("a"), submission("b"), submission("c")],
+        [results("A", "A"), None, results("C")],
+    )
+
+    assert merged["Trial ID"].tolist() == ["A", "A", "C"]
+
+
+def test_merge_trial_results_skips_conflicting_submissions(capsys):
+    """A trial is taken from the first file it is in, reporting the rest."""
+    merged = merge_trial_results(
+        [submission("a"), submission("b")],
+        [results("A", "B"), results("B", "C")],
+    )
+
+    assert merged["Trial ID"].tolist() == ["A", "B", "C"]
+    assert merged["Value"].tolist() == [0, 1, 1]
+    assert "Skipping trial 'B' in b.csv, which is already in a.csv" in (
+        capsys.readouterr().out
+    )
+
+
+def test_merge_trial_results_drops_identical_copies(capsys):
+    """A trial submitted twice with the same rows is kept once, quietly."""
+    merged = merge_trial_results(
+        [submission("a"), submission("b")],
+        [results("A", "B"), results("A", "B")[::-1].reset_index(drop=True)],
+    )
+
+    assert merged["Trial ID"].tolist() == ["A", "B"]
+    assert capsys.readouterr().out == ""
+
+
+def test_merge_trial_results_without_results():
+    """A run where every pipeline failed is a clear error."""
+    with pytest.raises(ValueError, match="Every pipeline failed"):
+        merge_trial_results([submission("a")], [None])
+
+
+def test_merge_trial_results_without_pipelines():
+    """A run with nothing selected is not reported as failures."""
+    with pytest.raises(ValueError, match="No trials were selected"):
+        merge_trial_results([], [])
+
+
+def test_discover_submissions(tmp_path):
+    """Submissions are sorted by path, leaving out pipeline outputs."""
+    for name in ["b.csv", "a.csv", "a_clean.csv", "notes.txt"]:
+        (tmp_path / name).write_text("Trial\n")
+
+    assert discover_submissions(str(tmp_path)) == [
+        tmp_path / "a.csv",
+        tmp_path / "b.csv",
+    ]
+    with pytest.raises(FileNotFoundError):
+        discover_submissions(str(tmp_path / "missing" / "*.csv"))
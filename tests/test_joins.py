@@ -0,0 +1,111 @@
+"""Tests for the join cardinality checks in utils."""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+from pipeline_template import ClosedLoopPipeline
+from utils import JoinCardinalityError, check_unique_keys, checked_merge
+
+TRIALS = pd.DataFrame({"Trial ID": ["A", "B"], "Technology": ["W", "I"]})
+DATA = pd.DataFrame({"Trial ID": ["A", "A", "B"], "Value": [1, 2, 3]})
+
+
+def test_checked_merge_matches_merge():
+    """A join with the declared cardinality is a plain merge."""
+    merged = checked_merge(DATA, TRIALS, "many_to_one", on="Trial ID")
+
+    pd.testing.assert_frame_equal(merged, DATA.merge(TRIALS, on="Trial ID"))
+
+
+def test_checked_merge_reports_duplicate_right_keys():
+    """Duplicate keys on a "one" side are reported with their row counts."""
+    trials = pd.concat([TRIALS, TRIALS.iloc[[0]]], ignore_index=True)
+
+    with pytest.raises(JoinCardinalityError) as error:
+        checked_merge(DATA, trials, "many_to_one", on="Trial ID")
+
+    assert error.value.side == "right"
+    assert error.value.duplicates.to_dict() == {"A": 2}
+
+
+def test_checked_merge_checks_left_keys():
+    """A one_to_one join also checks the left keys."""
+    with pytest.raises(JoinCardinalityError) as error:
+        checked_merge(DATA, TRIALS, "one_to_one", on="Trial ID")
+
+    assert error.value.side == "left"
+
+
+def test_checked_merge_checks_index_keys():
+    """Index keys are checked when joining on the index."""
+    conditions = pd.DataFrame({"Days": [1, 2]}, index=["A", "A"])
+
+    with pytest.raises(JoinCardinalityError):
+        checked_merge(
+            TRIALS.set_index("Trial ID"),
+            conditions,
+            "one_to_one",
+            left_index=True,
+            right_index=True,
+        )
+
+
+def test_checked_merge_allows_many_to_many():
+    """many_to_many joins are not checked."""
+    merged = checked_merge(DATA, DATA, "many_to_many", on="Trial ID")
+
+    assert len(merged) == 5
+
+
+def test_checked_merge_rejects_unknown_cardinality():
+    """The cardinality must be one of JOIN_CARDINALITIES."""
+    with pytest.raises(ValueError, match="Unknown join cardinality"):
+        checked_merge(DATA, TRIALS, "one_to_some", on="Trial ID")
+
+
+def test_check_unique_keys_compares_all_key_columns():
+    """Rows are only duplicates if every key column matches."""
+    keys = pd.DataFrame({"Trial ID": ["A", "A"], "Item ID": [1, 2]})
+
+    check_unique_keys(keys, "left", "one_to_one")
+    with pytest.raises(JoinCardinalityError):
+        check_unique_keys(keys[["Trial ID"]], "left", "one_to_one")
+
+
+def test_check_unique_keys_counts_missing_keys():
+    """Missing keys match each other, as in a pandas index."""
+    check_unique_keys(pd.Series(["A", None]), "left", "one_to_one")
+    with pytest.raises(JoinCardinalityError) as error:
+        check_unique_keys(pd.Series(["A", None, None]), "left", "one_to_one")
+
+    assert error.value.duplicates.to_dict() == {None: 2}
+
+
+def test_stack_items_leaves_out_rows_without_a_bag():
+    """Blank or unmapped rows in one sheet don't stop the sheets aligning."""
+    pipeline = ClosedLoopPipeline(
+        Path("closed_loop.xlsx"),
+        items=pd.DataFrame({"Item ID": ["I1"], "Item Name": ["Cup"]}),
+    )
+    bags = {
+        "Trial ID": ["A", "A"],
+        "Trial Stage": ["Second Removal"] * 2,
+        "Bag Set": [1, 1],
+        "Bag Number": [1, 2],
+        "I1": [0.5, 0.25],
+    }
+    mass = pd.DataFrame(bags)
+    # A blank row, and two rows of a facility without a trial ID
+    area = pd.DataFrame(
+        {
+            column: values + [np.nan, np.nan, values[0]]
+            for column, values in bags.items()
+        }
+    ).assign(**{"Trial ID": ["A", "A", np.nan, np.nan, np.nan]})
+
+    stacked = pipeline.stack_items({"Mass": mass, "Area": area})
+
+    assert stacked["Bag Number"].tolist() == [1, 2]
+    assert stacked["Mass"].tolist() == [0.5, 0.25]
+    assert stacked["Area"].tolist() == [0.5, 0.25]
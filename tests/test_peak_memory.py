@@ -0,0 +1,51 @@
+"""Checks that the pipeline's peak memory stays within budget."""
+import contextlib
+import io
+
+import pandas as pd
+from benchmark import benchmark_clean_trials, benchmark_pipelines
+from schema import concat_tables
+from utils import get_default_dfs
+
+# Peak memory of clean_trials, as a fraction of the size of its input.
+# Filtering with one mask copies the rows once, to about 0.4 of the input;
+# another full copy of the trials would take it over 1.
+CLEAN_TRIALS_MEMORY_BUDGET = 0.75
+# Peak memory of any stage of a trial pipeline on the synthetic data, in
+# MB. They peak at about 1.2 MB.
+PIPELINE_MEMORY_BUDGET_MB = 16
+
+
+def test_clean_trials_peak_memory(run_pipeline, synthetic_data):
+    """clean_trials copies the combined trials at most once."""
+    data_sheet_paths, trial_data_paths = synthetic_data
+    with pd.option_context("mode.copy_on_write", True):
+        default_dfs = get_default_dfs(data_sheet_paths)
+        with contextlib.redirect_stdout(io.StringIO()):
+            all_trials = concat_tables(
+                [
+                    pipeline.run()
+                    for pipeline in run_pipeline.get_trials_to_run(
+                        trial_data_paths, default_dfs
+                    )
+                ]
+            )
+        record = benchmark_clean_trials(
+            run_pipeline, all_trials, default_dfs.brand_mapping
+        )
+
+    input_mb = all_trials.memory_usage(deep=True).sum() / 2**20
+    assert record["peak_memory_mb"] <= CLEAN_TRIALS_MEMORY_BUDGET * input_mb
+
+
+def test_pipeline_peak_memory(run_pipeline, synthetic_data):
+    """No pipeline stage exceeds the memory budget."""
+    records = benchmark_pipelines(run_pipeline, *synthetic_data)
+
+    over_budget = {
+        record["name"]: record["peak_memory_mb"]
+        for record in records
+        if record["benchmark"] == "pipeline"
+        and record["peak_memory_mb"] > PIPELINE_MEMORY_BUDGET_MB
+    }
+    assert not over_budget
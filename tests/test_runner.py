@@ -0,0 +1,127 @@
+"""Tests for selecting and running trial pipelines."""
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from intake import SubmissionPipeline
+from runner import PipelineError, run_pipelines, select_trials
+
+
+class StubPipeline:
+    """Stands in for a trial pipeline, without any data."""
+
+    legacy = False
+
+    def __init__(self, trial_name, fail=False, optional=False):
+        self.trial_name = trial_name
+        self.fail = fail
+        self.optional = optional
+
+    def run(self, **run_kwargs):
+        if self.fail:
+            raise ValueError(f"{self.trial_name} failed")
+        return pd.DataFrame({"Trial ID": [self.trial_name]})
+
+
+@pytest.fixture(scope="module")
+def pipelines(run_pipeline, synthetic_data):
+    """The pipeline of every synthetic trial file, by trial name."""
+    data_sheet_paths, trial_data_paths = synthetic_data
+    return {
+        pipeline.trial_name: pipeline
+        for pipeline in run_pipeline.get_trials_to_run(trial_data_paths)
+    }
+
+
+def trial_names(pipelines):
+    return [pipeline.trial_name for pipeline in pipelines]
+
+
+def test_select_trials_by_name(pipelines):
+    """Trial names are matched case insensitively."""
+    selected = select_trials(list(pipelines.values()), trial_names=["WR001"])
+
+    assert trial_names(selected) == ["wr001"]
+
+
+def test_select_trials_by_technology_keeps_unknown(pipelines):
+    """Files with several trials are kept, to be filtered by row later."""
+    selected = select_trials(list(pipelines.values()), technologies=["Windrow"])
+
+    assert set(trial_names(selected)) == {
+        name
+        for name, pipeline in pipelines.items()
+        if pipeline.technology in ("Windrow", "Unknown")
+    }
+    assert {"wr001", "wr003", "OCT_22_PARTIAL"} <= set(trial_names(selected))
+    assert "casp001" not in trial_names(selected)
+
+
+def test_select_trials_excludes_technologies(pipelines):
+    """Excluded technologies are dropped, keeping the original order."""
+    selected = select_trials(
+        list(pipelines.values()),
+        exclude_technologies=["Anaerobic Digestion"],
+    )
+
+    assert trial_names(selected) == [
+        name for name in pipelines if name != "ad001"
+    ]
+
+
+def test_select_trials_without_legacy(pipelines):
+    """Only pipelines for current data formats are kept without legacy."""
+    selected = select_trials(list(pipelines.values()), include_legacy=False)
+
+    assert selected
+    assert not any(pipeline.legacy for pipeline in selected)
+
+
+def test_submissions_have_unknown_technology():
+    """A submission's file name doesn't decide its technology."""
+    submission = SubmissionPipeline(Path("ADVANCED1.csv"), trial_name="AD1")
+
+    assert submission.technology == "Unknown"
+    assert select_trials(
+        [submission], exclude_technologies=["Anaerobic Digestion"]
+    ) == [submission]
+
+
+@pytest.mark.parametrize("backend", ["serial", "thread", "process"])
+def test_run_pipelines_skips_optional_failures(backend):
+    """A failing optional pipeline gives None and the others still run."""
+    results = run_pipelines(
+        [
+            StubPipeline("a"),
+            StubPipeline("b", fail=True, optional=True),
+            StubPipeline("c"),
+        ],
+        max_workers=2,
+        backend=backend,
+    )
+
+    assert [None if r is None else r["Trial ID"][0] for r in results] == [
+        "a",
+        None,
+        "c",
+    ]
+
+
+@pytest.mark.parametrize("backend", ["serial", "thread", "process"])
+def test_run_pipelines_stops_on_required_failure(backend):
+    """A failing pipeline that isn't optional stops the run."""
+    with pytest.raises(PipelineError, match="'b'"):
+        run_pipelines(
+            [
+                StubPipeline("a", fail=True, optional=True),
+                StubPipeline("b", fail=True),
+            ],
+            max_workers=2,
+            backend=backend,
+        )
+
+
+def test_run_pipelines_rejects_unknown_backend():
+    """The backend must be one of BACKENDS."""
+    with pytest.raises(ValueError, match="Unknown backend"):
+        run_pipelines([StubPipeline("a")], backend="cluster")
@@ -0,0 +1,57 @@
+"""Tests for reading worksheets through shared handles and the cache."""
+import os
+
+import pandas as pd
+import pytest
+from workbooks import (
+    cache_settings,
+    close_workbooks,
+    configure_cache,
+    read_excel,
+)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """Sends cache entries to a temporary directory for one test."""
+    settings = cache_settings()
+    configure_cache(cache_dir=tmp_path / "cache")
+    yield tmp_path / "cache"
+    close_workbooks()
+    configure_cache(**settings)
+
+
+def write_workbook(path, value):
+    pd.DataFrame({"a": [value]}).to_excel(path, index=False)
+    # Files rewritten within the filesystem's timestamp resolution keep
+    # their mtime, so move it on explicitly
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9 * value))
+
+
+@pytest.mark.parametrize("enabled", [True, False])
+def test_read_excel_sees_edited_workbook(tmp_path, cache, enabled):
+    """Editing a workbook between reads in one process is not missed."""
+    configure_cache(enabled=enabled)
+    path = tmp_path / "x.xlsx"
+    write_workbook(path, 1)
+    assert read_excel(path)["a"].tolist() == [1]
+
+    write_workbook(path, 2)
+
+    assert read_excel(path)["a"].tolist() == [2]
+    close_workbooks()
+    assert read_excel(path)["a"].tolist() == [2]
+
+
+def test_read_excel_reparses_corrupt_entries(tmp_path, cache):
+    """A truncated cache entry is replaced rather than failing the read."""
+    path = tmp_path / "x.xlsx"
+    write_workbook(path, 1)
+    read_excel(path)
+    (entry,) = cache.iterdir()
+    entry.write_bytes(entry.read_bytes()[:10])
+
+    assert read_excel(path)["a"].tolist() == [1]
+    assert read_excel(path)["a"].tolist() == [1]
+    assert entry.stat().st_size > 10